@@ -0,0 +1,77 @@
+"""Measure the cost of MessageBuffer.append as garbage accumulates."""
+
+import logging
+import random
+import statistics
+import time
+
+from juliet.message import DEFAULT_MAX_BUF_LEN, MessageBuffer, msg_frame_re
+
+BLOCK_SIZE = 4 * 1024
+
+logging.basicConfig(level=logging.FATAL)
+
+
+# the original bytes / regex implementation, for comparison
+class LegacyBuffer:
+    def __init__(self, maxlen=DEFAULT_MAX_BUF_LEN):
+        self.buffer = b""
+        self.maxlen = maxlen
+
+    def append(self, data):
+        self.buffer += data
+
+        match = msg_frame_re.search(self.buffer)
+
+        while match:
+            self.buffer = self.buffer[match.end() :]
+            match = msg_frame_re.search(self.buffer)
+
+        if len(self.buffer) > self.maxlen:
+            self.buffer = self.buffer[-self.maxlen :]
+
+
+def noise(rand, length):
+    # printable junk (similar to stray GPS sentences) with the odd marker
+    alphabet = b"$GPRMC,0123456789.ABCDEFNSWE*<>"
+    return bytes(rand.choice(alphabet) for _ in range(length))
+
+
+def run(factory, garbage, label, blocks=32):
+    rand = random.Random(42)
+    msgbuf = factory()
+
+    # the worst case: an unterminated frame start followed by junk...
+    msgbuf.append(b">>0:FFFF:bench:20210319143703:")
+
+    filler = bytes(rand.choice(b"abcdefghijklmnop") for _ in range(BLOCK_SIZE))
+
+    if garbage > 0:
+        msgbuf.append(filler * (garbage // BLOCK_SIZE))
+
+    block = noise(rand, BLOCK_SIZE)
+    timings = []
+
+    for _ in range(blocks):
+        for data in (filler, block):
+            start = time.perf_counter()
+            msgbuf.append(data)
+            timings.append(time.perf_counter() - start)
+
+    per_append = statistics.median(timings) * 1e6
+
+    print(
+        f"{label:>8} garbage={garbage:>8} buffer={len(msgbuf.buffer):>8} {per_append:10.1f} us/append"
+    )
+
+    return per_append
+
+
+def main():
+    for garbage in (0, 64 * 1024, 1024 * 1024, 4 * 1024 * 1024):
+        run(LegacyBuffer, garbage, "legacy")
+        run(MessageBuffer, garbage, "current")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Compare the bytes on air for each text encoding over a sample chat corpus."""
+
+import logging
+
+from juliet.message import (
+    ChannelMessage,
+    CompressedTextMessage,
+    DeflateChannelMessage,
+    DeflateTextMessage,
+    TextMessage,
+    select_shortest,
+)
+
+logging.basicConfig(level=logging.FATAL)
+
+CORPUS = [
+    "hi",
+    "73",
+    "CQ CQ CQ de W0JHX",
+    "good morning everyone",
+    "anyone on frequency this morning?",
+    "roger that, see you on the air tonight",
+    "checking in from the EOC, standing by for traffic",
+    "net control, W0JHX checking in with no traffic",
+    "What are the conditions like on 20m today?",
+    "the repeater is down for maintenance until Saturday afternoon",
+    "I'm monitoring the simplex frequency if anyone needs a relay",
+    "thanks for the report, you're 5 by 9 here -- loud and clear",
+    "weather update: heavy snow expected tomorrow, roads are closed north of town",
+    "shelter at the high school is open and has power, bring blankets if you can",
+    "Does anybody know if the Winlink gateway on the hill is back up yet?",
+]
+
+
+def average(sizes):
+    return sum(sizes) / len(sizes)
+
+
+def main():
+    encodings = {
+        "plain": lambda text: TextMessage(text, sender="W0JHX"),
+        "zlib+b64": lambda text: CompressedTextMessage(text, sender="W0JHX"),
+        "zdict+b85": lambda text: DeflateTextMessage(text, sender="W0JHX"),
+        "channel": lambda text: ChannelMessage(text, "#CQCQCQ", sender="W0JHX"),
+        "channel+zdict": lambda text: DeflateChannelMessage(
+            text, "#CQCQCQ", sender="W0JHX"
+        ),
+        "shortest": lambda text: select_shortest(
+            TextMessage(text, sender="W0JHX"), DeflateTextMessage(text, sender="W0JHX")
+        ),
+    }
+
+    baseline = average(
+        [len(TextMessage(text, sender="W0JHX").pack()) for text in CORPUS]
+    )
+
+    for name, encode in encodings.items():
+        sizes = [len(encode(text).pack()) for text in CORPUS]
+        avg = average(sizes)
+
+        print(
+            f"{name:>14}  avg {avg:6.1f} bytes  max {max(sizes):4d} bytes  "
+            f"({avg / baseline * 100:5.1f}% of plain)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Measure message history writes and queries with millions of stored messages."""
+
+import logging
+import os
+import random
+import string
+import tempfile
+import time
+
+from juliet.capture import Direction
+from juliet.history import MessageHistory
+
+ROWS = 2_000_000
+
+CHANNELS = [f"#net{idx}" for idx in range(20)]
+SENDERS = [f"W{idx}ABC" for idx in range(500)]
+
+# one message every few seconds, so the history covers a few months
+START_TIME = 1616112000
+STEP = 4
+
+REPEATS = 7
+
+logging.basicConfig(level=logging.FATAL)
+
+
+class HistoryClock:
+    def __init__(self, start):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+
+def fill(history, clock, rand):
+    words = ["".join(rand.choices(string.ascii_lowercase, k=5)) for _ in range(64)]
+
+    start = time.perf_counter()
+
+    for idx in range(ROWS):
+        content = " ".join(rand.choices(words, k=8))
+        direction = Direction.XMIT if idx % 4 == 0 else Direction.RECV
+
+        # record() never waits on the disk; if the writer falls behind,
+        # messages are dropped (and counted), so pace the producer instead
+        while history.depth >= history.maxsize // 2:
+            time.sleep(0.001)
+
+        history.record(
+            direction, rand.choice(CHANNELS), rand.choice(SENDERS), content, "vhf"
+        )
+        clock.now += STEP
+
+    history.flush()
+
+    return time.perf_counter() - start
+
+
+# the best time (in milliseconds) for a query
+def best_time(query):
+    timings = []
+
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        rows = query()
+        timings.append(time.perf_counter() - start)
+
+    return min(timings) * 1000, len(rows)
+
+
+def main():
+    rand = random.Random(1621)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "history.db")
+        clock = HistoryClock(START_TIME)
+        history = MessageHistory(path, clock=clock)
+
+        elapsed = fill(history, clock, rand)
+        stats = history.stats()
+
+        print(
+            f"recorded {stats['recorded']} messages in {elapsed:0.1f} s "
+            f"({stats['recorded'] / elapsed:0.0f}/s, {stats['dropped']} dropped, "
+            f"{os.path.getsize(path) / 1024 / 1024:0.0f} MiB)"
+        )
+
+        end = clock.now
+
+        queries = {
+            "history #net7 50": lambda: history.recent("#net7", 50),
+            "history #net7 100": lambda: history.recent("#net7", 100),
+            "sender W42ABC 50": lambda: history.by_sender("W42ABC", 50),
+            "since 10m": lambda: history.visible_since(
+                end - 600, CHANNELS[:5], "W42ABC", limit=101
+            ),
+            "since 1d": lambda: history.visible_since(
+                end - 86400, CHANNELS[:5], "W42ABC", limit=101
+            ),
+            "since 10m #net7": lambda: history.since(end - 600, "#net7", limit=101),
+            "since 30d #net7": lambda: history.since(
+                end - 30 * 86400, "#net7", limit=101
+            ),
+        }
+
+        for name, query in queries.items():
+            elapsed, count = best_time(query)
+            print(f"{name:<20} {elapsed:8.3f} ms  ({count} rows)")
+
+        history.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Measure send and receive latency for each radio transport over a pty pair."""
+
+import logging
+import os
+import select
+import statistics
+import threading
+import time
+import tty
+
+from juliet.radio import RECV_BLOCK_SIZE, RadioAsync, RadioComm
+
+logging.basicConfig(level=logging.FATAL)
+
+ROUNDS = 10
+FRAME = b">>0:1234:bench:20210319143703:hello world:<<"
+
+
+# the original serial worker, with reads and writes sharing a single lock
+class LegacyRadioComm(RadioComm):
+    def __init__(self, *args, **kwargs):
+        self.comm_lock = threading.Lock()
+
+        super().__init__(*args, **kwargs)
+
+        write = self.comm.write
+
+        def locked_write(data):
+            with self.comm_lock:
+                return write(data)
+
+        self.comm.write = locked_write
+
+    def _read_available(self):
+        with self.comm_lock:
+            return self.comm.read(RECV_BLOCK_SIZE)
+
+
+def read_exactly(fd, size):
+    data = b""
+
+    while len(data) < size:
+        select.select([fd], [], [])
+        data += os.read(fd, size - len(data))
+
+    return data
+
+
+# time from send() until the bytes can be read on the other end
+def xmit_latency(radio, master):
+    samples = []
+
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        radio.send(FRAME)
+        read_exactly(master, len(FRAME))
+        samples.append(time.perf_counter() - start)
+
+    return samples
+
+
+# time from writing bytes on the other end until on_recv fires
+def recv_latency(radio, master):
+    samples = []
+    received = threading.Event()
+
+    def on_recv(radio, data):
+        received.set()
+
+    radio.on_recv += on_recv
+
+    for _ in range(ROUNDS):
+        received.clear()
+
+        start = time.perf_counter()
+        os.write(master, FRAME)
+        received.wait()
+        samples.append(time.perf_counter() - start)
+
+    radio.on_recv -= on_recv
+
+    return samples
+
+
+def report(name, direction, samples):
+    median = statistics.median(samples) * 1e3
+    worst = max(samples) * 1e3
+
+    print(f"{name:>10} {direction}  median {median:8.2f} ms  max {worst:8.2f} ms")
+
+
+def main():
+    for name, radio_class in [
+        ("legacy", LegacyRadioComm),
+        ("thread", RadioComm),
+        ("async", RadioAsync),
+    ]:
+        master, slave = os.openpty()
+        tty.setraw(master)
+
+        radio = radio_class(os.ttyname(slave), xmit_rate=1e9, xmit_gap=0)
+
+        try:
+            report(name, "xmit", xmit_latency(radio, master))
+            report(name, "recv", recv_latency(radio, master))
+        finally:
+            radio.close()
+            os.close(slave)
+            os.close(master)
+
+
+if __name__ == "__main__":
+    main()
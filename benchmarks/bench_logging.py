@@ -0,0 +1,102 @@
+"""Compare receive throughput with debug logging turned off and on."""
+
+import logging
+import os
+import random
+import time
+
+import irc.bot
+
+from juliet import Juliet
+from juliet.message import FileMessage, MessageBuffer, TextMessage
+from juliet.radio import RadioLoop
+
+CHUNK_SIZE = 64
+
+
+def configure_logging(level):
+    root = logging.getLogger()
+
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+
+    # formatting still happens; the output is thrown away
+    handler = logging.StreamHandler(open(os.devnull, "w"))
+    handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+
+    root.addHandler(handler)
+    root.setLevel(level)
+
+
+def chunks(data, size=CHUNK_SIZE):
+    return [data[idx : idx + size] for idx in range(0, len(data), size)]
+
+
+# a large frame arriving a few bytes at a time, as from a serial port
+def large_frame():
+    # random text does not compress, so the frame stays large
+    content = random.Random(1621).randbytes(128 * 1024).hex()
+    frame = FileMessage(content, filename="bench.txt").pack()
+    parts = chunks(frame)
+
+    def run():
+        msgbuf = MessageBuffer()
+
+        for part in parts:
+            msgbuf.append(part)
+
+    return run, len(frame)
+
+
+# many short frames through the bot's receive path
+def radio_recv():
+    jules = Juliet("bench", RadioLoop(), "localhost")
+    jules.channels["#bench"] = irc.bot.Channel()
+
+    class NullConnection:
+        def notice(self, target, text):
+            pass
+
+    jules.connection = NullConnection()
+
+    frames = b"".join(TextMessage(f"message {idx}").pack() for idx in range(500))
+    parts = chunks(frames)
+
+    def run():
+        jules.msgbuf.reset()
+        jules.msgbuf.dedup.clear()
+
+        for part in parts:
+            jules.radio.on_recv(jules.radio, part)
+
+    return run, len(frames)
+
+
+def measure(setup, level, repeat=3):
+    configure_logging(level)
+
+    run, size = setup()
+    best = None
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return size / best / 1024
+
+
+def main():
+    for name, setup in (("large frame", large_frame), ("radio recv", radio_recv)):
+        quiet = measure(setup, logging.WARNING)
+        debug = measure(setup, logging.DEBUG)
+
+        print(
+            f"{name:<12} warning: {quiet:10.1f} KiB/s  debug: {debug:10.1f} KiB/s  "
+            f"({quiet / debug:0.1f}x slower)"
+        )
+
+
+if __name__ == "__main__":
+    main()
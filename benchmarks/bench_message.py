@@ -0,0 +1,105 @@
+"""Measure the memory used by each message and the cost of pack / unpack."""
+
+import gc
+import logging
+import timeit
+import tracemalloc
+
+from juliet.message import ChannelMessage, Message
+
+COUNT = 10000
+
+logging.basicConfig(level=logging.FATAL)
+
+
+def frames():
+    return [
+        ChannelMessage(f"message {idx}", channel="#CQCQCQ", sender="W0JHX").pack()
+        for idx in range(COUNT)
+    ]
+
+
+# the average number of bytes held by each object built by the factory
+def memory_per_object(factory):
+    gc.collect()
+    tracemalloc.start()
+
+    before = tracemalloc.get_traced_memory()[0]
+    objects = factory()
+    after = tracemalloc.get_traced_memory()[0]
+
+    tracemalloc.stop()
+
+    size = (after - before) / len(objects)
+    del objects
+
+    return size
+
+
+def unpacked(data, load=False):
+    def build():
+        msgs = [Message.unpack(frame) for frame in data]
+
+        if load:
+            for msg in msgs:
+                msg.load()
+
+        return msgs
+
+    return build
+
+
+def rate(stmt, number=COUNT):
+    best = min(timeit.repeat(stmt, number=1, repeat=5))
+    return number / best
+
+
+def created():
+    return [
+        ChannelMessage(f"message {idx}", channel="#CQCQCQ", sender="W0JHX")
+        for idx in range(COUNT)
+    ]
+
+
+def create():
+    for _ in range(COUNT):
+        ChannelMessage("hello world", channel="#CQCQCQ", sender="W0JHX")
+
+
+def pack(msg):
+    return lambda: [msg.pack() for _ in range(COUNT)]
+
+
+def unpack(frame):
+    return lambda: [Message.unpack(frame) for _ in range(COUNT)]
+
+
+def unpack_load(frame):
+    return lambda: [Message.unpack(frame).load() for _ in range(COUNT)]
+
+
+def unpack_timestamp(frame):
+    return lambda: [Message.unpack(frame).timestamp for _ in range(COUNT)]
+
+
+def main():
+    data = frames()
+    sample = data[0]
+
+    print("memory per message (bytes, including content strings):")
+    print(f"  created          {memory_per_object(created):8.0f}")
+    print(f"  unpacked (lazy)  {memory_per_object(unpacked(data)):8.0f}")
+    print(f"  unpacked+loaded  {memory_per_object(unpacked(data, True)):8.0f}")
+
+    msg = ChannelMessage("hello world", channel="#CQCQCQ", sender="W0JHX")
+
+    print("throughput (messages per second):")
+    print(f"  create           {rate(create):10.0f}")
+    print(f"  pack             {rate(pack(msg)):10.0f}")
+    print(f"  unpack           {rate(unpack(sample)):10.0f}")
+    print(f"  unpack+load      {rate(unpack_load(sample)):10.0f}")
+    print(f"  unpack+timestamp {rate(unpack_timestamp(sample)):10.0f}")
+
+
+if __name__ == "__main__":
+    main()
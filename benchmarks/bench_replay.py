@@ -0,0 +1,90 @@
+"""Measure how long it takes to replay a day of captured radio traffic."""
+
+import logging
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from juliet.capture import CaptureSink, Direction
+from juliet.message import ChannelMessage
+from juliet.replay import Replay
+from juliet.sim import gps_sentence
+
+# a channel that is busy all day at 1200 baud (120 bytes per second)
+DAY_BYTES = 120 * 24 * 60 * 60
+
+# bytes per read, as from a serial port
+READ_SIZE = 64
+
+logging.basicConfig(level=logging.FATAL)
+
+
+class ReplayClock:
+    def __init__(self, start):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+
+def write_day(path, rand):
+    clock = ReplayClock(1616112000.0)
+    capture = CaptureSink(path, clock=clock)
+
+    written = 0
+    idx = 0
+
+    while written < DAY_BYTES:
+        tstamp = datetime.fromtimestamp(clock.now, tz=timezone.utc)
+
+        msg = ChannelMessage(
+            f"message {idx} from the field", channel="#CQCQCQ", timestamp=tstamp
+        )
+        data = msg.pack()
+
+        if rand.random() < 0.2:
+            data += gps_sentence(rand)
+
+        for offset in range(0, len(data), READ_SIZE):
+            chunk = data[offset : offset + READ_SIZE]
+            capture.write(Direction.RECV, chunk)
+            clock.now += len(chunk) / 120
+
+        written += len(data)
+        idx += 1
+
+    capture.close()
+
+    return idx
+
+
+def main():
+    rand = random.Random(1621)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "day.cap")
+
+        start = time.perf_counter()
+        frames = write_day(path, rand)
+        elapsed = time.perf_counter() - start
+
+        size = os.path.getsize(path)
+        print(
+            f"wrote {frames} frames / {size / 1024 / 1024:0.1f} MiB in {elapsed:0.1f} s"
+        )
+
+        for dedup in (False, True):
+            stats = Replay(dedup=dedup).run([path])
+            total = sum(stats.messages.values())
+
+            print(
+                f"replay (dedup={dedup!s:<5}) {stats.records} records "
+                f"{total} messages in {stats.elapsed:0.2f} s "
+                f"({stats.throughput / 1024 / 1024:0.2f} MiB/s)"
+            )
+
+
+if __name__ == "__main__":
+    main()
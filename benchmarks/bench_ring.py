@@ -0,0 +1,96 @@
+"""Compare MessageBuffer and RingMessageBuffer on speed and memory use."""
+
+import logging
+import random
+import string
+import time
+import tracemalloc
+
+from juliet.message import MessageBuffer, RingMessageBuffer, TextMessage
+from juliet.radio import RECV_BLOCK_SIZE
+from juliet.sim import gps_sentence
+
+# bytes per append: a slow serial port, and a full block from RadioAsync
+READ_SIZES = (64, RECV_BLOCK_SIZE)
+
+REPEATS = 7
+
+logging.basicConfig(level=logging.FATAL)
+
+
+def make_stream(content_size, count, rand):
+    parts = []
+
+    for _ in range(count):
+        content = "".join(rand.choices(string.ascii_letters, k=content_size))
+        parts.append(TextMessage(content).pack())
+        parts.append(gps_sentence(rand))
+
+    return b"".join(parts)
+
+
+def receive(factory, chunks):
+    msgbuf = factory()
+    received = []
+
+    msgbuf.on_message += lambda mbuf, msg: received.append(msg.sender)
+
+    start = time.perf_counter()
+
+    for chunk in chunks:
+        msgbuf.append(chunk)
+
+    return time.perf_counter() - start, len(received)
+
+
+def peak_memory(factory, chunks):
+    msgbuf = factory()
+    msgbuf.on_message += lambda mbuf, msg: None
+
+    tracemalloc.start()
+
+    for chunk in chunks:
+        msgbuf.append(chunk)
+
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return peak
+
+
+def compare(buffers, stream, content_size, read_size):
+    chunks = [stream[idx : idx + read_size] for idx in range(0, len(stream), read_size)]
+    total = len(stream)
+
+    # alternate between the buffers so that both see the same conditions
+    timings = {name: [] for name, _ in buffers}
+
+    for _ in range(REPEATS):
+        for name, factory in buffers:
+            timings[name].append(receive(factory, chunks)[0])
+
+    for name, factory in buffers:
+        elapsed = min(timings[name])
+        peak = peak_memory(factory, chunks)
+
+        print(
+            f"content={content_size:>6} read={read_size:>5} {name:<7} "
+            f"{total / elapsed / 1024 / 1024:6.2f} MiB/s  "
+            f"peak {peak / 1024:8.1f} KiB"
+        )
+
+
+def main():
+    rand = random.Random(1621)
+
+    buffers = [("buffer", MessageBuffer), ("ring", RingMessageBuffer)]
+
+    for content_size, count in ((64, 20000), (1024, 2000), (16384, 200)):
+        stream = make_stream(content_size, count, rand)
+
+        for read_size in READ_SIZES:
+            compare(buffers, stream, content_size, read_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Compare the regex frame parser with split_frame for various frame sizes."""
+
+import logging
+import timeit
+from datetime import datetime, timezone
+
+from juliet.message import TextMessage, packed_msg_re, parse_timestamp, split_frame
+
+logging.basicConfig(level=logging.FATAL)
+
+SIZES = [50, 1024, 64 * 1024, 1024 * 1024]
+
+
+# the original parsing steps from Message.unpack
+def legacy_parse(data):
+    text = str(data, "utf-8")
+    match = packed_msg_re.match(text)
+
+    version = int(match.group("ver"), 16)
+    crc = int(match.group("crc"), 16)
+    tstamp = datetime.strptime(match.group("time"), "%Y%m%d%H%M%S")
+    tstamp = tstamp.replace(tzinfo=timezone.utc)
+
+    return (version, crc, match.group("sender"), tstamp, match.group("msg"))
+
+
+def current_parse(data):
+    ver, crc, sender, tstamp, content, sig = split_frame(data)
+
+    version = int(ver, 16)
+    crc = int(crc, 16)
+    tstamp = parse_timestamp(tstamp)
+
+    return (version, crc, sender, tstamp, str(content, "utf-8"))
+
+
+def make_frame(size):
+    msg = TextMessage("x", sender="bench")
+    overhead = len(msg.pack()) - 1
+
+    msg.content = ("lorem ipsum dolor sit amet " * (size // 27 + 1))[: size - overhead]
+    return msg.pack()
+
+
+def main():
+    for size in SIZES:
+        frame = make_frame(size)
+        number = max(10, 200000 // size)
+
+        legacy = timeit.timeit(lambda f=frame: legacy_parse(f), number=number)
+        current = timeit.timeit(lambda f=frame: current_parse(f), number=number)
+
+        legacy = legacy / number * 1e6
+        current = current / number * 1e6
+
+        print(
+            f"{len(frame):>8} bytes  legacy {legacy:10.1f} us  "
+            f"current {current:10.1f} us  ({legacy / current:5.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,389 @@
+"""Run the benchmark suite and compare the results against a stored baseline.
+
+Results are written as JSON (seconds per operation for each case).  When a baseline
+is given, any case that is slower than the baseline by more than the threshold is
+reported as a regression and the script exits with an error; cases that are not in the
+baseline are listed, but do not fail the run.  Comparisons use the best of several
+repeats, which is the least sensitive to other activity on the machine.
+
+    python benchmarks/suite.py --output results.json --baseline benchmarks/baseline.json
+    python benchmarks/suite.py --save-baseline benchmarks/baseline.json
+"""
+
+import argparse
+import fnmatch
+import json
+import logging
+import platform
+import random
+import statistics
+import sys
+import time
+import timeit
+from datetime import datetime, timezone
+
+import irc.client
+
+from juliet import Juliet, __version__
+from juliet.crc import CRC16_BACKEND, checksum, crc16
+from juliet.message import (
+    ChannelMessage,
+    CompressedTextMessage,
+    DeflateChannelMessage,
+    DeflateTextMessage,
+    FileMessage,
+    Message,
+    MessageBuffer,
+    RingMessageBuffer,
+    TextMessage,
+    char_escape,
+    char_unescape,
+    make_safe_filename,
+    message_types,
+)
+from juliet.radio import RadioLoop
+from juliet.reliable import AckMessage, SequencedMessage
+from juliet.sim import gps_sentence
+from juliet.transfer import FragmentMessage, ResendMessage
+
+logging.basicConfig(level=logging.FATAL)
+
+DEFAULT_THRESHOLD = 0.25
+
+# each case is timed for at least this long per repeat
+MIN_TIME = 0.05
+REPEATS = 5
+
+# regressions are timed again this many times before they are reported
+RECHECKS = 2
+
+CRC_SIZES = [16, 256, 4 * 1024, 64 * 1024]
+
+TEXT = "good morning everyone, checking in from the EOC with no traffic"
+
+# text with protocol characters that must be escaped
+PROTOCOL_TEXT = "net control: <W0JHX> 50% of stations checked in\r\nnext net: 19:00"
+
+benchmarks = {}
+
+
+# register a benchmark; the function returns the callable to time
+def benchmark(name):
+    def register(func):
+        benchmarks[name] = func
+        return func
+
+    return register
+
+
+# a sample message for each registered version
+def sample_messages():
+    frame = TextMessage(TEXT, sender="W0JHX").pack()
+
+    samples = [
+        TextMessage(TEXT, sender="W0JHX"),
+        CompressedTextMessage(TEXT, sender="W0JHX"),
+        DeflateTextMessage(TEXT, sender="W0JHX"),
+        ChannelMessage(TEXT, "#CQCQCQ", sender="W0JHX"),
+        DeflateChannelMessage(TEXT, "#CQCQCQ", sender="W0JHX"),
+        FileMessage(TEXT * 16, filename="notes.txt", sender="W0JHX"),
+        FragmentMessage(
+            "aGVsbG8gd29ybGQ=", "0a1b2c3d", 0, 4, "notes.txt", "text/plain"
+        ),
+        ResendMessage("0a1b2c3d", [1, 2, 3, 7]),
+        SequencedMessage.wrap(frame, "W0JHX", 42, base=40, acks={"KD0ABC": (7, [9])}),
+        AckMessage("W0JHX", {"KD0ABC": (7, [9, 10])}),
+    ]
+
+    covered = {type(msg) for msg in samples}
+    missing = set(message_types.values()) - covered
+
+    if missing:
+        raise RuntimeError(f"no benchmark sample for {missing}")
+
+    return samples
+
+
+def make_stream(frames, noise, seed=1621):
+    rand = random.Random(seed)
+    parts = []
+
+    for frame in frames:
+        if noise:
+            parts.append(gps_sentence(rand))
+
+        parts.append(frame)
+
+    return b"".join(parts)
+
+
+def register_crc():
+    rand = random.Random(1621)
+
+    for size in CRC_SIZES:
+        data = bytes(rand.getrandbits(8) for _ in range(size))
+
+        benchmark(f"crc16/{size}")(lambda data=data: lambda: crc16(data))
+
+    parts = ("W0JHX", "20210319143703", TEXT, None)
+    benchmark("checksum/frame")(lambda: lambda: checksum(*parts))
+
+
+def register_messages():
+    for msg in sample_messages():
+        name = type(msg).__name__
+        packed = msg.pack()
+
+        benchmark(f"pack/{msg.version}-{name}")(lambda msg=msg: msg.pack)
+
+        # reading the content as well, since some messages (e.g. deflated
+        # channel messages) only decode it when it is used
+        def unpack(packed=packed):
+            msg = Message.unpack(packed)
+            msg.load()
+            return msg.content
+
+        benchmark(f"unpack/{msg.version}-{name}")(lambda unpack=unpack: unpack)
+
+
+@benchmark("roundtrip/compressed")
+def compressed_roundtrip():
+    def run():
+        Message.unpack(CompressedTextMessage(TEXT).pack()).load()
+
+    return run
+
+
+@benchmark("roundtrip/deflate")
+def deflate_roundtrip():
+    def run():
+        Message.unpack(DeflateTextMessage(TEXT).pack()).load()
+
+    return run
+
+
+def register_escape():
+    for name, text in (("plain", TEXT), ("protocol", PROTOCOL_TEXT)):
+        escaped = char_escape(text)
+
+        benchmark(f"escape/{name}")(lambda text=text: lambda: char_escape(text))
+        benchmark(f"unescape/{name}")(
+            lambda escaped=escaped: lambda: char_unescape(escaped)
+        )
+
+    benchmark("filename/safe")(lambda: lambda: make_safe_filename("field_notes-2.txt"))
+    benchmark("filename/unsafe")(
+        lambda: lambda: make_safe_filename("../field notes: <draft> (2).txt")
+    )
+
+
+def buffer_append(noise, factory=MessageBuffer):
+    frames = [TextMessage(f"{TEXT} {idx}").pack() for idx in range(64)]
+    stream = make_stream(frames, noise)
+
+    # deliver the stream in pieces, as a serial port would
+    chunks = [stream[idx : idx + 61] for idx in range(0, len(stream), 61)]
+
+    def run():
+        msgbuf = factory()
+
+        for chunk in chunks:
+            msgbuf.append(chunk)
+
+    return run
+
+
+benchmark("buffer/clean")(lambda: buffer_append(noise=False))
+benchmark("buffer/noisy")(lambda: buffer_append(noise=True))
+benchmark("buffer/ring-clean")(
+    lambda: buffer_append(noise=False, factory=RingMessageBuffer)
+)
+benchmark("buffer/ring-noisy")(
+    lambda: buffer_append(noise=True, factory=RingMessageBuffer)
+)
+
+
+class NullConnection:
+    def notice(self, target, text):
+        pass
+
+    def privmsg(self, target, text):
+        pass
+
+
+# IRC message => radio => received message, over a loopback radio
+@benchmark("e2e/pubmsg-loopback")
+def pubmsg_loopback():
+    jules = Juliet("bench", RadioLoop(), "localhost")
+    jules.connection = NullConnection()
+    jules.channels["#cqcqcq"] = irc.bot.Channel()
+
+    source = irc.client.NickMask("W0JHX!w0jhx@localhost")
+    counter = iter(range(1 << 62))
+
+    def run():
+        # vary the text so that the dedup cache does not drop the message
+        text = f"{TEXT} {next(counter)}"
+        event = irc.client.Event("pubmsg", source, "#cqcqcq", [text])
+        jules.on_pubmsg(jules.connection, event)
+
+    return run
+
+
+register_crc()
+register_messages()
+register_escape()
+
+
+def time_case(func):
+    timer = timeit.Timer(func)
+    number, elapsed = timer.autorange()
+
+    while elapsed < MIN_TIME:
+        number *= 2
+        elapsed = timer.timeit(number)
+
+    samples = [elapsed / number]
+    samples.extend(t / number for t in timer.repeat(REPEATS - 1, number))
+
+    return {
+        "median": statistics.median(samples),
+        "min": min(samples),
+        "number": number,
+    }
+
+
+def run_suite(pattern="*"):
+    results = {}
+
+    for name, setup in benchmarks.items():
+        if not fnmatch.fnmatch(name, pattern):
+            continue
+
+        results[name] = time_case(setup())
+
+    return {
+        "meta": {
+            "version": __version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "crc_backend": CRC16_BACKEND,
+            "timestamp": datetime.now(tz=timezone.utc).isoformat(),
+        },
+        "results": results,
+    }
+
+
+# returns a list of (name, baseline, current, change) for cases over threshold
+def compare(report, baseline, threshold):
+    regressions = []
+
+    for name, result in report["results"].items():
+        base = baseline["results"].get(name)
+
+        if base is None:
+            continue
+
+        change = result["min"] / base["min"] - 1
+
+        if change > threshold:
+            regressions.append((name, base["min"], result["min"], change))
+
+    return regressions
+
+
+# cases that were run but are not in the baseline (so cannot be compared)
+def missing_baseline(report, baseline):
+    return [name for name in report["results"] if name not in baseline["results"]]
+
+
+# time suspect cases again, in case the first run was disturbed
+def recheck(report, baseline, threshold):
+    regressions = compare(report, baseline, threshold)
+
+    for _ in range(RECHECKS):
+        if not regressions:
+            break
+
+        for name, *_ in regressions:
+            result = report["results"][name]
+            result["min"] = min(result["min"], time_case(benchmarks[name]())["min"])
+
+        regressions = compare(report, baseline, threshold)
+
+    return regressions
+
+
+def print_report(report, baseline=None):
+    for name, result in report["results"].items():
+        line = f"{name:<40} {result['min'] * 1e6:12.2f} us"
+        line += f"  (median {result['median'] * 1e6:0.2f} us)"
+
+        if baseline is not None:
+            base = baseline["results"].get(name)
+
+            if base is None:
+                line += "  (no baseline)"
+            else:
+                line += f"  {(result['min'] / base['min'] - 1) * 100:+6.1f}%"
+
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+
+    parser.add_argument("--filter", default="*", help="run matching cases only")
+    parser.add_argument("--output", help="write the results to this file")
+    parser.add_argument("--baseline", help="compare against this baseline")
+    parser.add_argument("--save-baseline", help="write the results as a baseline")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="allowed slowdown before reporting a regression (0.25 = 25%%)",
+    )
+
+    args = parser.parse_args()
+
+    baseline = None
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+
+    start = time.perf_counter()
+    report = run_suite(args.filter)
+    regressions = []
+    missing = []
+
+    if baseline is not None:
+        regressions = recheck(report, baseline, args.threshold)
+        missing = missing_baseline(report, baseline)
+
+    elapsed = time.perf_counter() - start
+
+    print_report(report, baseline)
+    print(f"\n{len(report['results'])} case(s) in {elapsed:0.1f} s")
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as fp:
+                json.dump(report, fp, indent=2, sort_keys=True)
+                fp.write("\n")
+
+    # new cases are reported, but do not fail the run
+    for name in missing:
+        print(f"NO BASELINE {name}: save a new baseline to compare this case")
+
+    for name, base, current, change in regressions:
+        print(
+            f"REGRESSION {name}: {base * 1e6:0.2f} us => {current * 1e6:0.2f} us "
+            f"({change * 100:+0.1f}%)"
+        )
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,34 +3,219 @@
 # Licensed under the MIT License. See LICENSE for full terms.
 ##
 
+import functools
 import logging
+import threading
+import time
 
 import irc.bot
 
-from .message import ChannelMessage, MessageBuffer, TextMessage
+from .capture import Direction
+from .dedup import DedupCache
+from .event import Event
+from .gateway import DEFAULT_RADIO_NAME, RadioPort, RoutingTable
+from .history import format_entry, parse_since
+from .message import (
+    ChannelMessage,
+    DeflateChannelMessage,
+    DeflateTextMessage,
+    FileMessage,
+    MessageBuffer,
+    RingMessageBuffer,
+    TextMessage,
+    select_shortest,
+)
+from .metrics import NULL_REGISTRY
+from .trace import Dump
+from .transfer import (
+    DEFAULT_MAX_FILE_SIZE,
+    FragmentMessage,
+    Reassembler,
+    ResendMessage,
+    TransferSender,
+)
 from .version import __version__
+from .xmit import Priority
 
 __all__ = ["Juliet", "__version__"]
 
+# transmit priority for outgoing messages; messages are matched by type
+message_priority = {
+    TextMessage: Priority.DIRECT,
+    ChannelMessage: Priority.CHANNEL,
+    FileMessage: Priority.BULK,
+    FragmentMessage: Priority.BULK,
+    ResendMessage: Priority.CONTROL,
+}
+
+# how often (in seconds) to check for stalled file transfers
+TRANSFER_CHECK_INTERVAL = 10
+
+# streamed files wait for the radio queue to fall below this many frames
+STREAM_QUEUE_LIMIT = 16
+
+# the number of messages sent for a history request (by default, and at most)
+HISTORY_LINES = 20
+MAX_HISTORY_LINES = 100
+
+
+# the transmit priority for a message, from the first of its types (or base
+# types) that has one
+def get_priority(msg):
+    for msg_type in type(msg).__mro__:
+        if msg_type in message_priority:
+            return message_priority[msg_type]
+
+    return Priority.CHANNEL
+
+
+# Events => Handler Function
+#   on_file => func(juliet, file_msg)
+#
+# Juliet serves one or more radios (see add_radio), each with its own transmit
+# queue and message buffer.  every radio runs its own threads, so a slow port
+# does not hold up the others.  channels are carried on the radios given by the
+# routing table (or all of them) and frames heard on one radio may be relayed
+# to others.
+
 
 class Juliet(irc.bot.SingleServerIRCBot):
-    def __init__(self, nick, radio, server, port=6667, realname=None, channels=None):
+    def __init__(
+        self,
+        nick,
+        radio,
+        server,
+        port=6667,
+        realname=None,
+        channels=None,
+        download_dir=None,
+        max_file_size=DEFAULT_MAX_FILE_SIZE,
+        compress=True,
+        metrics=None,
+        ring_buffer=None,
+        radio_name=DEFAULT_RADIO_NAME,
+        routes=None,
+        relay=None,
+        history=None,
+    ):
         super().__init__([(server, port)], nick, realname or nick)
 
         self.auto_channels = channels
+        self.compress = compress
 
-        self.msgbuf = MessageBuffer()
-        self.msgbuf.on_message += self._handle_message
+        # a MessageHistory that records the messages relayed in each direction
+        # (None to keep no history)
+        self.history = history
+
+        if metrics is None:
+            metrics = NULL_REGISTRY
+
+        self.metrics = metrics
+        self.metric_recv_latency = metrics.histogram("juliet_recv_latency_seconds")
+
+        # channel names heard on the air are not used as labels, since any
+        # station could make the number of them grow without limit
+        self.metric_dropped = metrics.counter("juliet_dropped")
 
-        self.radio = radio
         self.logger = logging.getLogger(__name__).getChild("Juliet")
 
         if radio is None:
             raise ValueError("radio not specified")
 
+        # repeaters and multiple receivers often deliver the same frame twice;
+        # the cache is shared so that a frame heard on several radios (or
+        # relayed between them) is only handled once
+        self.dedup = DedupCache()
+        self.routes = RoutingTable(routes)
+
+        # ports by name and by radio, in the order they were added
+        self.ports = {}
+        self.radio_ports = {}
+
+        # the first radio is also available as self.radio (and its buffer as
+        # self.msgbuf) for code that only deals with one radio
+        port = self.add_radio(radio_name, radio, ring_buffer=ring_buffer, relay=relay)
+
+        self.radio = radio
+        self.msgbuf = port.msgbuf
+
+        # file transfers are sent in fragments and rebuilt as they arrive
+        self.transfers_out = TransferSender()
+        self.transfers_in = Reassembler(
+            download_dir=download_dir, max_file_size=max_file_size
+        )
+        self.on_file = Event()
+
+        self.reactor.scheduler.execute_every(
+            TRANSFER_CHECK_INTERVAL, self._check_transfers
+        )
+
+    # serve another radio; if a ring size is given, frames are parsed in place
+    # in a fixed ring.  frames heard on this radio are sent again on the radios
+    # named in relay (channel messages only where the channel is routed).
+    def add_radio(self, name, radio, compress=None, ring_buffer=None, relay=None):
+        if name in self.ports:
+            raise ValueError(f"radio name already in use: {name}")
+
+        if radio in self.radio_ports:
+            raise ValueError(f"radio already added: {name}")
+
+        if compress is None:
+            compress = self.compress
+
+        metrics = self.metrics.labeled(radio=name)
+
+        if ring_buffer is None:
+            msgbuf = MessageBuffer(dedup=self.dedup, metrics=metrics)
+        else:
+            msgbuf = RingMessageBuffer(ring_buffer, dedup=self.dedup, metrics=metrics)
+
+        port = RadioPort(name, radio, msgbuf, compress=compress, relay=relay)
+
+        msgbuf.on_message += functools.partial(self._handle_message, port)
+
+        if port.relay:
+            msgbuf.on_frame += functools.partial(self._relay_frame, port)
+
+        self.ports[name] = port
+        self.radio_ports[radio] = port
+
         radio.on_recv += self._radio_recv
         radio.on_xmit += self._radio_xmit
 
+        return port
+
+    def send_file(self, content, filename=None, mimetype=None):
+        fragments = self.transfers_out.fragment(
+            content, filename=filename, mimetype=mimetype, sender=self._nickname
+        )
+
+        for frag in fragments:
+            self._send_message(frag)
+
+        return fragments[0].transfer_id
+
+    # send a file from disk without loading it into memory; fragments are fed
+    # to the radio from a background thread as the transmit queue drains
+    def stream_file(self, path, filename=None, mimetype=None):
+        fragments = self.transfers_out.stream(
+            path, filename=filename, mimetype=mimetype, sender=self._nickname
+        )
+
+        thread = threading.Thread(
+            target=self._stream_worker, args=(fragments,), daemon=True
+        )
+        thread.start()
+
+        return thread
+
+    def _stream_worker(self, fragments):
+        for frag in fragments:
+            while self._queue_depth() > STREAM_QUEUE_LIMIT:
+                time.sleep(0.1)
+
+            self._send_message(frag)
+
     def on_nicknameinuse(self, conn, event):
         conn.nick(conn.get_nickname() + "_")
 
@@ -64,8 +249,17 @@ class Juliet(irc.bot.SingleServerIRCBot):
 
         msg = ChannelMessage(content=text, channel=channel, sender=sender)
 
-        data = msg.pack()
-        self.radio.send(data)
+        def compressed():
+            return DeflateChannelMessage(
+                content=text, channel=channel, sender=sender, timestamp=msg.epoch
+            )
+
+        if self.history is not None:
+            self.history.record(Direction.XMIT, channel, sender, text)
+
+        self._send_text(msg, compressed, self._routed_ports(channel))
+
+        self.metrics.counter("juliet_relayed", channel=channel, to="radio").inc()
 
     def on_dccmsg(self, conn, event):
         self.logger.debug("DCC [MSG] -- %s", event)
@@ -77,21 +271,139 @@ class Juliet(irc.bot.SingleServerIRCBot):
         self.logger.debug("DCC [CHAT] -- %s", event)
 
     def _radio_recv(self, radio, data):
-        self.logger.debug("[radio] << %s", data)
-        self.msgbuf.append(data)
+        port = self.radio_ports[radio]
+
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("[%s] << %s", port.name, Dump(data))
 
-    def _handle_message(self, mbuf, msg):
+        # messages are handled as the data is appended, so this is the start
+        # time for anything relayed from this chunk
+        port.recv_started = time.monotonic()
+        port.msgbuf.append(data)
+
+    # runs on the thread of the radio that received the message
+    def _handle_message(self, port, mbuf, msg):
         if isinstance(msg, ChannelMessage):
             if msg.channel in self.channels:
-                self.connection.notice(msg.channel, f"[{msg.sender}] {msg.content}")
+                # radios deliver messages on their own threads
+                with self.reactor.mutex:
+                    self.connection.notice(msg.channel, f"[{msg.sender}] {msg.content}")
+
+                self._relayed_to_irc(msg.channel, port)
+
+                if self.history is not None:
+                    self.history.record(
+                        Direction.RECV, msg.channel, msg.sender, msg.content, port.name
+                    )
             else:
                 self.logger.debug("not on channel %s; discarding", msg.channel)
+                self.metric_dropped.inc()
+
+        elif isinstance(msg, FragmentMessage):
+            file_msg = self.transfers_in.add(msg)
+
+            if file_msg is not None:
+                self.logger.info(
+                    "received file from %s -- %s", msg.sender, file_msg.filename
+                )
+                self.on_file(self, file_msg)
+
+        elif isinstance(msg, ResendMessage):
+            # the fragments are only missing on the radio that asked for them
+            for frag in self.transfers_out.resend(msg):
+                self._send_message(frag, ports=(port,))
 
         else:
             self.logger.debug("unsupported message %s; discarding", type(msg))
 
+    # send a new frame from one radio on to the radios it relays to; copies
+    # that come back are dropped by the shared dedup cache
+    def _relay_frame(self, port, mbuf, frame, msg):
+        channel = msg.channel if isinstance(msg, ChannelMessage) else None
+        data = None
+
+        for name in port.relay:
+            target = self.ports.get(name)
+
+            if target is None or target is port:
+                continue
+
+            if channel is not None and not self.routes.allows(channel, name):
+                continue
+
+            # the frame may be a view into the receive buffer
+            if data is None:
+                data = bytes(frame)
+
+            target.radio.send(data, priority=get_priority(msg))
+
+            self.metrics.counter(
+                "juliet_radio_relayed", source=port.name, radio=name
+            ).inc()
+
+    def _relayed_to_irc(self, channel, port):
+        self.metrics.counter("juliet_relayed", channel=channel, to="irc").inc()
+
+        if port.recv_started is not None:
+            self.metric_recv_latency.observe(time.monotonic() - port.recv_started)
+
+    # the ports that carry the given channel
+    def _routed_ports(self, channel):
+        return [
+            port
+            for port in self.ports.values()
+            if self.routes.allows(channel, port.name)
+        ]
+
+    # the most frames waiting to be sent on any radio
+    def _queue_depth(self):
+        return max(
+            (getattr(port.radio, "queue_depth", 0) for port in self.ports.values()),
+            default=0,
+        )
+
+    def _check_transfers(self):
+        self.transfers_in.expire()
+
+        for request in self.transfers_in.resend_requests(sender=self._nickname):
+            self.logger.debug(
+                "requesting %d fragment(s) -- %s",
+                len(request.missing),
+                request.transfer_id,
+            )
+            self._send_message(request)
+
+    # send a message on the given ports (or all of them)
+    def _send_message(self, msg, ports=None):
+        priority = get_priority(msg)
+        data = msg.pack()
+
+        if ports is None:
+            ports = self.ports.values()
+
+        for port in ports:
+            port.radio.send(data, priority=priority)
+
+    # send a text message on the given ports; compressed() builds the
+    # compressed version, which is used where it is shorter (and allowed)
+    def _send_text(self, msg, compressed, ports):
+        shortest = None
+
+        for port in ports:
+            if not port.compress:
+                self._send_message(msg, ports=(port,))
+                continue
+
+            if shortest is None:
+                shortest = select_shortest(msg, compressed())
+
+            self._send_message(shortest, ports=(port,))
+
     def _radio_xmit(self, radio, data):
-        self.logger.debug("[radio] >> %s", data)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            port = self.radio_ports.get(radio)
+            name = DEFAULT_RADIO_NAME if port is None else port.name
+            self.logger.debug("[%s] >> %s", name, Dump(data))
 
     def _do_command(self, conn, sender, cmd, params):
         self.logger.debug("handle command [%s] -- %s %s", sender, cmd, params)
@@ -113,11 +425,118 @@ class Juliet(irc.bot.SingleServerIRCBot):
             conn.part(channel)
 
         elif cmd == "xmit":
-            text = " ".join(params)
-            msg = TextMessage(content=text, sender=sender)
-            data = msg.pack()
-            self.radio.send(data)
-            conn.privmsg(sender, "Your message has been sent! 👍")
+            self._send_xmit(conn, sender, params)
+
+        elif cmd == "metrics":
+            self._send_metrics(conn, sender, params[0] if params else None)
+
+        elif cmd == "history":
+            self._send_history(conn, sender, params)
+
+        elif cmd == "since":
+            self._send_since(conn, sender, params)
 
         else:
             conn.privmsg(sender, f'Sorry, I don\'t understand "{cmd}" 😞')
+
+    # xmit <text> -- send a direct text message on every radio
+    def _send_xmit(self, conn, sender, params):
+        text = " ".join(params)
+        msg = TextMessage(content=text, sender=sender)
+
+        def compressed():
+            return DeflateTextMessage(content=text, sender=sender, timestamp=msg.epoch)
+
+        if self.history is not None:
+            self.history.record(Direction.XMIT, None, sender, text)
+
+        self._send_text(msg, compressed, self.ports.values())
+        conn.privmsg(sender, "Your message has been sent! 👍")
+
+    def _send_metrics(self, conn, sender, prefix=None):
+        if not self.metrics.enabled:
+            conn.privmsg(sender, "Metrics are not enabled.")
+            return
+
+        lines = self.metrics.summary(prefix)
+
+        if not lines:
+            conn.privmsg(sender, "No matching metrics.")
+
+        for line in lines:
+            conn.privmsg(sender, line)
+
+    # history is only shown for channels that we are on, to users who are also
+    # on them (channels we have left or that need a key stay private)
+    def _readable_channels(self, nick):
+        return [name for name, chan in self.channels.items() if chan.has_user(nick)]
+
+    def _can_read(self, channel, nick):
+        chan = self.channels.get(channel)
+        return chan is not None and chan.has_user(nick)
+
+    # history <#channel> [count] -- the most recent messages on a channel
+    def _send_history(self, conn, sender, params):
+        if self.history is None:
+            conn.privmsg(sender, "History is not enabled.")
+            return
+
+        try:
+            channel = params[0]
+            count = int(params[1]) if len(params) > 1 else HISTORY_LINES
+        except (IndexError, ValueError):
+            conn.privmsg(sender, "Usage: history <#channel> [count]")
+            return
+
+        if not self._can_read(channel, sender):
+            conn.privmsg(sender, f"You must be on {channel} to see its history.")
+            return
+
+        count = max(1, min(count, MAX_HISTORY_LINES))
+        entries = self.history.recent(channel, count)
+
+        if not entries:
+            conn.privmsg(sender, f"No history for {channel}.")
+
+        for entry in entries:
+            conn.privmsg(sender, format_entry(entry, channel=False))
+
+    # since <time> [#channel] -- messages since a time (see parse_since)
+    def _send_since(self, conn, sender, params):
+        if self.history is None:
+            conn.privmsg(sender, "History is not enabled.")
+            return
+
+        if not params:
+            conn.privmsg(sender, "Usage: since <time> [#channel]")
+            return
+
+        try:
+            tstamp = parse_since(params[0])
+        except ValueError:
+            conn.privmsg(sender, f'Sorry, I don\'t understand the time "{params[0]}"')
+            return
+
+        channel = params[1] if len(params) > 1 else None
+        limit = MAX_HISTORY_LINES + 1
+
+        if channel is not None and not self._can_read(channel, sender):
+            conn.privmsg(sender, f"You must be on {channel} to see its history.")
+            return
+
+        # without a channel, the channels the asker can read (and their own
+        # direct messages) are shown
+        if channel is None:
+            channels = self._readable_channels(sender)
+            entries = self.history.visible_since(tstamp, channels, sender, limit)
+        else:
+            entries = self.history.since(tstamp, channel, limit=limit)
+
+        if not entries:
+            conn.privmsg(sender, "No messages since then.")
+
+        for entry in entries[:MAX_HISTORY_LINES]:
+            conn.privmsg(sender, format_entry(entry, channel=channel is None))
+
+        if len(entries) > MAX_HISTORY_LINES:
+            conn.privmsg(sender, "More messages were left out; try a later time.")
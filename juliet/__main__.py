@@ -8,15 +8,98 @@ import logging
 from juliet import Juliet
 
 from . import config, radio
+from .capture import CaptureSink
+from .event import EventDispatcher
+from .history import MessageHistory
+from .metrics import NULL_REGISTRY, MetricsRegistry, MetricsServer
+from .reliable import ReliableRadio
 
 ## MAIN ENTRY
 
 conf = config.User()
 log = logging.getLogger(__name__)
 
-radio = radio.RadioComm(
-    serial_port=conf.RADIO_COMM_PORT, baud_rate=conf.RADIO_BAUD_RATE
-)
+metrics = NULL_REGISTRY
+metrics_server = None
+
+if conf.METRICS_ENABLED:
+    metrics = MetricsRegistry()
+
+    if conf.METRICS_HTTP_PORT is not None:
+        metrics_server = MetricsServer(
+            metrics, host=conf.METRICS_HTTP_HOST, port=conf.METRICS_HTTP_PORT
+        )
+
+# sinks and dispatchers that must be closed on exit
+captures = []
+recv_dispatchers = []
+
+
+# set up a radio from its settings (conf or one of conf.RADIOS)
+def build_radio(radio_conf):
+    if radio_conf.RADIO_TRANSPORT == "async":
+        radio_class = radio.RadioAsync
+    else:
+        radio_class = radio.RadioComm
+
+    # each radio runs its own threads and transmit queue, so a slow port never
+    # holds up the others
+    comm = radio_class(
+        serial_port=radio_conf.RADIO_COMM_PORT,
+        baud_rate=radio_conf.RADIO_BAUD_RATE,
+        xmit_rate=radio_conf.RADIO_XMIT_RATE,
+        xmit_burst=radio_conf.RADIO_XMIT_BURST,
+        xmit_gap=radio_conf.RADIO_XMIT_GAP,
+        batch_window=radio_conf.RADIO_BATCH_WINDOW,
+        batch_size=radio_conf.RADIO_BATCH_SIZE,
+        lane_weights=radio_conf.RADIO_LANE_WEIGHTS,
+        metrics=metrics.labeled(radio=radio_conf.RADIO_NAME),
+    )
+
+    # record the raw traffic, before any frames are unwrapped by the reliable
+    # layer
+    if radio_conf.RADIO_CAPTURE_FILE is not None:
+        capture = CaptureSink(
+            radio_conf.RADIO_CAPTURE_FILE,
+            max_bytes=radio_conf.RADIO_CAPTURE_MAX_BYTES,
+            backups=radio_conf.RADIO_CAPTURE_BACKUPS,
+        )
+        capture.attach(comm)
+        captures.append(capture)
+
+    # handle received data on a separate thread so the radio is never held up
+    if radio_conf.RADIO_RECV_QUEUE is not None:
+        recv_dispatcher = EventDispatcher(
+            radio_conf.RADIO_RECV_QUEUE, radio_conf.RADIO_RECV_OVERFLOW
+        )
+        comm.on_recv.dispatcher = recv_dispatcher
+        recv_dispatchers.append(recv_dispatcher)
+
+    # acknowledge and retransmit frames between stations that use a station name
+    if conf.RELIABLE_STATION is not None:
+        comm = ReliableRadio(
+            comm,
+            station=conf.RELIABLE_STATION,
+            peers=conf.RELIABLE_PEERS,
+            window=conf.RELIABLE_WINDOW,
+            max_retries=conf.RELIABLE_RETRIES,
+        )
+
+    return comm
+
+
+# record relayed messages for the history commands
+history = None
+
+if conf.HISTORY_FILE is not None:
+    history = MessageHistory(
+        conf.HISTORY_FILE, batch_size=conf.HISTORY_BATCH_SIZE, metrics=metrics
+    )
+
+radio_confs = conf.RADIOS or [conf]
+radios = [build_radio(radio_conf) for radio_conf in radio_confs]
+
+first = radio_confs[0]
 
 jules = Juliet(
     nick=conf.IRC_NICKNAME,
@@ -24,13 +107,44 @@ jules = Juliet(
     server=conf.IRC_SERVER_HOST,
     port=conf.IRC_SERVER_PORT,
     channels=conf.IRC_CHANNELS,
-    radio=radio,
+    download_dir=conf.DOWNLOAD_DIR,
+    max_file_size=conf.DOWNLOAD_MAX_SIZE,
+    compress=first.RADIO_COMPRESS,
+    metrics=metrics,
+    ring_buffer=first.RADIO_RING_BUFFER,
+    radio=radios[0],
+    radio_name=first.RADIO_NAME,
+    routes=conf.RADIO_ROUTES,
+    relay=first.RADIO_RELAY,
+    history=history,
 )
 
+for radio_conf, comm in zip(radio_confs[1:], radios[1:], strict=True):
+    jules.add_radio(
+        radio_conf.RADIO_NAME,
+        comm,
+        compress=radio_conf.RADIO_COMPRESS,
+        ring_buffer=radio_conf.RADIO_RING_BUFFER,
+        relay=radio_conf.RADIO_RELAY,
+    )
+
 try:
     jules.start()
 except KeyboardInterrupt:
     log.info("Canceled by user")
     jules.disconnect("offline")
 
-radio.close()
+for comm in radios:
+    comm.close()
+
+for recv_dispatcher in recv_dispatchers:
+    recv_dispatcher.close(timeout=5)
+
+for capture in captures:
+    capture.close()
+
+if history is not None:
+    history.close(timeout=5)
+
+if metrics_server is not None:
+    metrics_server.close()
@@ -0,0 +1,269 @@
+##
+# juliet - Copyright (c) Jason Heddings. All rights reserved.
+# Licensed under the MIT License. See LICENSE for full terms.
+##
+
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from enum import IntEnum
+
+# capture files start with a short header:
+#   magic (4 bytes) | format version (1 byte)
+#
+# followed by one record for each block of data sent or received:
+#   timestamp (float64, seconds since the epoch) | direction (1 byte) |
+#   length (uint32) | data (length bytes)
+#
+# all values are little-endian.  records are only ever appended, so a capture
+# that was interrupted may end with a partial record (which readers ignore, and
+# which is cut off before a new session appends to the file).
+
+CAPTURE_MAGIC = b"JCAP"
+CAPTURE_VERSION = 1
+
+capture_header = struct.Struct("<4sB")
+record_header = struct.Struct("<dBI")
+
+# the number of old capture files kept when rotating
+DEFAULT_CAPTURE_BACKUPS = 5
+
+
+class Direction(IntEnum):
+    RECV = 0
+    XMIT = 1
+
+
+# records the raw data sent and received by a radio; this is separate from
+# logging so that it may be left on without affecting log output
+#
+# if max_bytes is given, the file is rotated once it reaches that size: the
+# current file becomes path.1 (the previous path.1 becomes path.2, and so on)
+# and only the given number of backups are kept
+class CaptureSink:
+    def __init__(
+        self,
+        path,
+        clock=time.time,
+        max_bytes=None,
+        backups=DEFAULT_CAPTURE_BACKUPS,
+    ):
+        if max_bytes is not None and max_bytes <= capture_header.size:
+            raise ValueError("max_bytes is too small for a capture file")
+
+        if backups is None or backups < 0:
+            raise ValueError("backups must not be negative")
+
+        self.path = path
+        self.clock = clock
+        self.max_bytes = max_bytes
+        self.backups = backups
+
+        self.logger = logging.getLogger(__name__).getChild("CaptureSink")
+
+        self.lock = threading.Lock()
+        self.fp = self._open(path)
+
+        self.records = 0
+        self.bytes = 0
+        self.rotations = 0
+
+        self.logger.info("capturing radio traffic -- %s", path)
+
+    def attach(self, radio):
+        radio.on_recv += self.on_recv
+        radio.on_xmit += self.on_xmit
+
+    def detach(self, radio):
+        radio.on_recv -= self.on_recv
+        radio.on_xmit -= self.on_xmit
+
+    def on_recv(self, radio, data):
+        self.write(Direction.RECV, data)
+
+    def on_xmit(self, radio, data):
+        self.write(Direction.XMIT, data)
+
+    def write(self, direction, data):
+        header = record_header.pack(self.clock(), direction, len(data))
+
+        with self.lock:
+            if self.fp is None:
+                return
+
+            self.fp.write(header)
+            self.fp.write(data)
+
+            self.records += 1
+            self.bytes += len(data)
+
+            if self.max_bytes is not None and self.fp.tell() >= self.max_bytes:
+                self._rotate()
+
+    def flush(self):
+        with self.lock:
+            if self.fp is not None:
+                self.fp.flush()
+
+    def close(self):
+        with self.lock:
+            if self.fp is not None:
+                self.fp.close()
+                self.fp = None
+
+    def _open(self, path):
+        try:
+            fp = open(path, "r+b")
+        except FileNotFoundError:
+            fp = open(path, "w+b")
+
+        try:
+            end = capture_end(fp)
+        except Exception:
+            fp.close()
+            raise
+
+        # anything after the last complete record would be read as the start
+        # of the records that follow it
+        if end < fp.seek(0, os.SEEK_END):
+            self.logger.warning("removing partial record from capture -- %s", path)
+            fp.truncate(end)
+
+        fp.seek(end)
+
+        # new files start with the header; existing captures are appended
+        if end == 0:
+            fp.write(capture_header.pack(CAPTURE_MAGIC, CAPTURE_VERSION))
+
+        return fp
+
+    def _rotate(self):
+        self.fp.close()
+
+        if self.backups > 0:
+            for idx in range(self.backups - 1, 0, -1):
+                older = f"{self.path}.{idx}"
+
+                if os.path.exists(older):
+                    os.replace(older, f"{self.path}.{idx + 1}")
+
+            os.replace(self.path, f"{self.path}.1")
+
+        else:
+            os.remove(self.path)
+
+        self.rotations += 1
+        self.logger.debug("rotated capture file -- %s", self.path)
+
+        self.fp = self._open(self.path)
+
+
+# the offset just past the last complete record in an open capture file (0 if
+# the file does not even have a complete header)
+def capture_end(fp):
+    fp.seek(0)
+    header = fp.read(capture_header.size)
+
+    if len(header) < capture_header.size:
+        return 0
+
+    magic, version = capture_header.unpack(header)
+
+    if magic != CAPTURE_MAGIC:
+        raise ValueError("not a capture file")
+
+    if version != CAPTURE_VERSION:
+        raise ValueError(f"unsupported capture version: {version}")
+
+    size = os.fstat(fp.fileno()).st_size
+    offset = capture_header.size
+
+    while offset + record_header.size <= size:
+        fp.seek(offset)
+        _, _, length = record_header.unpack(fp.read(record_header.size))
+
+        if offset + record_header.size + length > size:
+            break
+
+        offset += record_header.size + length
+
+    return offset
+
+
+# reads the records from a capture file; the file is memory-mapped, so records
+# are read without copying the file into memory first
+class CaptureReader:
+    def __init__(self, path):
+        self.path = path
+        self.fp = open(path, "rb")
+        self.map = None
+
+        # set once the end of the file is reached, if it ends part way through
+        # a record (e.g. if the writer was interrupted)
+        self.truncated = False
+
+        try:
+            self.size = os.fstat(self.fp.fileno()).st_size
+
+            if self.size < capture_header.size:
+                raise ValueError("not a capture file")
+
+            self.map = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+            magic, version = capture_header.unpack_from(self.map, 0)
+
+            if magic != CAPTURE_MAGIC:
+                raise ValueError("not a capture file")
+
+            if version != CAPTURE_VERSION:
+                raise ValueError(f"unsupported capture version: {version}")
+
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # yields (timestamp, direction, data) for each complete record
+    def __iter__(self):
+        buf = self.map
+        end = self.size
+        offset = capture_header.size
+
+        unpack_header = record_header.unpack_from
+        header_size = record_header.size
+
+        while offset + header_size <= end:
+            tstamp, direction, length = unpack_header(buf, offset)
+
+            start = offset + header_size
+            offset = start + length
+
+            if offset > end:
+                self.truncated = True
+                return
+
+            yield tstamp, direction, buf[start:offset]
+
+        if offset < end:
+            self.truncated = True
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+        self.fp.close()
+
+
+# yields (timestamp, direction, data) for each record in a capture file
+def read_capture(path):
+    with CaptureReader(path) as reader:
+        yield from reader
@@ -6,6 +6,11 @@
 import os
 import sys
 
+from .event import Overflow
+from .xmit import Priority
+
+RADIO_TRANSPORTS = ("thread", "async")
+
 
 def load_config(config_file):
     import logging.config
@@ -36,12 +41,72 @@ def load_config(config_file):
 
 
 class Default:
+    # the name of the radio, as used by relays, routes and metrics
+    RADIO_NAME = "radio"
+
     # the port name for accessing the radio (required)
     RADIO_COMM_PORT = "/dev/tty.usbserial"
 
     # the baud rate when accessing the radio (default to 9600)
     RADIO_BAUD_RATE = 9600
 
+    # the average transmit rate in bytes per second (default from baud rate)
+    RADIO_XMIT_RATE = None
+
+    # the number of bytes that may be sent in a burst (default to 512)
+    RADIO_XMIT_BURST = 512
+
+    # the minimum time between frames in seconds (default to 0.1)
+    RADIO_XMIT_GAP = 0.1
+
+    # time to wait for more frames to combine in one write (default to 0)
+    RADIO_BATCH_WINDOW = 0
+
+    # the maximum number of bytes in a single write (default to burst size)
+    RADIO_BATCH_SIZE = None
+
+    # relative weights for the transmit lanes (default to 8 / 4 / 2 / 1)
+    RADIO_LANE_WEIGHTS = None
+
+    # compress text messages when it makes them shorter (default to True)
+    RADIO_COMPRESS = True
+
+    # the serial transport: "thread" (reader / writer threads) or "async" (event
+    # loop, which needs a port with a file descriptor, so not on Windows);
+    # default to thread
+    RADIO_TRANSPORT = "thread"
+
+    # queue received data for a separate handler thread (default to None, inline)
+    RADIO_RECV_QUEUE = None
+
+    # what to do when the receive queue is full (default to block)
+    RADIO_RECV_OVERFLOW = Overflow.BLOCK
+
+    # record raw radio traffic to this file (default to None, disabled)
+    RADIO_CAPTURE_FILE = None
+
+    # start a new capture file at this size in bytes (default to None, never)
+    RADIO_CAPTURE_MAX_BYTES = None
+
+    # the number of old capture files to keep (default to 5)
+    RADIO_CAPTURE_BACKUPS = 5
+
+    # parse received frames in place in a ring of this size in bytes (default
+    # to None, received data is kept in a growing buffer)
+    RADIO_RING_BUFFER = None
+
+    # the names of other radios that frames heard on this radio are sent to
+    # (default to None, frames are not relayed)
+    RADIO_RELAY = None
+
+    # a RadioConfig for each radio, when more than one is used (default to
+    # None, a single radio described by the settings above)
+    RADIOS = None
+
+    # the names of the radios that carry each IRC channel (default to None,
+    # every channel is carried on every radio)
+    RADIO_ROUTES = None
+
     # the hostname of the target IRC server (required)
     IRC_SERVER_HOST = "localhost"
 
@@ -60,6 +125,39 @@ class Default:
     # the default JOIN channels on the IRC server (default to None)
     IRC_CHANNELS = None
 
+    # where received files are saved (default to None, kept in memory)
+    DOWNLOAD_DIR = None
+
+    # the largest file saved to DOWNLOAD_DIR, in bytes (default to 64 MiB)
+    DOWNLOAD_MAX_SIZE = 64 * 1024 * 1024
+
+    # record relayed messages in this database file (default to None, disabled)
+    HISTORY_FILE = None
+
+    # the number of messages written to the history at once (default to 256)
+    HISTORY_BATCH_SIZE = 256
+
+    # the station name used for reliable delivery (default to None, disabled)
+    RELIABLE_STATION = None
+
+    # stations that are always expected to acknowledge frames (default to None)
+    RELIABLE_PEERS = None
+
+    # the number of frames that may be waiting for an ACK (default to 8)
+    RELIABLE_WINDOW = 8
+
+    # how many times a frame is sent again before giving up (default to 5)
+    RELIABLE_RETRIES = 5
+
+    # collect runtime metrics (default to False)
+    METRICS_ENABLED = False
+
+    # serve metrics over HTTP on this port (default to None, disabled)
+    METRICS_HTTP_PORT = None
+
+    # the address for the metrics server (default to the loopback address)
+    METRICS_HTTP_HOST = "127.0.0.1"
+
     def validate(self):
         if self.IRC_SERVER_HOST is None:
             raise ValueError("IRC server host must be specified")
@@ -70,44 +168,227 @@ class Default:
         if self.IRC_NICKNAME is None:
             raise ValueError("IRC nickname must be specified")
 
+        self._validate_radios()
+
+        if self.RELIABLE_WINDOW is None or self.RELIABLE_WINDOW <= 0:
+            raise ValueError("Reliable window must be greater than zero")
+
+        if self.RELIABLE_RETRIES is None or self.RELIABLE_RETRIES < 0:
+            raise ValueError("Reliable retries must not be negative")
+
+        if self.METRICS_HTTP_PORT is not None and not self.METRICS_ENABLED:
+            raise ValueError("Metrics must be enabled to use the HTTP server")
+
+        if self.HISTORY_BATCH_SIZE is None or self.HISTORY_BATCH_SIZE <= 0:
+            raise ValueError("History batch size must be greater than zero")
+
+    def _validate_radios(self):
+        if self.RADIOS is None:
+            radios = [self]
+        elif len(self.RADIOS) == 0:
+            raise ValueError("At least one radio must be specified")
+        else:
+            radios = self.RADIOS
+
+        names = set()
+
+        for radio in radios:
+            radio._validate_radio()
+            radio._validate_xmit()
+
+            if radio.RADIO_NAME in names:
+                raise ValueError(f"Duplicate radio name: {radio.RADIO_NAME}")
+
+            names.add(radio.RADIO_NAME)
+
+        self._validate_routes(radios, names)
+
+    # relays and routes must name radios that exist
+    def _validate_routes(self, radios, names):
+        for radio in radios:
+            for name in radio.RADIO_RELAY or []:
+                if name not in names:
+                    raise ValueError(f"Unknown radio in relay: {name}")
+
+                if name == radio.RADIO_NAME:
+                    raise ValueError(f"Radio cannot relay to itself: {name}")
+
+        if self.RADIO_ROUTES is not None:
+            for channel, route in self.RADIO_ROUTES.items():
+                for name in route:
+                    if name not in names:
+                        raise ValueError(
+                            f"Unknown radio in route for {channel}: {name}"
+                        )
+
+    def _validate_radio(self):
         if self.RADIO_COMM_PORT is None:
             raise ValueError("Radio port must be specified")
 
+        if self.RADIO_TRANSPORT not in RADIO_TRANSPORTS:
+            raise ValueError(f"Unknown radio transport: {self.RADIO_TRANSPORT}")
+
+        if self.RADIO_RECV_QUEUE is not None and self.RADIO_RECV_QUEUE <= 0:
+            raise ValueError("Radio receive queue must be greater than zero")
+
         if self.RADIO_BAUD_RATE is None:
             raise ValueError("Radio port must be specified")
 
+        if self.RADIO_CAPTURE_BACKUPS is None or self.RADIO_CAPTURE_BACKUPS < 0:
+            raise ValueError("Radio capture backups must not be negative")
+
+        if self.RADIO_RING_BUFFER is not None and self.RADIO_RING_BUFFER <= 0:
+            raise ValueError("Radio ring buffer must be greater than zero")
+
+    def _validate_xmit(self):
+        if self.RADIO_XMIT_RATE is not None and self.RADIO_XMIT_RATE <= 0:
+            raise ValueError("Radio transmit rate must be greater than zero")
+
+        if self.RADIO_XMIT_BURST is None or self.RADIO_XMIT_BURST <= 0:
+            raise ValueError("Radio transmit burst must be greater than zero")
+
+        if self.RADIO_XMIT_GAP is None or self.RADIO_XMIT_GAP < 0:
+            raise ValueError("Radio frame gap must not be negative")
+
+        if self.RADIO_BATCH_WINDOW is None or self.RADIO_BATCH_WINDOW < 0:
+            raise ValueError("Radio batch window must not be negative")
+
+        if self.RADIO_BATCH_SIZE is not None and self.RADIO_BATCH_SIZE <= 0:
+            raise ValueError("Radio batch size must be greater than zero")
+
+        if self.RADIO_LANE_WEIGHTS is not None:
+            for weight in self.RADIO_LANE_WEIGHTS.values():
+                if weight <= 0:
+                    raise ValueError("Radio lane weights must be greater than zero")
+
+    def _load_radio(self, conf):
+        self.RADIO_NAME = conf.get("name", "radio")
+        self.RADIO_COMM_PORT = conf.get("port", None)
+        self.RADIO_BAUD_RATE = conf.get("baud", 9600)
+
+        self.RADIO_XMIT_RATE = conf.get("rate", None)
+        self.RADIO_XMIT_BURST = conf.get("burst", 512)
+        self.RADIO_XMIT_GAP = conf.get("gap", 0.1)
+
+        self.RADIO_BATCH_WINDOW = conf.get("batch_window", 0)
+        self.RADIO_BATCH_SIZE = conf.get("batch_size", None)
+
+        self.RADIO_COMPRESS = conf.get("compress", True)
+        self.RADIO_TRANSPORT = conf.get("transport", "thread")
+
+        self.RADIO_RECV_QUEUE = conf.get("recv_queue", None)
+
+        self.RADIO_RECV_OVERFLOW = Overflow(conf.get("recv_overflow", "block"))
+
+        self.RADIO_CAPTURE_FILE = conf.get("capture", None)
+        self.RADIO_CAPTURE_MAX_BYTES = conf.get("capture_max_bytes", None)
+        self.RADIO_CAPTURE_BACKUPS = conf.get("capture_backups", 5)
+
+        self.RADIO_RING_BUFFER = conf.get("ring_buffer", None)
+
+        relay = conf.get("relay", None)
+
+        if isinstance(relay, str):
+            relay = [relay]
+
+        self.RADIO_RELAY = relay
+
+        weights = conf.get("weights", None)
+
+        if weights is not None:
+            self.RADIO_LANE_WEIGHTS = {}
+
+            for name, weight in weights.items():
+                if name.upper() not in Priority.__members__:
+                    raise ValueError(f"unknown transmit lane: {name}")
+
+                self.RADIO_LANE_WEIGHTS[Priority[name.upper()]] = weight
+
+
+# the settings for one radio, when several are listed in the configuration
+class RadioConfig(Default):
+    def __init__(self, conf):
+        if "name" not in conf:
+            raise ValueError("missing radio name in configuration")
+
+        self._load_radio(conf)
+
 
 class User(Default):
     def __init__(self):
         if "server" in g_conf:
-            conf = g_conf["server"]
+            self._load_server(g_conf["server"])
 
-            self.IRC_SERVER_HOST = conf.get("host", "localhost")
-            self.IRC_SERVER_PORT = conf.get("port", 6667)
+        if "radio" in g_conf:
+            self._load_radios(g_conf["radio"])
 
-            self.IRC_NICKNAME = conf.get("nickname", "juliet")
-            self.IRC_REALNAME = conf.get("realname", "Juliet Radio Bot")
-            self.IRC_PASSWORD = conf.get("password", None)
+        if "routes" in g_conf:
+            self._load_routes(g_conf["routes"])
 
-            self.IRC_CHANNELS = []
+        if "reliable" in g_conf:
+            conf = g_conf["reliable"]
 
-            for channel in conf.get("channels", None):
-                if "name" not in channel:
-                    raise ValueError("missing channel name in configuration")
+            self.RELIABLE_STATION = conf.get("station", None)
+            self.RELIABLE_PEERS = conf.get("peers", None)
+            self.RELIABLE_WINDOW = conf.get("window", 8)
+            self.RELIABLE_RETRIES = conf.get("retries", 5)
 
-                if "key" not in channel:
-                    channel["key"] = None
+        if "metrics" in g_conf:
+            conf = g_conf["metrics"]
 
-                self.IRC_CHANNELS.append(channel)
+            self.METRICS_ENABLED = conf.get("enabled", True)
+            self.METRICS_HTTP_PORT = conf.get("http_port", None)
+            self.METRICS_HTTP_HOST = conf.get("http_host", "127.0.0.1")
 
-        if "radio" in g_conf:
-            conf = g_conf["radio"]
+        if "files" in g_conf:
+            conf = g_conf["files"]
+
+            self.DOWNLOAD_DIR = conf.get("downloads", None)
+            self.DOWNLOAD_MAX_SIZE = conf.get("max_size", 64 * 1024 * 1024)
+
+        if "history" in g_conf:
+            conf = g_conf["history"]
 
-            self.RADIO_COMM_PORT = conf.get("port", None)
-            self.RADIO_BAUD_RATE = conf.get("baud", 9600)
+            self.HISTORY_FILE = conf.get("path", None)
+            self.HISTORY_BATCH_SIZE = conf.get("batch_size", 256)
 
         self.validate()
 
+    def _load_server(self, conf):
+        self.IRC_SERVER_HOST = conf.get("host", "localhost")
+        self.IRC_SERVER_PORT = conf.get("port", 6667)
+
+        self.IRC_NICKNAME = conf.get("nickname", "juliet")
+        self.IRC_REALNAME = conf.get("realname", "Juliet Radio Bot")
+        self.IRC_PASSWORD = conf.get("password", None)
+
+        self.IRC_CHANNELS = []
+
+        for channel in conf.get("channels", None):
+            if "name" not in channel:
+                raise ValueError("missing channel name in configuration")
+
+            if "key" not in channel:
+                channel["key"] = None
+
+            self.IRC_CHANNELS.append(channel)
+
+    # a single radio, or a list of them (each with a name)
+    def _load_radios(self, conf):
+        if isinstance(conf, list):
+            self.RADIOS = [RadioConfig(radio_conf) for radio_conf in conf]
+        else:
+            self._load_radio(conf)
+
+    def _load_routes(self, conf):
+        self.RADIO_ROUTES = {}
+
+        for channel, route in conf.items():
+            if isinstance(route, str):
+                route = [route]
+
+            self.RADIO_ROUTES[channel] = list(route)
+
 
 if len(sys.argv) > 1:
     cfg_file = sys.argv[1]
@@ -0,0 +1,170 @@
+##
+# juliet - Copyright (c) Jason Heddings. All rights reserved.
+# Licensed under the MIT License. See LICENSE for full terms.
+##
+
+import logging
+import sys
+
+logger = logging.getLogger(__name__)
+
+CRC16_POLY = 0x1021
+CRC16_INIT = 0xFFFF
+
+# inputs at least this long are processed two bytes at a time
+WIDE_TABLE_MIN_LEN = 32
+
+
+# modified from https://gist.github.com/oysstu/68072c44c02879a2abf94ef350d1c7c6
+#
+# this is the original bit-by-bit algorithm; it is kept as the reference for the
+# table engines (and for any non-standard polynomials)
+def crc16_bitwise(data, crc=CRC16_INIT, poly=CRC16_POLY):
+    if isinstance(data, str):
+        data = bytes(data, "utf-8")
+
+    data = bytearray(data)
+
+    for b in data:
+        cur_byte = 0xFF & b
+        for _ in range(0, 8):
+            if (crc & 0x0001) ^ (cur_byte & 0x0001):
+                crc = (crc >> 1) ^ poly
+            else:
+                crc >>= 1
+            cur_byte >>= 1
+
+    crc = ~crc & 0xFFFF
+    crc = (crc << 8) | ((crc >> 8) & 0xFF)
+
+    return crc & 0xFFFF
+
+
+def _finalize(crc):
+    crc = ~crc & 0xFFFF
+    return ((crc << 8) | (crc >> 8)) & 0xFFFF
+
+
+def _make_table(poly):
+    table = []
+
+    for idx in range(256):
+        crc = idx
+        for _ in range(8):
+            crc = (crc >> 1) ^ poly if crc & 1 else crc >> 1
+        table.append(crc)
+
+    return table
+
+
+def _as_bytes(data):
+    if isinstance(data, str):
+        return data.encode("utf-8")
+
+    if isinstance(data, memoryview) and data.format != "B":
+        return data.cast("B")
+
+    return data
+
+
+# CRC of a single byte from a zero register
+CRC16_TABLE = _make_table(CRC16_POLY)
+
+# CRC of a byte followed by a zero byte (used to build the wide table)
+CRC16_TABLE_1 = [(crc >> 8) ^ CRC16_TABLE[crc & 0xFF] for crc in CRC16_TABLE]
+
+# slice-by-2 table indexed by (register ^ next 16-bit word); built on first use
+_wide_table = None
+
+
+def _get_wide_table():
+    global _wide_table
+
+    if _wide_table is None:
+        lo = CRC16_TABLE_1
+        hi = CRC16_TABLE
+        _wide_table = [lo[word & 0xFF] ^ hi[word >> 8] for word in range(0x10000)]
+
+    return _wide_table
+
+
+def crc16_table(data, crc=CRC16_INIT):
+    data = _as_bytes(data)
+    table = CRC16_TABLE
+
+    for b in data:
+        crc = (crc >> 8) ^ table[(crc ^ b) & 0xFF]
+
+    return _finalize(crc)
+
+
+def crc16_sliced(data, crc=CRC16_INIT):
+    data = _as_bytes(data)
+
+    # the word view relies on native little-endian byte order
+    if len(data) < WIDE_TABLE_MIN_LEN or sys.byteorder != "little":
+        return crc16_table(data, crc)
+
+    table = CRC16_TABLE
+    wide = _get_wide_table()
+
+    view = memoryview(data).cast("B")
+    tail = len(view) & ~1
+
+    for word in view[:tail].cast("H"):
+        crc = wide[crc ^ word]
+
+    for b in view[tail:]:
+        crc = (crc >> 8) ^ table[(crc ^ b) & 0xFF]
+
+    return _finalize(crc)
+
+
+def _load_native():
+    try:
+        import crcmod
+        from crcmod import _crcfunext  # noqa: F401
+    except ImportError:
+        return None
+
+    # crcmod describes the reflected form of our (right-shifting) polynomial
+    func = crcmod.mkCrcFun(0x18408, initCrc=CRC16_INIT, rev=True, xorOut=0)
+
+    def crc16_native(data, crc=CRC16_INIT):
+        return _finalize(func(_as_bytes(data), crc))
+
+    return crc16_native
+
+
+crc16_native = _load_native()
+
+if crc16_native is None:
+    CRC16_BACKEND = "python"
+    _crc16 = crc16_sliced
+else:
+    CRC16_BACKEND = "native"
+    _crc16 = crc16_native
+
+logger.debug("crc16 backend: %s", CRC16_BACKEND)
+
+
+def crc16(data, crc=CRC16_INIT, poly=CRC16_POLY):
+    if poly != CRC16_POLY:
+        return crc16_bitwise(data, crc, poly)
+
+    return _crc16(data, crc)
+
+
+def checksum(*parts):
+    crc = CRC16_INIT
+
+    for part in parts:
+        if part is None:
+            continue
+
+        if len(part) == 0:
+            continue
+
+        crc = _crc16(part, crc)
+
+    return crc
@@ -0,0 +1,91 @@
+##
+# juliet - Copyright (c) Jason Heddings. All rights reserved.
+# Licensed under the MIT License. See LICENSE for full terms.
+##
+
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_CACHE_SIZE = 1024
+
+# copies of a frame (e.g. from a repeater) arrive within a few seconds
+DEFAULT_CACHE_TTL = 300
+
+
+# remembers recently seen frames so that repeated copies can be dropped; old
+# entries are evicted when the cache is full (LRU) or when they expire (TTL)
+class DedupCache:
+    def __init__(
+        self, maxsize=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL, clock=time.monotonic
+    ):
+        if maxsize is None or maxsize <= 0:
+            raise ValueError("maxsize must be greater than zero")
+
+        if ttl is None or ttl <= 0:
+            raise ValueError("ttl must be greater than zero")
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+    # check for a key that has been seen recently (updating the counters)
+    def is_duplicate(self, key):
+        with self.lock:
+            now = self.clock()
+            expires = self.entries.get(key)
+
+            if expires is not None and expires > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True
+
+            self.misses += 1
+            return False
+
+    # record a key as seen; expiry is counted from the first copy
+    def remember(self, key):
+        with self.lock:
+            now = self.clock()
+            expires = self.entries.get(key)
+
+            if expires is None or expires <= now:
+                self.entries[key] = now + self.ttl
+
+            self.entries.move_to_end(key)
+            self._evict(now)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _evict(self, now):
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+        # entries are mostly in order of expiry, so stop at the first live one
+        while self.entries:
+            key, expires = next(iter(self.entries.items()))
+
+            if expires > now:
+                break
+
+            del self.entries[key]
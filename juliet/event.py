@@ -3,9 +3,61 @@
 # Licensed under the MIT License. See LICENSE for full terms.
 ##
 
+import logging
+import threading
+import time
+from collections import deque
+from enum import Enum
+
+DEFAULT_QUEUE_SIZE = 256
+
+
+# what to do when a dispatcher queue is full
+class Overflow(Enum):
+    BLOCK = "block"
+    DROP_OLDEST = "drop_oldest"
+    DROP_NEWEST = "drop_newest"
+
+
+class HandlerStats:
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    @property
+    def avg_time(self):
+        return self.total_time / self.calls if self.calls else 0.0
+
+    def record(self, elapsed, failed=False):
+        self.calls += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+
+        if failed:
+            self.errors += 1
+
 
 # modified from https://stackoverflow.com/a/2022629/197772
+#
+# handlers run inline by default; if a dispatcher is given, each call to the
+# event is queued and the handlers run on the dispatcher thread instead.
+#
+# handlers are timed when they run on a dispatcher, or when timing is set;
+# inline events on the receive path are not slowed down by it.  stats are kept
+# by handler name, so removed handlers are not held on to.
 class Event(list):
+    def __init__(self, dispatcher=None, timing=False):
+        super().__init__()
+
+        self.dispatcher = dispatcher
+        self.timing = timing
+
+        self.handler_stats = {}
+        self.stats_lock = threading.Lock()
+
     def __iadd__(self, handler):
         self.append(handler)
         return self
@@ -15,8 +67,158 @@ class Event(list):
         return self
 
     def __call__(self, *args, **kwargs):
-        for handler in self:
-            handler(*args, **kwargs)
+        if self.dispatcher is None:
+            self.fire(*args, **kwargs)
+        else:
+            self.dispatcher.submit(self.fire, args, kwargs)
 
     def __repr__(self):
         return "Event(%s)" % list.__repr__(self)
+
+    # run all handlers in the current thread
+    def fire(self, *args, **kwargs):
+        if not self.timing and self.dispatcher is None:
+            for handler in list(self):
+                handler(*args, **kwargs)
+
+            return
+
+        for handler in list(self):
+            failed = True
+            start = time.perf_counter()
+
+            try:
+                handler(*args, **kwargs)
+                failed = False
+            finally:
+                self._record(handler, time.perf_counter() - start, failed)
+
+    # timing for each handler, keyed by handler name
+    def stats(self):
+        with self.stats_lock:
+            return {
+                stats.name: {
+                    "calls": stats.calls,
+                    "errors": stats.errors,
+                    "avg_time": stats.avg_time,
+                    "max_time": stats.max_time,
+                }
+                for stats in self.handler_stats.values()
+            }
+
+    def _record(self, handler, elapsed, failed):
+        name = getattr(handler, "__qualname__", None) or repr(handler)
+
+        with self.stats_lock:
+            stats = self.handler_stats.get(name)
+
+            if stats is None:
+                stats = self.handler_stats[name] = HandlerStats(name)
+
+            stats.record(elapsed, failed)
+
+
+# runs queued calls on a worker thread, in the order they were submitted; the
+# queue is bounded and the overflow policy decides what happens when it fills
+class EventDispatcher:
+    def __init__(self, maxsize=DEFAULT_QUEUE_SIZE, overflow=Overflow.BLOCK):
+        if maxsize is None or maxsize <= 0:
+            raise ValueError("maxsize must be greater than zero")
+
+        self.maxsize = maxsize
+        self.overflow = Overflow(overflow)
+
+        self.logger = logging.getLogger(__name__).getChild("EventDispatcher")
+
+        self.pending = deque()
+        self.lock = threading.Condition(threading.Lock())
+
+        self.active = True
+        self.busy = False
+
+        self.dispatched = 0
+        self.dropped = 0
+
+        self.worker = threading.Thread(target=self._worker, daemon=True)
+        self.worker.start()
+
+    # queue a call; returns False if the call was dropped
+    def submit(self, func, args=(), kwargs=None):
+        call = (func, args, kwargs or {})
+
+        with self.lock:
+            if not self.active:
+                return False
+
+            while len(self.pending) >= self.maxsize:
+                if self.overflow == Overflow.DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+
+                if self.overflow == Overflow.DROP_OLDEST:
+                    self.pending.popleft()
+                    self.dropped += 1
+                    break
+
+                self.lock.wait()
+
+                if not self.active:
+                    return False
+
+            self.pending.append(call)
+            self.lock.notify_all()
+
+        return True
+
+    @property
+    def depth(self):
+        with self.lock:
+            return len(self.pending)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "depth": len(self.pending),
+                "dispatched": self.dispatched,
+                "dropped": self.dropped,
+            }
+
+    # wait until all queued calls have run; returns False on timeout
+    def join(self, timeout=None):
+        with self.lock:
+            return self.lock.wait_for(
+                lambda: not self.pending and not self.busy, timeout
+            )
+
+    # stop the worker after any queued calls have run
+    def close(self, timeout=None):
+        self.join(timeout)
+
+        with self.lock:
+            self.active = False
+            self.lock.notify_all()
+
+        self.worker.join(timeout)
+
+    def _worker(self):
+        while True:
+            with self.lock:
+                self.busy = False
+                self.lock.notify_all()
+
+                while self.active and not self.pending:
+                    self.lock.wait()
+
+                if not self.pending:
+                    break
+
+                func, args, kwargs = self.pending.popleft()
+
+                self.busy = True
+                self.dispatched += 1
+                self.lock.notify_all()
+
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                self.logger.exception("event handler failed")
@@ -0,0 +1,61 @@
+##
+# juliet - Copyright (c) Jason Heddings. All rights reserved.
+# Licensed under the MIT License. See LICENSE for full terms.
+##
+
+from irc.dict import IRCDict
+
+DEFAULT_RADIO_NAME = "radio"
+
+
+# a radio served by the bot, with its own buffer for received frames; frames
+# heard on this radio are sent again on the radios named in relay
+class RadioPort:
+    def __init__(self, name, radio, msgbuf, compress=True, relay=None):
+        self.name = name
+        self.radio = radio
+        self.msgbuf = msgbuf
+        self.compress = compress
+        self.relay = list(relay) if relay else []
+
+        # when the data being handled was received (for latency metrics)
+        self.recv_started = None
+
+    def __repr__(self):
+        return f"RadioPort({self.name})"
+
+
+# maps IRC channels to the radios that carry them; channels without a route are
+# carried on every radio.  channel names are not case sensitive.
+class RoutingTable:
+    def __init__(self, routes=None):
+        self.routes = IRCDict()
+
+        if routes:
+            for channel, radios in routes.items():
+                self.add(channel, radios)
+
+    def __len__(self):
+        return len(self.routes)
+
+    def __contains__(self, channel):
+        return channel in self.routes
+
+    # route a channel to one radio (by name) or a list of them
+    def add(self, channel, radios):
+        if isinstance(radios, str):
+            radios = [radios]
+
+        self.routes[channel] = tuple(radios)
+
+    def remove(self, channel):
+        self.routes.pop(channel, None)
+
+    # check if messages for the channel should be carried on the named radio
+    def allows(self, channel, radio_name):
+        radios = self.routes.get(channel)
+        return radios is None or radio_name in radios
+
+    # every radio name used by a route
+    def radio_names(self):
+        return {name for radios in self.routes.values() for name in radios}
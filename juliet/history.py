@@ -0,0 +1,329 @@
+##
+# juliet - Copyright (c) Jason Heddings. All rights reserved.
+# Licensed under the MIT License. See LICENSE for full terms.
+##
+
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import deque, namedtuple
+from datetime import datetime, timedelta, timezone
+
+from .metrics import NULL_REGISTRY
+
+# the number of messages written in one transaction (at most)
+DEFAULT_BATCH_SIZE = 256
+
+# messages waiting to be written; more than this are dropped, rather than
+# holding up the radio or the IRC connection
+DEFAULT_HISTORY_QUEUE = 8192
+
+# messages are only ever appended; rows are ordered by id, which follows the
+# order they were recorded in.  channel names are not case sensitive and
+# direct messages have no channel.
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    tstamp INTEGER NOT NULL,
+    direction INTEGER NOT NULL,
+    channel TEXT COLLATE NOCASE,
+    sender TEXT,
+    content TEXT NOT NULL,
+    radio TEXT
+);
+CREATE INDEX IF NOT EXISTS messages_channel ON messages (channel, tstamp);
+CREATE INDEX IF NOT EXISTS messages_sender ON messages (sender, tstamp);
+CREATE INDEX IF NOT EXISTS messages_tstamp ON messages (tstamp);
+"""
+
+INSERT_MESSAGE = (
+    "INSERT INTO messages (tstamp, direction, channel, sender, content, radio) "
+    "VALUES (?, ?, ?, ?, ?, ?)"
+)
+
+SELECT_COLUMNS = "SELECT tstamp, direction, channel, sender, content, radio"
+
+# every query is answered from one of the indexes (newest first for the most
+# recent messages, which are then put back in order)
+SELECT_RECENT = (
+    f"{SELECT_COLUMNS} FROM messages WHERE channel = ? "
+    "ORDER BY tstamp DESC, id DESC LIMIT ?"
+)
+
+SELECT_SENDER = (
+    f"{SELECT_COLUMNS} FROM messages WHERE sender = ? "
+    "ORDER BY tstamp DESC, id DESC LIMIT ?"
+)
+
+SELECT_SINCE = (
+    f"{SELECT_COLUMNS} FROM messages WHERE tstamp >= ? ORDER BY tstamp, id LIMIT ?"
+)
+
+SELECT_CHANNEL_SINCE = (
+    f"{SELECT_COLUMNS} FROM messages WHERE channel = ? AND tstamp >= ? "
+    "ORDER BY tstamp, id LIMIT ?"
+)
+
+# the same, for a list of channels (filled in with one placeholder for each)
+# and the direct messages from one sender; the rows come from the channel and
+# sender indexes and only the matching rows are sorted
+SELECT_VISIBLE_SINCE = (
+    SELECT_COLUMNS + " FROM messages WHERE tstamp >= ? "
+    "AND (channel IN ({channels}) OR (channel IS NULL AND sender = ?)) "
+    "ORDER BY tstamp, id LIMIT ?"
+)
+
+# tstamp is seconds since the epoch (when the message was recorded)
+HistoryEntry = namedtuple(
+    "HistoryEntry", ("tstamp", "direction", "channel", "sender", "content", "radio")
+)
+
+duration_re = re.compile(r"^(\d+)([smhd])$")
+
+duration_units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+# the start time (seconds since the epoch) for "since" requests; accepts a
+# duration (30m, 2h, 1d), a time of day (14:30, 14:30:15) or a full date and
+# time (2021-03-19T14:30).  times are UTC, like message timestamps.
+def parse_since(text, now=None):
+    if now is None:
+        now = time.time()
+
+    match = duration_re.match(text)
+
+    if match is not None:
+        return now - int(match.group(1)) * duration_units[match.group(2)]
+
+    current = datetime.fromtimestamp(now, tz=timezone.utc)
+
+    if ":" in text and "-" not in text:
+        clock = datetime.strptime(text, "%H:%M:%S" if text.count(":") == 2 else "%H:%M")
+        start = current.replace(
+            hour=clock.hour, minute=clock.minute, second=clock.second, microsecond=0
+        )
+
+        # a time later than now means yesterday
+        if start > current:
+            start -= timedelta(days=1)
+
+        return start.timestamp()
+
+    start = datetime.fromisoformat(text)
+
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=timezone.utc)
+
+    return start.timestamp()
+
+
+# one line of history for IRC; the channel is left out if it is already known
+def format_entry(entry, channel=True):
+    stamp = datetime.fromtimestamp(entry.tstamp, tz=timezone.utc)
+    line = stamp.strftime("[%Y-%m-%d %H:%M:%S]")
+
+    if channel:
+        line += f" {entry.channel or '(direct)'}"
+
+    return f"{line} <{entry.sender}> {entry.content}"
+
+
+# an append-only store of the messages relayed between IRC and the radios.
+# messages are queued by record() and written in batches by a background
+# thread, so callers never wait on the disk; queries use their own connection
+# and are answered from the indexes while writes continue (the database uses
+# write-ahead logging).
+class MessageHistory:
+    def __init__(
+        self,
+        path,
+        batch_size=DEFAULT_BATCH_SIZE,
+        maxsize=DEFAULT_HISTORY_QUEUE,
+        clock=time.time,
+        metrics=None,
+    ):
+        if batch_size is None or batch_size <= 0:
+            raise ValueError("batch_size must be greater than zero")
+
+        if maxsize is None or maxsize <= 0:
+            raise ValueError("maxsize must be greater than zero")
+
+        self.path = path
+        self.batch_size = batch_size
+        self.maxsize = maxsize
+        self.clock = clock
+
+        self.logger = logging.getLogger(__name__).getChild("MessageHistory")
+
+        if metrics is None:
+            metrics = NULL_REGISTRY
+
+        self.metric_recorded = metrics.counter("history_recorded")
+        self.metric_dropped = metrics.counter("history_dropped")
+        self.metric_batches = metrics.counter("history_batches")
+
+        self.writer = self._connect()
+        self.writer.executescript(HISTORY_SCHEMA)
+
+        self.reader = self._connect()
+        self.reader_lock = threading.Lock()
+
+        self.pending = deque()
+        self.lock = threading.Condition(threading.Lock())
+
+        self.active = True
+        self.busy = False
+
+        self.recorded = 0
+        self.dropped = 0
+
+        metrics.gauge("history_queue_depth", lambda: self.depth)
+
+        self.worker = threading.Thread(target=self._worker, daemon=True)
+        self.worker.start()
+
+        self.logger.info("recording message history -- %s", path)
+
+    # both connections are shared between threads (each one under a lock)
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+
+        return conn
+
+    # queue a message to be written; returns False if it was dropped
+    def record(self, direction, channel, sender, content, radio=None):
+        row = (int(self.clock()), direction, channel, sender, content, radio)
+
+        with self.lock:
+            if not self.active or len(self.pending) >= self.maxsize:
+                self.dropped += 1
+                self.metric_dropped.inc()
+                return False
+
+            self.pending.append(row)
+            self.lock.notify_all()
+
+        return True
+
+    @property
+    def depth(self):
+        with self.lock:
+            return len(self.pending)
+
+    # the most recent messages on a channel, oldest first
+    def recent(self, channel, limit):
+        rows = self._query(SELECT_RECENT, (channel, limit))
+
+        rows.reverse()
+        return rows
+
+    # messages recorded at or after the given time (seconds since the epoch),
+    # oldest first; optionally only for one channel
+    def since(self, tstamp, channel=None, limit=None):
+        if limit is None:
+            limit = -1
+
+        if channel is None:
+            return self._query(SELECT_SINCE, (int(tstamp), limit))
+
+        return self._query(SELECT_CHANNEL_SINCE, (channel, int(tstamp), limit))
+
+    # messages recorded at or after the given time on any of the channels,
+    # along with the direct messages from sender, oldest first
+    def visible_since(self, tstamp, channels, sender, limit=None):
+        if limit is None:
+            limit = -1
+
+        channels = list(channels)
+        sql = SELECT_VISIBLE_SINCE.format(channels=",".join("?" * len(channels)))
+
+        return self._query(sql, (int(tstamp), *channels, sender, limit))
+
+    # the most recent messages from a sender, oldest first
+    def by_sender(self, sender, limit):
+        rows = self._query(SELECT_SENDER, (sender, limit))
+
+        rows.reverse()
+        return rows
+
+    def _query(self, sql, params):
+        with self.reader_lock:
+            if self.reader is None:
+                return []
+
+            cursor = self.reader.execute(sql, params)
+            return [HistoryEntry._make(row) for row in cursor]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "depth": len(self.pending),
+                "recorded": self.recorded,
+                "dropped": self.dropped,
+            }
+
+    # wait until all queued messages are written; returns False on timeout
+    def flush(self, timeout=None):
+        with self.lock:
+            return self.lock.wait_for(
+                lambda: not self.pending and not self.busy, timeout
+            )
+
+    # stop the writer after any queued messages are written
+    def close(self, timeout=None):
+        self.flush(timeout)
+
+        with self.lock:
+            if not self.active:
+                return
+
+            self.active = False
+            self.lock.notify_all()
+
+        self.worker.join(timeout)
+
+        with self.reader_lock:
+            self.reader.close()
+            self.reader = None
+
+    def _worker(self):
+        while True:
+            with self.lock:
+                self.busy = False
+                self.lock.notify_all()
+
+                while self.active and not self.pending:
+                    self.lock.wait()
+
+                if not self.pending:
+                    break
+
+                # everything that is waiting goes in one transaction
+                count = min(len(self.pending), self.batch_size)
+                batch = [self.pending.popleft() for _ in range(count)]
+
+                self.busy = True
+
+            self._write(batch)
+
+        self.writer.close()
+
+    def _write(self, batch):
+        try:
+            with self.writer:
+                self.writer.executemany(INSERT_MESSAGE, batch)
+
+        except sqlite3.Error:
+            self.logger.exception("failed to write %d message(s)", len(batch))
+            return
+
+        with self.lock:
+            self.recorded += len(batch)
+
+        self.metric_recorded.inc(len(batch))
+        self.metric_batches.inc()
@@ -4,91 +4,146 @@
 ##
 
 import base64
+import functools
+import hashlib
 import logging
 import mimetypes
 import re
 import threading
-import urllib.parse
+import time
 import zlib
-from datetime import datetime, timezone
+from datetime import date, datetime, timezone
 
+from .crc import checksum, crc16  # noqa: F401
 from .event import Event
+from .metrics import NULL_REGISTRY
+from .trace import Dump
 
 msg_frame_re = re.compile(rb">>[^><]+<<")
+frame_body_re = re.compile(rb"[^><]*")
 packed_msg_re = re.compile(
     r"^>>(?P<ver>[a-fA-F0-9]+):(?P<crc>[a-zA-Z0-9]+):(?P<sender>[a-zA-Z0-9~/=+_$@#*&%!|-]+)?:(?P<time>[0-9]{14})?:(?P<msg>.+)(?!\\):(?P<sig>[a-zA-Z0-9]+)?<<$"
 )
 
+# field patterns for split_frame; these mirror the groups in packed_msg_re
+frame_ver_re = re.compile(rb"[a-fA-F0-9]+")
+frame_crc_re = re.compile(rb"[a-zA-Z0-9]+")
+frame_sender_re = re.compile(rb"[a-zA-Z0-9~/=+_$@#*&%!|-]*")
+frame_time_re = re.compile(rb"(?:[0-9]{14})?")
+frame_sig_re = re.compile(rb"[a-zA-Z0-9]*")
+
+# the same fields for frame_spans, which matches the header in one pass
+frame_header_re = re.compile(
+    rb">>([a-fA-F0-9]+):([a-zA-Z0-9]+):([a-zA-Z0-9~/=+_$@#*&%!|-]*):((?:[0-9]{14})?):"
+)
+frame_newline_re = re.compile(rb"\n")
+frame_sig_chars = frozenset(
+    b"0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+)
+
 DEFAULT_MAX_BUF_LEN = 5 * 1024 * 1024
 
+# the size of the ring used by RingMessageBuffer, which is also the largest
+# frame that it can receive
+DEFAULT_RING_SIZE = 256 * 1024
+
+LT = ord("<")
+COLON = ord(":")
+NEWLINE = ord("\n")
+
 ## FUTURE MESSAGE TYPES:
 #  - Position: current object position
 #  - Weather: current observed weather
 #  - APRS: maybe just support APRS frames?
 
 
-def format_timestamp(tstamp):
-    tstamp = tstamp.astimezone(tz=timezone.utc)
-    return tstamp.strftime("%Y%m%d%H%M%S")
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+SECONDS_PER_DAY = 24 * 60 * 60
 
 
-def parse_timestamp(string):
-    tstamp = datetime.strptime(string, "%Y%m%d%H%M%S")
-    return tstamp.replace(tzinfo=timezone.utc)
+# whole seconds since the epoch for a datetime (or an epoch that is already an
+# int); naive datetimes are in local time, as with datetime.astimezone
+def to_epoch(tstamp):
+    if isinstance(tstamp, int):
+        return tstamp
 
+    return int(tstamp.replace(microsecond=0).timestamp())
 
-# modified from https://gist.github.com/oysstu/68072c44c02879a2abf94ef350d1c7c6
-def crc16(data, crc=0xFFFF, poly=0x1021):
-    if isinstance(data, str):
-        data = bytes(data, "utf-8")
 
-    data = bytearray(data)
+def from_epoch(seconds):
+    return datetime.fromtimestamp(seconds, tz=timezone.utc)
+
+
+# messages mostly carry the current date, so the date part of a timestamp is
+# cached and only the time of day is worked out for each message
+@functools.lru_cache(maxsize=64)
+def _format_day(days):
+    day = date.fromordinal(EPOCH_ORDINAL + days)
+    return f"{day.year:04d}{day.month:02d}{day.day:02d}"
+
+
+@functools.lru_cache(maxsize=64)
+def _parse_day(text):
+    day = date(int(text[0:4]), int(text[4:6]), int(text[6:8]))
+    return day.toordinal() - EPOCH_ORDINAL
+
+
+# the 14 digit timestamp (YYYYMMDDhhmmss, in UTC) used in message frames
+def format_epoch(seconds):
+    days, seconds = divmod(seconds, SECONDS_PER_DAY)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+
+    return f"{_format_day(days)}{hours:02d}{minutes:02d}{seconds:02d}"
 
-    for b in data:
-        cur_byte = 0xFF & b
-        for _ in range(0, 8):
-            if (crc & 0x0001) ^ (cur_byte & 0x0001):
-                crc = (crc >> 1) ^ poly
-            else:
-                crc >>= 1
-            cur_byte >>= 1
 
-    crc = ~crc & 0xFFFF
-    crc = (crc << 8) | ((crc >> 8) & 0xFF)
+# accepts exactly 14 digits (as str or bytes) -- see split_frame
+def parse_epoch(string):
+    if string is None or len(string) != 14:
+        raise ValueError("invalid timestamp")
 
-    return crc & 0xFFFF
+    hours = int(string[8:10])
+    minutes = int(string[10:12])
+    seconds = int(string[12:14])
 
+    if hours > 23 or minutes > 59 or seconds > 59:
+        raise ValueError("invalid timestamp")
 
-def checksum(*parts):
-    crc = 0xFFFF
+    day = string[0:8]
 
-    for part in parts:
-        if part is None:
-            continue
+    # the cache needs a key that can be hashed
+    if isinstance(day, bytearray):
+        day = bytes(day)
 
-        if len(part) == 0:
-            continue
+    return _parse_day(day) * SECONDS_PER_DAY + hours * 3600 + minutes * 60 + seconds
 
-        crc = crc16(part, crc)
 
-    return crc
+def format_timestamp(tstamp):
+    return format_epoch(to_epoch(tstamp))
+
+
+def parse_timestamp(string):
+    return from_epoch(parse_epoch(string))
 
 
-safe_filename_chars = ".-_ "
+# anything other than word characters (letters, digits and underscores) and
+# the few punctuation characters below is removed from filenames
+unsafe_filename_re = re.compile(r"[^\w. -]")
 
 
 def make_safe_filename(unsafe):
     if unsafe is None or len(unsafe) == 0:
         return None
 
-    safe = "".join([c for c in unsafe if c.isalnum() or c in safe_filename_chars])
+    return unsafe_filename_re.sub("", unsafe).strip()
 
-    return safe.strip()
 
-
-# make text safe for transmitting (mostly protocol chracters)...
+# make text safe for transmitting (mostly protocol chracters)...  the escape
+# character itself is included (first, so that it is escaped before the rest)
+# so that any text survives the round trip
 
 char_entities = {
+    "%": "%25",
     ":": "%3A",
     ">": "%3E",
     "<": "%3C",
@@ -96,44 +151,271 @@ char_entities = {
     "\n": "%0A",
 }
 
+# entity => character, decoding % last so that it does not start new entities
+char_decode = [(entity, ch) for ch, entity in char_entities.items() if ch != "%"]
+char_decode.append((char_entities["%"], "%"))
+
+
+# a chain of str.replace() calls is faster than str.translate() here, since
+# translate() has no fast path for characters that expand to several others;
+# the "in" checks skip copying the text for entities that are not present
+
 
 def char_escape(text):
-    return "".join(char_entities.get(ch, ch) for ch in text)
+    for ch, entity in char_entities.items():
+        if ch in text:
+            text = text.replace(ch, entity)
 
+    return text
 
-# XXX as a shortcut use standard decode from urllib...  we use the
-# above table to keep messages short and easier to read in plain text
+
+# only the entities above are decoded; any other % is left in the text, which
+# is how it arrives from senders that do not escape the % character
 
 
 def char_unescape(text):
-    return urllib.parse.unquote(text)
+    if "%" not in text:
+        return text
+
+    for entity, ch in char_decode:
+        if entity in text:
+            text = text.replace(entity, ch)
+
+    return text
+
+
+# preset dictionary for compressing short chat messages; common phrases are
+# near the end, where they are cheapest to reference.  this is part of the
+# protocol -- changing it will break compatibility with other stations.
+TEXT_ZDICT = (
+    b"https://www. .com .org .net QRZ QRM QRN QSB QSY QTH QRP QRO QRT QRV QRX "
+    b"APRS D-STAR DMR Fusion Echolink IRLP Winlink simplex repeater reflector "
+    b"gateway frequency offset tone squelch antenna battery power watts radio "
+    b"MHz kHz VHF UHF HF 2m 70cm 10m 20m 40m 80m band conditions propagation "
+    b"weather report emergency traffic ARES RACES SKYWARN EOC shelter "
+    b"Monday Tuesday Wednesday Thursday Friday Saturday Sunday tonight "
+    b"tomorrow morning afternoon evening minutes hours today later "
+    b"What Where When How Who Why Yes No OK Hi Hello Thanks Thank you "
+    b"anyone anybody everyone there here this that with from have will would "
+    b"could should about just like know think going want need please sorry "
+    b"check-in check in checking in net control stand by standing by listening "
+    b"monitoring clear signal report you're 5 by 9 59 loud and clear "
+    b"good morning good afternoon good evening good night 73 88 CQ CQ CQ de "
+    b"copy that roger that QSL thanks for the call see you on the air "
+    b"the and you for are not but can I'm it's don't "
+)
+
+# translate base85 output to avoid the framing characters (< and >)
+b85_safe_table = str.maketrans("<>", "[]")
+b85_unsafe_table = str.maketrans("[]", "<>")
+
+
+# compress text with the preset dictionary and encode it as (safe) base85
+def deflate_text(text):
+    comp = zlib.compressobj(9, zlib.DEFLATED, -15, zdict=TEXT_ZDICT)
+    data = comp.compress(text.encode("utf-8")) + comp.flush()
+    b85 = str(base64.b85encode(data), "ascii")
+    return b85.translate(b85_safe_table)
+
+
+def inflate_text(text):
+    data = base64.b85decode(text.translate(b85_unsafe_table))
+    decomp = zlib.decompressobj(-15, zdict=TEXT_ZDICT)
+    data = decomp.decompress(data) + decomp.flush()
+    return data.decode("utf-8")
+
+
+# split a packed message into its raw fields without decoding the frame; the
+# fields are returned as bytes in order: version, crc, sender, timestamp,
+# content and signature.  empty optional fields are returned as None; returns
+# None if the data is not a valid frame.  accepts the same frames as
+# packed_msg_re (other than text that is not valid UTF-8, which is only checked
+# when decoding the content).
+def split_frame(data):
+    if not data.startswith(b">>"):
+        return None
+
+    # the pattern allows a single trailing newline after the end marker
+    if data.endswith(b"<<"):
+        end = len(data) - 2
+    elif data.endswith(b"<<\n"):
+        end = len(data) - 3
+    else:
+        return None
+
+    fields = data[2:end].split(b":", 4)
+
+    if len(fields) != 5:
+        return None
+
+    ver, crc, sender, tstamp, body = fields
+    content, sep, sig = body.rpartition(b":")
+
+    if not sep or not content or b"\n" in content:
+        return None
+
+    if not frame_ver_re.fullmatch(ver) or not frame_crc_re.fullmatch(crc):
+        return None
+
+    if not frame_sender_re.fullmatch(sender) or not frame_time_re.fullmatch(tstamp):
+        return None
+
+    if not frame_sig_re.fullmatch(sig):
+        return None
+
+    return (ver, crc, sender or None, tstamp or None, content, sig or None)
+
+
+# find the fields of a frame without copying any of the data (e.g. a frame in a
+# memoryview); accepts the same frames as split_frame, but returns a (start,
+# end) pair of offsets for each field in the same order.  empty fields have
+# equal offsets; returns None if the data is not a valid frame.
+def frame_spans(data):
+    header = frame_header_re.match(data)
+
+    if header is None:
+        return None
+
+    # the pattern allows a single trailing newline after the end marker
+    end = len(data)
+
+    if data[end - 1] == NEWLINE:
+        end -= 1
+
+    if end < 2 or data[end - 1] != LT or data[end - 2] != LT:
+        return None
+
+    end -= 2
+
+    # the signature is everything after the last ":" in the frame
+    start = header.end()
+    sep = end - 1
+
+    while sep >= start and data[sep] != COLON:
+        if data[sep] not in frame_sig_chars:
+            return None
+
+        sep -= 1
+
+    if sep <= start or frame_newline_re.search(data, start, sep) is not None:
+        return None
+
+    return (
+        header.span(1),
+        header.span(2),
+        header.span(3),
+        header.span(4),
+        (start, sep),
+        (sep + 1, end),
+    )
+
+
+def is_utf8(data):
+    try:
+        str(data, "utf-8")
+    except UnicodeDecodeError:
+        return False
+
+    return True
+
+
+# Events => Handler Function
+#   on_message => func(msgbuf, msg)
+#   on_frame => func(msgbuf, frame, msg)
+#
+# on_frame receives the raw frame of each new message, just before on_message;
+# frames from a RingMessageBuffer are views that are reused after the handler
+# returns, so handlers must copy any frame they keep (e.g. bytes(frame)).
 
 
 class MessageBuffer:
-    def __init__(self, maxlen=DEFAULT_MAX_BUF_LEN):
-        self.buffer = b""
+    def __init__(self, maxlen=DEFAULT_MAX_BUF_LEN, dedup=None, metrics=None):
+        self.buffer = bytearray()
         self.maxlen = maxlen
 
+        # a DedupCache for dropping repeated frames (None to keep them all)
+        self.dedup = dedup
+
+        if metrics is None:
+            metrics = NULL_REGISTRY
+
+        self.metric_bytes_in = metrics.counter("buffer_bytes_in")
+        self.metric_bytes_trimmed = metrics.counter("buffer_bytes_trimmed")
+        self.metric_frames = metrics.counter("buffer_frames")
+        self.metric_invalid = metrics.counter("buffer_invalid_frames")
+        self.metric_duplicates = metrics.counter("buffer_duplicate_frames")
+
+        metrics.gauge("buffer_size", lambda: self.buffer_size())
+
+        # start of the current candidate frame (-1 if none) and the position
+        # where scanning resumes; bytes before these have already been seen
+        self.frame_start = -1
+        self.scan_cursor = 0
+
         self.lock = threading.RLock()
         self.logger = logging.getLogger(__name__).getChild("MessageBuffer")
 
         self.on_message = Event()
+        self.on_frame = Event()
 
     def reset(self):
         with self.lock:
-            self.buffer = b""
+            self.buffer = bytearray()
+            self.frame_start = -1
+            self.scan_cursor = 0
+
+    # the number of bytes waiting in the buffer
+    def buffer_size(self):
+        return len(self.buffer)
+
+    # the offset in the buffer just past the last byte received
+    def buffer_end(self):
+        return len(self.buffer)
+
+    # the frame at the given offsets in the buffer, as passed to unpack_frame
+    def get_frame(self, start, end):
+        return bytes(self.buffer[start:end])
 
     def append(self, data):
         with self.lock:
             self.logger.debug("adding %d bytes to buffer", len(data))
 
+            self.metric_bytes_in.inc(len(data))
+
             self.buffer += data
             self.parse_buffer()
+            self.compact()
 
             # keep the buffer below our max length...
             if len(self.buffer) > self.maxlen:
-                trim_buff = -1 * self.maxlen
-                self.buffer = self.buffer[trim_buff:]
+                trimmed = len(self.buffer) - self.maxlen
+                self.metric_bytes_trimmed.inc(trimmed)
+                self.discard(trimmed)
+
+    def compact(self):
+        with self.lock:
+            # anything before the current frame (or the scan cursor) is either
+            # a consumed frame or junk that can never start a new frame
+            if self.frame_start >= 0:
+                self.discard(self.frame_start)
+            else:
+                self.discard(self.scan_cursor)
+
+    def discard(self, count):
+        if count <= 0:
+            return
+
+        with self.lock:
+            # deleting from the front of a bytearray does not move the data
+            del self.buffer[:count]
+
+            self.scan_cursor = max(self.scan_cursor - count, 0)
+
+            if self.frame_start >= count:
+                self.frame_start -= count
+            elif self.frame_start >= 0:
+                self.logger.debug("discarding partial frame")
+                self.frame_start = -1
 
     def parse_buffer(self):
         messages = []
@@ -143,48 +425,371 @@ class MessageBuffer:
             frame = self.next_frame()
 
             while frame:
+                # content is decoded lazily, so a frame with a valid checksum
+                # may still fail once a handler reads its fields
                 try:
-                    msg = Message.unpack(frame)
-                    messages.append(msg)
-                    self.on_message(self, msg)
+                    msg = self.unpack_frame(frame)
+
+                    if msg is not None:
+                        if self.on_frame:
+                            self.on_frame(self, frame, msg)
+
+                        self.on_message(self, msg)
+
+                        self.metric_frames.inc()
+                        messages.append(msg)
+
                 except ValueError:
-                    self.logger.warning("Invalid message frame -- %s...", frame[:10])
+                    self.logger.warning("Invalid message frame -- %s", Dump(frame))
+                    self.metric_invalid.inc()
 
                 frame = self.next_frame()
 
         return messages
 
+    # unpack a single frame, unless it is a copy of one that was already seen;
+    # copies are identified from the raw frame, before any content decoding
+    def unpack_frame(self, frame):
+        if self.dedup is None:
+            return Message.unpack(frame)
+
+        fields = self.split_frame(frame)
+
+        if fields is None:
+            return Message.unpack(frame)
+
+        key = self.frame_key(frame, fields)
+
+        if self.dedup.is_duplicate(key):
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("dropping duplicate frame -- %s", Dump(frame))
+
+            self.metric_duplicates.inc()
+            return None
+
+        msg = Message.unpack(frame, fields=fields)
+
+        # only frames that pass the checksum are remembered
+        if msg is not None:
+            self.dedup.remember(key)
+
+        return msg
+
+    def split_frame(self, frame):
+        return split_frame(frame)
+
+    # copies of a frame are identical, byte for byte; the header alone is not
+    # enough, since the fragments of a file share a sender and timestamp and
+    # the 16 bit checksum does not tell them apart
+    def frame_key(self, frame, fields):
+        return hashlib.blake2b(frame, digest_size=16).digest()
+
+    # scans forward from the last position, matching the same frames as
+    # msg_frame_re without revisiting bytes that have already been checked
     def next_frame(self):
-        frame = None
+        with self.lock:
+            buf = self.buffer
+            buflen = self.buffer_end()
+
+            while True:
+                if self.frame_start < 0:
+                    start = buf.find(b">>", self.scan_cursor, buflen)
+
+                    if start < 0:
+                        # a trailing ">" may be the beginning of the next frame
+                        self.scan_cursor = max(buflen - 1, self.scan_cursor)
+                        return None
+
+                    self.frame_start = start
+                    self.scan_cursor = start + 2
+
+                end = frame_body_re.match(buf, self.scan_cursor, buflen).end()
+                self.scan_cursor = end
+
+                if end >= buflen:
+                    return None
+
+                # the body ended on a ">" that may start a new frame
+                if buf[end] != LT:
+                    self.frame_start = -1
+                    self.scan_cursor = end - 1
+                    continue
 
+                # frames must have a body...
+                if end == self.frame_start + 2:
+                    self.frame_start = -1
+                    continue
+
+                # wait for the rest of the end marker
+                if end + 1 >= buflen:
+                    return None
+
+                if buf[end + 1] != LT:
+                    self.frame_start = -1
+                    self.scan_cursor = end + 1
+                    continue
+
+                frame = self.get_frame(self.frame_start, end + 2)
+
+                self.frame_start = -1
+                self.scan_cursor = end + 2
+
+                return frame
+
+
+# a MessageBuffer that keeps received data in a fixed-size ring, rather than a
+# bytearray that grows and shrinks with each append; frames are handed to
+# Message.unpack as memoryviews into the ring, so received data is not copied
+# again until the message fields are decoded
+#
+# the ring is not circular in the strict sense: when new data does not fit
+# after the last byte received, any unconsumed data (at most one partial frame)
+# is moved to the front first.  frames are only valid in unpack_frame (and the
+# on_frame handlers), since the ring is reused once a frame has been consumed.
+class RingMessageBuffer(MessageBuffer):
+    def __init__(self, size=DEFAULT_RING_SIZE, dedup=None, metrics=None):
+        # the ring must be in place before the parent registers any metrics
+        self.ring = bytearray(size)
+        self.view = memoryview(self.ring)
+
+        # received data is held between these offsets in the ring
+        self.head = 0
+        self.tail = 0
+
+        super().__init__(maxlen=size, dedup=dedup, metrics=metrics)
+
+        self.buffer = self.ring
+
+    def reset(self):
         with self.lock:
-            self.logger.debug("NEXT: %s", self.buffer)
+            self.head = 0
+            self.tail = 0
+            self.frame_start = -1
+            self.scan_cursor = 0
 
-            match = msg_frame_re.search(self.buffer)
+    def buffer_size(self):
+        return self.tail - self.head
 
-            if match:
-                frame = match.group(0)
-                eom = match.end()
-                self.buffer = self.buffer[eom:]
+    def buffer_end(self):
+        return self.tail
 
-        return frame
+    def get_frame(self, start, end):
+        return self.view[start:end]
 
+    def append(self, data):
+        with self.lock:
+            self.logger.debug("adding %d bytes to buffer", len(data))
 
+            self.metric_bytes_in.inc(len(data))
+
+            end = self.tail + len(data)
+
+            if end > len(self.ring):
+                self.append_pieces(memoryview(data))
+                return
+
+            self.ring[self.tail : end] = data
+            self.tail = end
+
+            self.parse_buffer()
+            self.compact()
+
+    # data that does not fit after the tail of the ring is added in pieces,
+    # making room for each piece first
+    def append_pieces(self, data):
+        while data:
+            room = self.make_room(len(data))
+            end = self.tail + room
+
+            self.ring[self.tail : end] = data[:room]
+            self.tail = end
+            data = data[room:]
+
+            self.parse_buffer()
+            self.compact()
+
+    # ensure there is space for (up to) count more bytes after the tail of the
+    # ring; returns the number of bytes that may be written
+    def make_room(self, count):
+        size = len(self.ring)
+
+        if self.tail + count <= size:
+            return count
+
+        self.rewind()
+
+        # a partial frame that fills the ring can never be completed...
+        if self.tail == size:
+            trimmed = min(count, size)
+            self.metric_bytes_trimmed.inc(trimmed)
+            self.discard(trimmed)
+            self.rewind()
+
+        return min(count, size - self.tail)
+
+    # move the unconsumed data to the front of the ring
+    def rewind(self):
+        head = self.head
+
+        if head == 0:
+            return
+
+        length = self.tail - head
+
+        if length > 0:
+            self.ring[:length] = self.ring[head : self.tail]
+
+        self.head = 0
+        self.tail = length
+
+        self.scan_cursor = max(self.scan_cursor - head, 0)
+
+        if self.frame_start >= 0:
+            self.frame_start -= head
+
+    def compact(self):
+        with self.lock:
+            if self.frame_start >= 0:
+                self.discard(self.frame_start - self.head)
+            else:
+                self.discard(self.scan_cursor - self.head)
+
+            # start from the front of the ring whenever it is empty
+            if self.head == self.tail:
+                self.head = self.tail = self.scan_cursor = 0
+
+    def discard(self, count):
+        if count <= 0:
+            return
+
+        with self.lock:
+            self.head = min(self.head + count, self.tail)
+            self.scan_cursor = max(self.scan_cursor, self.head)
+
+            if 0 <= self.frame_start < self.head:
+                self.logger.debug("discarding partial frame")
+                self.frame_start = -1
+
+    def split_frame(self, frame):
+        return frame_spans(frame)
+
+
+# build a complete frame from its fields (the content must already be packed);
+# the timestamp may be a datetime or seconds since the epoch
+def pack_frame(version, sender, timestamp, content, signature=None):
+    sender = "" if sender is None else sender
+    tstamp = format_epoch(to_epoch(timestamp))
+    sig = "" if signature is None else signature
+    crc = checksum(sender, tstamp, content, sig)
+
+    text = f">>{version:X}:{crc:04X}:{sender}:{tstamp}:{content}:{sig}<<"
+
+    return bytes(text, "utf-8")
+
+
+# registered message classes, keyed by version (see Message.__init_subclass__)
+message_types = {}
+
+
+# a message field that is decoded from the packed content on first use; the
+# value is kept in "_<name>", which must be listed in the class __slots__
+def lazy_field(name):
+    attr = "_" + name
+
+    def getter(self):
+        self.load()
+        return getattr(self, attr)
+
+    def setter(self, value):
+        self.load()
+        setattr(self, attr, value)
+
+    return property(getter, setter)
+
+
+# messages use __slots__ rather than a __dict__, since thousands of them may be
+# held at once (e.g. for reassembly); subclasses should declare __slots__ for
+# their own fields.  the time is kept as whole seconds since the epoch and
+# only turned into a datetime when the timestamp is used.
 class Message:
+    # _packed is the packed content of an unpacked message, until it is loaded
+    __slots__ = ("_packed", "_content", "_epoch", "sender", "signature")
+
     version = None
 
+    # every slot on the class (used to compare messages)
+    _fields = __slots__
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+
+        cls._fields = tuple(
+            name
+            for klass in reversed(cls.__mro__)
+            for name in klass.__dict__.get("__slots__", ())
+        )
+
+        # only register classes that declare their own version
+        version = cls.__dict__.get("version")
+
+        if version is None:
+            return
+
+        if version in message_types:
+            raise ValueError(f"duplicate message version: {version}")
+
+        message_types[version] = cls
+
     def __init__(self, content, sender=None, signature=None, timestamp=None):
+        self._packed = None
+
         self.content = content
         self.sender = sender
         self.signature = signature
 
+        # juliet messages are only accurate to the second...
         if timestamp is None:
-            self.timestamp = datetime.now(tz=timezone.utc)
+            self._epoch = int(time.time())
         else:
-            self.timestamp = timestamp.astimezone(timezone.utc)
+            self._epoch = to_epoch(timestamp)
 
-        # juliet messages are only accurate to the second...
-        self.timestamp = self.timestamp.replace(microsecond=0)
+    content = lazy_field("content")
+
+    # the message time as a datetime (in UTC); may be set from a datetime or
+    # from seconds since the epoch
+    @property
+    def timestamp(self):
+        return from_epoch(self._epoch)
+
+    @timestamp.setter
+    def timestamp(self, value):
+        self._epoch = to_epoch(value)
+
+    # the message time in whole seconds since the epoch
+    @property
+    def epoch(self):
+        return self._epoch
+
+    @epoch.setter
+    def epoch(self, value):
+        self._epoch = int(value)
+
+    # decode the packed content (if needed); this is deferred until one of the
+    # content fields is used so that discarded messages are never decoded
+    def load(self):
+        packed = self._packed
+
+        if packed is None:
+            return
+
+        self._packed = None
+
+        try:
+            self.unpack_content(packed)
+        except (ValueError, zlib.error) as err:
+            # keep the packed content, so every later access fails the same way
+            self._packed = packed
+            raise ValueError("invalid message content") from err
 
     # sign this message with the given private key
     def sign(self, privkey):
@@ -199,77 +804,138 @@ class Message:
         return None
 
     def pack(self):
-        sender = "" if self.sender is None else self.sender
-        tstamp = format_timestamp(self.timestamp)
-        sig = "" if self.signature is None else self.signature
-        content = self.pack_content()
-        crc = checksum(sender, tstamp, content, sig)
-
-        text = f">>{self.version:X}:{crc:04X}:{sender}:{tstamp}:{content}:{sig}<<"
-
-        return bytes(text, "utf-8")
+        return pack_frame(
+            self.version,
+            self.sender,
+            self._epoch,
+            self.pack_content(),
+            self.signature,
+        )
 
     @classmethod
-    def unpack(cls, data, verify_crc=True):
+    def unpack(cls, data, verify_crc=True, fields=None):
         if data is None or len(data) == 0:
             return None
 
+        if isinstance(data, memoryview):
+            return cls.unpack_view(data, verify_crc, fields)
+
+        # callers that have already split the frame may pass in the fields
+        if fields is None:
+            fields = split_frame(data)
+
+        if fields is None:
+            # text that is not UTF-8 has never been treated as an error...
+            if not is_utf8(data):
+                return None
+
+            raise ValueError("invalid message data")
+
+        ver, crc, sender, tstamp, content, sig = fields
+
         try:
-            text = str(data, "utf-8")
+            text = str(content, "utf-8")
         except UnicodeDecodeError:
             return None
 
-        match = packed_msg_re.match(text)
-        if match is None or match is False:
+        if verify_crc:
+            crc_orig = int(crc, 16)
+            crc_calc = checksum(sender, tstamp, content, sig)
+
+            if crc_orig != crc_calc:
+                raise ValueError("checksum does not match")
+
+        sender = None if sender is None else sender.decode("ascii")
+        sig = None if sig is None else sig.decode("ascii")
+
+        return cls._restore(int(ver, 16), sender, sig, parse_epoch(tstamp), text)
+
+    # unpack a frame in place (e.g. from a RingMessageBuffer), using frame_spans
+    # rather than split_frame; only the decoded fields are copied out of the
+    # view, so the message remains valid once the view is released
+    @classmethod
+    def unpack_view(cls, view, verify_crc=True, spans=None):
+        if spans is None:
+            spans = frame_spans(view)
+
+        if spans is None:
+            if not is_utf8(view):
+                return None
+
             raise ValueError("invalid message data")
 
-        sender = match.group("sender")
-        content = match.group("msg")
-        tstamp = match.group("time")
-        sig = match.group("sig")
+        ver, crc, sender, tstamp, content, sig = spans
+        content = view[content[0] : content[1]]
+
+        try:
+            text = str(content, "utf-8")
+        except UnicodeDecodeError:
+            return None
+
+        # empty fields are left out, as with split_frame
+        sender = view[sender[0] : sender[1]] if sender[0] < sender[1] else None
+        sig = view[sig[0] : sig[1]] if sig[0] < sig[1] else None
+        tstamp = bytes(view[tstamp[0] : tstamp[1]]) if tstamp[0] < tstamp[1] else None
 
         if verify_crc:
-            crc_orig = int(match.group("crc"), 16)
+            crc_orig = int(bytes(view[crc[0] : crc[1]]), 16)
             crc_calc = checksum(sender, tstamp, content, sig)
 
             if crc_orig != crc_calc:
                 raise ValueError("checksum does not match")
 
-        version = int(match.group("ver"), 16)
+        return cls._restore(
+            int(bytes(view[ver[0] : ver[1]]), 16),
+            None if sender is None else str(sender, "ascii"),
+            None if sig is None else str(sig, "ascii"),
+            parse_epoch(tstamp),
+            text,
+        )
 
-        if version == TextMessage.version:
-            msg = TextMessage(content)
-        elif version == CompressedTextMessage.version:
-            msg = CompressedTextMessage(content)
-        elif version == ChannelMessage.version:
-            msg = ChannelMessage(content)
-        elif version == FileMessage.version:
-            msg = FileMessage(content)
-        else:
-            raise Exception("unsupported version")
+    # create a message of the registered type for the version from its fields;
+    # the content is decoded when the message is loaded
+    @staticmethod
+    def _restore(version, sender, signature, epoch, packed):
+        msg_type = message_types.get(version)
+
+        if msg_type is None:
+            raise ValueError(f"unsupported version: {version}")
+
+        msg = msg_type.__new__(msg_type)
 
         msg.sender = sender
-        msg.signature = sig
-        msg.timestamp = parse_timestamp(tstamp)
+        msg.signature = signature
+        msg._epoch = epoch
 
-        msg.unpack_content()
+        msg._packed = packed
 
         return msg
 
     def __eq__(self, other):
         if type(other) is type(self):
-            return self.__dict__ == other.__dict__
+            self.load()
+            other.load()
+            return self._state() == other._state()
         return NotImplemented
 
+    # the value of every field (including any from subclasses without slots)
+    def _state(self):
+        state = tuple(getattr(self, name, None) for name in self._fields)
+        return state + (getattr(self, "__dict__", None),)
+
 
 class CompressedMessage(Message):
-    def compress(self, content):
+    __slots__ = ()
+
+    @staticmethod
+    def compress(content):
         data = content.encode("utf-8")
         compressed = zlib.compress(data)
         b64 = base64.b64encode(compressed)
         return str(b64, "ascii")
 
-    def decompress(self, content):
+    @staticmethod
+    def decompress(content):
         b64 = bytes(content, "ascii")
         compressed = base64.b64decode(b64)
         data = zlib.decompress(compressed)
@@ -277,26 +943,32 @@ class CompressedMessage(Message):
 
 
 class TextMessage(Message):
+    __slots__ = ()
+
     version = 0
 
     def pack_content(self):
         return char_escape(self.content)
 
-    def unpack_content(self):
-        self.content = char_unescape(self.content)
+    def unpack_content(self, packed):
+        self._content = char_unescape(packed)
 
 
 class CompressedTextMessage(CompressedMessage):
+    __slots__ = ()
+
     version = 1
 
     def pack_content(self):
         return self.compress(self.content)
 
-    def unpack_content(self):
-        self.content = self.decompress(self.content)
+    def unpack_content(self, packed):
+        self._content = self.decompress(packed)
 
 
 class ChannelMessage(TextMessage):
+    __slots__ = ("_channel",)
+
     version = 3
 
     def __init__(
@@ -308,19 +980,87 @@ class ChannelMessage(TextMessage):
 
         self.channel = channel
 
+    channel = lazy_field("channel")
+
     def pack_content(self):
         text = self.channel + " " + self.content
         return char_escape(text)
 
-    def unpack_content(self):
-        text = char_unescape(self.content)
-        self.channel, self.content = text.split(" ", 1)
+    def unpack_content(self, packed):
+        text = char_unescape(packed)
+        self._channel, self._content = text.split(" ", 1)
+
+
+class DeflateTextMessage(TextMessage):
+    __slots__ = ()
+
+    version = 2
+
+    def pack_content(self):
+        return deflate_text(self.content)
+
+    def unpack_content(self, packed):
+        self._content = inflate_text(packed)
+
+
+# the channel is not compressed so that messages can be filtered cheaply; the
+# content is only inflated when it is used (_deflated holds it until then)
+class DeflateChannelMessage(ChannelMessage):
+    __slots__ = ("_deflated",)
+
+    version = 4
+
+    @property
+    def content(self):
+        self.inflate()
+        return self._content
+
+    @content.setter
+    def content(self, value):
+        self.load()
+        self._deflated = None
+        self._content = value
+
+    # inflate the content (if needed); like load(), a failure is raised again
+    # each time the content is used
+    def inflate(self):
+        self.load()
+
+        deflated = self._deflated
+
+        if deflated is None:
+            return
+
+        try:
+            self._content = inflate_text(deflated)
+        except (ValueError, zlib.error) as err:
+            raise ValueError("invalid message content") from err
+
+        self._deflated = None
+
+    def _state(self):
+        self.inflate()
+        return super()._state()
+
+    def pack_content(self):
+        return char_escape(self.channel) + " " + deflate_text(self.content)
+
+    def unpack_content(self, packed):
+        channel, text = packed.split(" ", 1)
+        self._channel = char_unescape(channel)
+        self._content = None
+        self._deflated = text
+
+
+# return the message that is shortest when packed
+def select_shortest(*messages):
+    return min(messages, key=lambda msg: len(msg.pack()))
 
 
 class FileMessage(CompressedMessage):
+    __slots__ = ("_filename", "_mimetype")
+
     version = 7
-    filename = None
-    mimetype = None
 
     def __init__(
         self,
@@ -341,14 +1081,17 @@ class FileMessage(CompressedMessage):
         else:
             self.mimetype = mimetype
 
+    filename = lazy_field("filename")
+    mimetype = lazy_field("mimetype")
+
     def pack_content(self):
         filename = make_safe_filename(self.filename) or ""
         mimetype = self.mimetype or ""
         compressed = self.compress(self.content)
         return filename + "|" + mimetype + "|" + compressed
 
-    def unpack_content(self):
-        (filename, mimetype, compressed) = self.content.split("|", 2)
-        self.filename = make_safe_filename(filename)
-        self.mimetype = mimetype if len(mimetype) > 0 else None
-        self.content = self.decompress(compressed)
+    def unpack_content(self, packed):
+        filename, mimetype, compressed = packed.split("|", 2)
+        self._filename = make_safe_filename(filename)
+        self._mimetype = mimetype if len(mimetype) > 0 else None
+        self._content = self.decompress(compressed)
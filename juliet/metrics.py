@@ -0,0 +1,345 @@
+##
+# juliet - Copyright (c) Jason Heddings. All rights reserved.
+# Licensed under the MIT License. See LICENSE for full terms.
+##
+
+import logging
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# upper bounds (in seconds) for latency histograms
+DEFAULT_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60)
+
+DEFAULT_METRICS_HOST = "127.0.0.1"
+DEFAULT_METRICS_PORT = 9640
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+# a value that is either set directly or read from a function when collected
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, func=None):
+        self.func = func
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def snapshot(self):
+        if self.func is not None:
+            return self.func()
+
+        return self.value
+
+
+# counts observations in fixed buckets; the last bucket holds anything larger
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        idx = bisect_left(self.buckets, value)
+
+        with self.lock:
+            self.counts[idx] += 1
+            self.count += 1
+            self.sum += value
+
+    # the upper bound of the bucket holding the given quantile (None if empty
+    # or past the last bucket)
+    def quantile(self, q):
+        with self.lock:
+            if self.count == 0:
+                return None
+
+            rank = q * self.count
+            seen = 0
+
+            # the last count (past every bucket) has no upper bound
+            for bound, count in zip(self.buckets, self.counts[:-1], strict=True):
+                seen += count
+
+                if seen >= rank:
+                    return bound
+
+        return None
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "count": self.count,
+                "sum": self.sum,
+                "buckets": dict(
+                    zip(self.buckets + (float("inf"),), self.counts, strict=True)
+                ),
+            }
+
+
+# stands in for every metric type when metrics are disabled
+class NullMetric:
+    kind = None
+
+    def inc(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+    def snapshot(self):
+        return None
+
+
+NULL_METRIC = NullMetric()
+
+
+# backslash, double quote and newline are escaped in label values, as in the
+# Prometheus text format
+label_escapes = str.maketrans({"\\": "\\\\", '"': '\\"', "\n": "\\n"})
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+
+    inner = ",".join(
+        f'{key}="{str(value).translate(label_escapes)}"' for key, value in labels
+    )
+    return "{" + inner + "}"
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return f"{value:g}"
+
+    return str(value)
+
+
+# metrics are created on first use and shared by name and labels; instrumented
+# objects look up their metrics once and keep them
+class MetricsRegistry:
+    enabled = True
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def counter(self, name, **labels):
+        return self._get(Counter, name, labels)
+
+    # if a function is given, it is called each time the gauge is collected
+    def gauge(self, name, func=None, **labels):
+        gauge = self._get(Gauge, name, labels)
+
+        if func is not None:
+            gauge.func = func
+
+        return gauge
+
+    def histogram(self, name, buckets=DEFAULT_LATENCY_BUCKETS, **labels):
+        return self._get(Histogram, name, labels, buckets)
+
+    # a view of this registry that adds the given labels to every metric
+    def labeled(self, **labels):
+        return LabeledRegistry(self, **labels)
+
+    def _get(self, metric_type, name, labels, *args):
+        key = (name, tuple(sorted(labels.items())))
+
+        with self.lock:
+            metric = self.metrics.get(key)
+
+            if metric is None:
+                metric = self.metrics[key] = metric_type(*args)
+
+            elif not isinstance(metric, metric_type):
+                raise ValueError(f"metric {name} is a {metric.kind}")
+
+        return metric
+
+    def collect(self):
+        with self.lock:
+            items = sorted(self.metrics.items(), key=lambda item: item[0])
+
+        for (name, labels), metric in items:
+            try:
+                value = metric.snapshot()
+            except Exception:
+                logging.getLogger(__name__).exception("failed to collect %s", name)
+                continue
+
+            yield name, labels, metric.kind, value
+
+    # returns {name: {labels: value}}, where labels is a tuple of (key, value)
+    def snapshot(self):
+        result = {}
+
+        for name, labels, _, value in self.collect():
+            result.setdefault(name, {})[labels] = value
+
+        return result
+
+    # the metrics in the Prometheus text format
+    def render(self):
+        lines = []
+        last_name = None
+
+        for name, labels, kind, value in self.collect():
+            if name != last_name:
+                lines.append(f"# TYPE {name} {kind}")
+                last_name = name
+
+            if kind != "histogram":
+                lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+                continue
+
+            total = 0
+
+            for bound, count in value["buckets"].items():
+                total += count
+                le = "+Inf" if bound == float("inf") else format_value(float(bound))
+                bucket_labels = format_labels(labels + (("le", le),))
+                lines.append(f"{name}_bucket{bucket_labels} {total}")
+
+            lines.append(f"{name}_sum{format_labels(labels)} {value['sum']:g}")
+            lines.append(f"{name}_count{format_labels(labels)} {value['count']}")
+
+        return "\n".join(lines) + "\n"
+
+    # one short line per metric (for chat); names may be filtered by prefix
+    def summary(self, prefix=None):
+        lines = []
+
+        for name, labels, kind, value in self.collect():
+            if prefix is not None and not name.startswith(prefix):
+                continue
+
+            label = name + format_labels(labels)
+
+            if kind != "histogram":
+                lines.append(f"{label} = {format_value(value)}")
+                continue
+
+            metric = self.metrics[(name, labels)]
+            avg = value["sum"] / value["count"] if value["count"] else 0.0
+
+            lines.append(
+                f"{label} count={value['count']} avg={avg:0.3f} "
+                f"p50<={metric.quantile(0.5)} p90<={metric.quantile(0.9)}"
+            )
+
+        return lines
+
+
+# hands out metrics that do nothing, so instrumented code costs next to
+# nothing when metrics are turned off
+class NullRegistry(MetricsRegistry):
+    enabled = False
+
+    def counter(self, name, **labels):
+        return NULL_METRIC
+
+    def gauge(self, name, func=None, **labels):
+        return NULL_METRIC
+
+    def histogram(self, name, buckets=DEFAULT_LATENCY_BUCKETS, **labels):
+        return NULL_METRIC
+
+    def labeled(self, **labels):
+        return self
+
+
+NULL_REGISTRY = NullRegistry()
+
+
+# hands out metrics from another registry with some labels already applied;
+# this lets several radios (for example) share one registry without colliding
+class LabeledRegistry:
+    def __init__(self, registry, **labels):
+        self.registry = registry
+        self.labels = labels
+
+    @property
+    def enabled(self):
+        return self.registry.enabled
+
+    def counter(self, name, **labels):
+        return self.registry.counter(name, **{**self.labels, **labels})
+
+    def gauge(self, name, func=None, **labels):
+        return self.registry.gauge(name, func, **{**self.labels, **labels})
+
+    def histogram(self, name, buckets=DEFAULT_LATENCY_BUCKETS, **labels):
+        return self.registry.histogram(name, buckets, **{**self.labels, **labels})
+
+    def labeled(self, **labels):
+        return LabeledRegistry(self.registry, **{**self.labels, **labels})
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+
+        body = self.server.registry.render().encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        self.server.logger.debug(format, *args)
+
+
+# serves the registry as plain text over HTTP from a background thread; this is
+# meant for local monitoring, so it listens on the loopback address by default
+class MetricsServer:
+    def __init__(self, registry, host=DEFAULT_METRICS_HOST, port=DEFAULT_METRICS_PORT):
+        self.logger = logging.getLogger(__name__).getChild("MetricsServer")
+
+        self.httpd = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.registry = registry
+        self.httpd.logger = self.logger
+
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+        self.logger.info("Metrics available -- http://%s:%d/metrics", host, self.port)
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
@@ -3,7 +3,9 @@
 # Licensed under the MIT License. See LICENSE for full terms.
 ##
 
+import asyncio
 import logging
+import os
 import queue
 import threading
 import time
@@ -11,9 +13,24 @@ import time
 import serial
 
 from .event import Event
+from .metrics import NULL_REGISTRY
+from .trace import Dump
+from .xmit import (
+    DEFAULT_BATCH_WINDOW,
+    DEFAULT_BURST_SIZE,
+    DEFAULT_FRAME_GAP,
+    Priority,
+    TokenBucket,
+    TransmitQueue,
+    baud_to_rate,
+    collect_batch,
+)
 
 RECV_BLOCK_SIZE = 4 * 1024
 
+# how often idle workers wake up to check for shutdown
+WORKER_POLL_INTERVAL = 1
+
 # XXX consider a RadioSocket implementation
 
 # Events => Handler Function
@@ -28,7 +45,7 @@ class RadioBase:
 
         self.logger = logging.getLogger(__name__).getChild("RadioBase")
 
-    def send(self, data):
+    def send(self, data, priority=Priority.CHANNEL):
         pass
 
     def close(self):
@@ -41,26 +58,148 @@ class RadioLoop(RadioBase):
 
         self.logger = logging.getLogger(__name__).getChild("RadioLoop")
 
-    def send(self, data):
+    def send(self, data, priority=Priority.CHANNEL):
         self.on_xmit(self, data)
-        self.logger.debug("send -- %s", data)
+
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("send -- %s", Dump(data))
+
         self.on_recv(self, data)
 
 
-class RadioComm(RadioBase):
-    def __init__(self, serial_port, baud_rate=9600):
+# common transmit queue and rate limiting for serial radios
+class QueuedRadio(RadioBase):
+    def __init__(
+        self,
+        baud_rate=9600,
+        xmit_rate=None,
+        xmit_burst=DEFAULT_BURST_SIZE,
+        xmit_gap=DEFAULT_FRAME_GAP,
+        batch_window=DEFAULT_BATCH_WINDOW,
+        batch_size=None,
+        lane_weights=None,
+        clock=time.monotonic,
+        metrics=None,
+    ):
         super().__init__()
 
+        self.logger = logging.getLogger(__name__).getChild("QueuedRadio")
+
+        # limit transmissions to the serial rate unless told otherwise
+        if xmit_rate is None:
+            xmit_rate = baud_to_rate(baud_rate)
+
+        self.scheduler = TokenBucket(
+            xmit_rate, burst=xmit_burst, gap=xmit_gap, clock=clock
+        )
+
+        self.logger.debug(
+            "xmit rate: %d B/s, burst: %d B, gap: %0.2f s",
+            xmit_rate,
+            xmit_burst,
+            xmit_gap,
+        )
+
+        # queued frames are combined into a single write (up to the burst size)
+        self.batch_window = batch_window or 0
+        self.batch_size = batch_size or xmit_burst
+
+        self.xmit_queue = TransmitQueue(weights=lane_weights, clock=clock)
+        self.xmit_pending = 0
+        self.xmit_lock = threading.Lock()
+
+        if metrics is None:
+            metrics = NULL_REGISTRY
+
+        self.metric_bytes_in = metrics.counter("radio_bytes_in")
+        self.metric_bytes_out = metrics.counter("radio_bytes_out")
+        self.metric_frames_out = metrics.counter("radio_frames_out")
+        self.metric_xmit_wait = metrics.histogram("radio_xmit_wait_seconds")
+
+        metrics.gauge("radio_queue_depth", lambda: self.queue_depth)
+        metrics.gauge("radio_queue_bytes", lambda: self.xmit_pending)
+
+    def send(self, data, priority=Priority.CHANNEL):
+        if data is None or len(data) == 0:
+            return False
+
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("queueing XMIT message [%s] -- %s", priority, Dump(data))
+
+        with self.xmit_lock:
+            self.xmit_pending += len(data)
+
+        self.xmit_queue.put(data, priority)
+        self._wake_transmitter()
+
+        return True
+
+    @property
+    def queue_depth(self):
+        return self.xmit_queue.qsize()
+
+    # per-lane depth, throughput and queue wait times
+    def queue_stats(self):
+        return self.xmit_queue.stats()
+
+    # the estimated time (in seconds) to send everything in the queue
+    @property
+    def drain_time(self):
+        return self.scheduler.drain_time(self.xmit_pending, self.queue_depth)
+
+    # called after a new frame is queued
+    def _wake_transmitter(self):
+        pass
+
+    # update the scheduler and notify handlers once a batch has been written
+    def _batch_sent(self, frames, batch):
+        self.scheduler.consume(len(batch))
+
+        with self.xmit_lock:
+            self.xmit_pending -= len(batch)
+
+        self.metric_bytes_out.inc(len(batch))
+        self.metric_frames_out.inc(len(frames))
+
+        for frame in frames:
+            self.on_xmit(self, frame)
+
+
+class RadioComm(QueuedRadio):
+    def __init__(
+        self,
+        serial_port,
+        baud_rate=9600,
+        xmit_rate=None,
+        xmit_burst=DEFAULT_BURST_SIZE,
+        xmit_gap=DEFAULT_FRAME_GAP,
+        batch_window=DEFAULT_BATCH_WINDOW,
+        batch_size=None,
+        lane_weights=None,
+        metrics=None,
+    ):
+        super().__init__(
+            baud_rate=baud_rate,
+            xmit_rate=xmit_rate,
+            xmit_burst=xmit_burst,
+            xmit_gap=xmit_gap,
+            batch_window=batch_window,
+            batch_size=batch_size,
+            lane_weights=lane_weights,
+            metrics=metrics,
+        )
+
         self.logger = logging.getLogger(__name__).getChild("RadioComm")
+
         self.logger.debug("opening radio on %s [%d]", serial_port, baud_rate)
 
-        self.comm = serial.Serial(serial_port, baud_rate, timeout=1)
-        self.comm_lock = threading.Lock()
+        # reads and writes happen on separate threads without a shared lock
+        self.comm = serial.Serial(serial_port, baud_rate, timeout=WORKER_POLL_INTERVAL)
 
         self.workers_active = True
+        self.closing = threading.Event()
 
-        # initialize transmitter event / thread / queue
-        self.xmit_queue = queue.Queue()
+        # initialize transmitter thread
         self.xmit_thread = threading.Thread(target=self._xmit_worker, daemon=True)
         self.xmit_thread.start()
 
@@ -70,20 +209,16 @@ class RadioComm(RadioBase):
 
         self.logger.info("Radio online -- %s", serial_port)
 
-    def send(self, data):
-        if data is None or len(data) == 0:
-            return False
-
-        self.logger.debug("queueing XMIT message -- %s...", data[:10])
-        self.xmit_queue.put(data)
-
-        return True
-
     def close(self):
         self.logger.debug("closing radio comms...")
         self.workers_active = False
+        self.closing.set()
 
-        # TODO support timeouts on thread joins
+        # wake the transmitter if it is waiting on the queue
+        self.xmit_queue.put(None)
+
+        # wake the receiver if it is waiting for data
+        self.comm.cancel_read()
 
         self.logger.debug("- waiting for transmitter...")
         self.xmit_thread.join()
@@ -98,37 +233,255 @@ class RadioComm(RadioBase):
 
     def _recv_worker(self):
         while self.workers_active:
-            data = None
+            try:
+                data = self._read_available()
+            except serial.SerialException as err:
+                self.logger.warning("radio read failed -- %s", err)
+                break
 
-            with self.comm_lock:
-                data = self.comm.read(RECV_BLOCK_SIZE)
+            if data:
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug("recv -- %s", Dump(data))
 
-            if data and len(data) > 0:
-                self.logger.debug("recv -- %s...", data[:10])
+                self.metric_bytes_in.inc(len(data))
                 self.on_recv(self, data)
 
-            # unlike the xmit thread, we do a quick sleep here as a yield for
-            # outgoing messages and quickly resume looking for incoming data
+    # wait for at least one byte, then take whatever else has arrived
+    def _read_available(self):
+        data = self.comm.read(1)
+
+        if data:
+            waiting = self.comm.in_waiting
 
-            time.sleep(0)
+            if waiting > 0:
+                data += self.comm.read(min(waiting, RECV_BLOCK_SIZE))
+
+        return data
 
     def _xmit_worker(self):
+        data = None
+
         while self.workers_active:
-            try:
-                data = self.xmit_queue.get(False)
-                self.logger.debug("xmit -- %s...", data[:10])
+            if data is None:
+                data = self.xmit_queue.get()
+
+            # None is queued by close() to stop the worker
+            if data is None:
+                break
+
+            frames, data = collect_batch(
+                self.xmit_queue, data, self.batch_window, self.batch_size
+            )
+
+            batch = b"".join(frames)
+            started = time.monotonic()
+
+            if not self._wait_for_xmit(len(batch)):
+                break
+
+            self.metric_xmit_wait.observe(time.monotonic() - started)
+
+            self.logger.debug("xmit -- %d frame(s) / %d bytes", len(frames), len(batch))
+
+            self.comm.write(batch)
+
+            self._batch_sent(frames, batch)
+
+    # wait for the scheduler to allow a frame; returns False if closing
+    def _wait_for_xmit(self, size):
+        delay = self.scheduler.delay(size)
+
+        while delay > 0:
+            if self.closing.wait(delay):
+                return False
+
+            delay = self.scheduler.delay(size)
+
+        return self.workers_active
+
+
+# a serial radio driven by an asyncio event loop (running in its own thread);
+# reads and writes use the non-blocking file descriptor of the port directly,
+# so the receiver and transmitter never wait on each other
+class RadioAsync(QueuedRadio):
+    def __init__(
+        self,
+        serial_port,
+        baud_rate=9600,
+        xmit_rate=None,
+        xmit_burst=DEFAULT_BURST_SIZE,
+        xmit_gap=DEFAULT_FRAME_GAP,
+        batch_window=DEFAULT_BATCH_WINDOW,
+        batch_size=None,
+        lane_weights=None,
+        metrics=None,
+    ):
+        super().__init__(
+            baud_rate=baud_rate,
+            xmit_rate=xmit_rate,
+            xmit_burst=xmit_burst,
+            xmit_gap=xmit_gap,
+            batch_window=batch_window,
+            batch_size=batch_size,
+            lane_weights=lane_weights,
+            metrics=metrics,
+        )
+
+        self.logger = logging.getLogger(__name__).getChild("RadioAsync")
+        self.logger.debug("opening radio on %s [%d]", serial_port, baud_rate)
+
+        # pyserial configures the port; after that, we only use the descriptor
+        self.comm = serial.Serial(serial_port, baud_rate, timeout=0)
+        self.fd = self.comm.fileno()
+        os.set_blocking(self.fd, False)
+
+        self.loop = asyncio.new_event_loop()
+        self.xmit_ready = asyncio.Event()
+        self.xmit_task = None
+
+        started = threading.Event()
+
+        self.loop_thread = threading.Thread(
+            target=self._run_loop, args=(started,), daemon=True
+        )
+        self.loop_thread.start()
 
-                with self.comm_lock:
-                    self.comm.write(data)
+        started.wait()
 
-                self.on_xmit(self, data)
+        self.logger.info("Radio online -- %s", serial_port)
+
+    def close(self):
+        if self.loop.is_closed():
+            return
+
+        self.logger.debug("closing radio comms...")
+
+        # stop the reader and transmitter; unsent frames are dropped
+        shutdown = asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop)
+        shutdown.result()
+
+        self.logger.debug("- stopping event loop...")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loop_thread.join()
+        self.loop.close()
+
+        self.logger.debug("- closing serial port...")
+        self.comm.close()
+
+        self.logger.info("Radio offline.")
+
+    def _wake_transmitter(self):
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.xmit_ready.set)
+
+    def _run_loop(self, started):
+        asyncio.set_event_loop(self.loop)
+
+        self.loop.add_reader(self.fd, self._read_ready)
+        self.xmit_task = self.loop.create_task(self._xmit_worker())
+
+        self.loop.call_soon(started.set)
+        self.loop.run_forever()
+
+    async def _shutdown(self):
+        self.loop.remove_reader(self.fd)
+        self.loop.remove_writer(self.fd)
+
+        self.xmit_task.cancel()
+
+        try:
+            await self.xmit_task
+        except asyncio.CancelledError:
+            pass
+
+    def _read_ready(self):
+        try:
+            data = os.read(self.fd, RECV_BLOCK_SIZE)
+        except BlockingIOError:
+            return
+        except OSError as err:
+            # e.g. EIO when the other end of a pty has been closed
+            self.logger.warning("radio read failed -- %s", err)
+            self.loop.remove_reader(self.fd)
+            return
+
+        if not data:
+            self.logger.warning("radio port closed")
+            self.loop.remove_reader(self.fd)
+            return
+
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("recv -- %s", Dump(data))
 
-            # raised if the queue is empty during timeout
+        self.metric_bytes_in.inc(len(data))
+        self.on_recv(self, data)
+
+    async def _xmit_worker(self):
+        data = None
+
+        while True:
+            if data is None:
+                data = await self._next_frame()
+
+            frames, data = collect_batch(self.xmit_queue, data, 0, self.batch_size)
+            batch = b"".join(frames)
+            started = time.monotonic()
+
+            delay = self.scheduler.delay(len(batch))
+
+            while delay > 0:
+                await asyncio.sleep(delay)
+                delay = self.scheduler.delay(len(batch))
+
+            self.metric_xmit_wait.observe(time.monotonic() - started)
+
+            self.logger.debug("xmit -- %d frame(s) / %d bytes", len(frames), len(batch))
+
+            await self._write(batch)
+
+            self._batch_sent(frames, batch)
+
+    # wait for the next frame, allowing others to join it during the window
+    async def _next_frame(self):
+        while True:
+            try:
+                data = self.xmit_queue.get_nowait()
             except queue.Empty:
-                pass
+                self.xmit_ready.clear()
+                await self.xmit_ready.wait()
+                continue
+
+            if self.batch_window > 0:
+                await asyncio.sleep(self.batch_window)
+
+            return data
+
+    async def _write(self, data):
+        view = memoryview(data)
+
+        while view:
+            try:
+                count = os.write(self.fd, view)
+            except BlockingIOError:
+                count = 0
+
+            view = view[count:]
+
+            if view:
+                await self._writable()
+
+    async def _writable(self):
+        ready = self.loop.create_future()
+
+        def on_writable():
+            self.loop.remove_writer(self.fd)
+
+            if not ready.done():
+                ready.set_result(None)
 
-            # the sleep here serves two purposes:
-            # - yield to the recv thread
-            # - limit transmission rate
+        self.loop.add_writer(self.fd, on_writable)
 
-            time.sleep(1)
+        try:
+            await ready
+        finally:
+            self.loop.remove_writer(self.fd)
@@ -0,0 +1,690 @@
+##
+# juliet - Copyright (c) Jason Heddings. All rights reserved.
+# Licensed under the MIT License. See LICENSE for full terms.
+##
+
+import logging
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict, deque
+
+from .event import Event
+from .message import (
+    Message,
+    MessageBuffer,
+    lazy_field,
+    pack_frame,
+    parse_epoch,
+    split_frame,
+)
+from .radio import RadioBase
+from .trace import Dump
+from .transfer import format_ranges, parse_ranges
+from .xmit import Priority
+
+# the number of frames that may be waiting for an ACK at once
+DEFAULT_WINDOW = 8
+
+# how long a receiver waits for outgoing traffic to carry its ACK
+DEFAULT_ACK_DELAY = 1.0
+
+# retransmit timeouts (in seconds) before and after measuring round trips
+DEFAULT_INITIAL_RTO = 5.0
+MIN_RTO = 1.0
+MAX_RTO = 60.0
+
+DEFAULT_MAX_RETRIES = 5
+
+# peers that have not been heard from in this long no longer need to ACK
+DEFAULT_PEER_TIMEOUT = 600
+
+DEFAULT_TICK_INTERVAL = 0.1
+
+# the largest number of out-of-order frames tracked for each peer
+MAX_SELECTIVE_ACKS = 256
+
+station_re = re.compile(r"[\w/-]+", re.ASCII)
+
+# each instance numbers its frames from 0, so frames also carry a random
+# session id; a new id tells peers that the station has restarted
+SESSION_BYTES = 4
+
+session_re = re.compile(f"[0-9a-f]{{{SESSION_BYTES * 2}}}")
+
+
+def check_station(station):
+    if station is None or not station_re.fullmatch(station):
+        raise ValueError(f"invalid station name: {station}")
+
+    return station
+
+
+def new_session():
+    return secrets.token_hex(SESSION_BYTES)
+
+
+# an empty session comes from a station that does not send one
+def check_session(session):
+    if not session:
+        return None
+
+    if not session_re.fullmatch(session):
+        raise ValueError(f"invalid session: {session}")
+
+    return session
+
+
+# format ACKs as "PEER=cum+ranges;..." -- cum is the highest frame received in
+# order and the (optional) ranges list frames received beyond that
+def format_acks(acks):
+    parts = []
+
+    for peer, (cum, received) in sorted(acks.items()):
+        if received:
+            parts.append(f"{peer}={cum}+{format_ranges(received)}")
+        else:
+            parts.append(f"{peer}={cum}")
+
+    return ";".join(parts)
+
+
+def parse_acks(text):
+    acks = {}
+
+    if not text:
+        return acks
+
+    for part in text.split(";"):
+        peer, _, value = part.partition("=")
+        cum, _, ranges = value.partition("+")
+
+        limit = int(cum) + MAX_SELECTIVE_ACKS * 2 + 2
+        acks[check_station(peer)] = (int(cum), parse_ranges(ranges, limit=limit))
+
+    return acks
+
+
+# a frame sent with a sequence number (and any ACKs for the frames we received);
+# this carries the fields of the original frame, so that it can be rebuilt
+class SequencedMessage(Message):
+    __slots__ = ("_station", "_session", "_seq", "_base", "_acks", "_inner_version")
+
+    version = 10
+
+    station = lazy_field("station")
+    session = lazy_field("session")
+    seq = lazy_field("seq")
+    base = lazy_field("base")
+    acks = lazy_field("acks")
+    inner_version = lazy_field("inner_version")
+
+    def __init__(
+        self,
+        content,
+        inner_version,
+        station,
+        seq,
+        base=0,
+        acks=None,
+        session=None,
+        sender=None,
+        signature=None,
+        timestamp=None,
+    ):
+        super().__init__(content, sender, signature, timestamp)
+
+        self.inner_version = inner_version
+        self.station = station
+        self.session = session
+        self.seq = seq
+        self.base = base
+        self.acks = acks or {}
+
+    # wrap a packed frame from another message
+    @classmethod
+    def wrap(cls, frame, station, seq, base=0, acks=None, session=None):
+        fields = split_frame(frame)
+
+        if fields is None:
+            raise ValueError("invalid message data")
+
+        ver, crc, sender, tstamp, content, sig = fields
+
+        return cls(
+            str(content, "utf-8"),
+            int(ver, 16),
+            station,
+            seq,
+            base=base,
+            acks=acks,
+            session=session,
+            sender=None if sender is None else sender.decode("ascii"),
+            signature=None if sig is None else sig.decode("ascii"),
+            timestamp=parse_epoch(tstamp),
+        )
+
+    # the original frame, exactly as it was given to wrap()
+    def unwrap(self):
+        return pack_frame(
+            self.inner_version,
+            self.sender,
+            self.epoch,
+            self.content,
+            self.signature,
+        )
+
+    def pack_content(self):
+        return (
+            f"{self.station}|{self.session or ''}|{self.seq}|{self.base}|"
+            f"{format_acks(self.acks)}|{self.inner_version:X}|{self.content}"
+        )
+
+    def unpack_content(self, packed):
+        fields = packed.split("|", 6)
+        station, session, seq, base, acks, inner_version, content = fields
+
+        self._station = check_station(station)
+        self._session = check_session(session)
+        self._seq = int(seq)
+        self._base = int(base)
+        self._acks = parse_acks(acks)
+        self._inner_version = int(inner_version, 16)
+        self._content = content
+
+
+# ACKs sent on their own when there is no other traffic to carry them
+class AckMessage(Message):
+    __slots__ = ("_station", "_acks")
+
+    version = 11
+
+    station = lazy_field("station")
+    acks = lazy_field("acks")
+
+    def __init__(self, station, acks, signature=None, timestamp=None):
+        super().__init__(None, station, signature, timestamp)
+
+        self.station = station
+        self.acks = acks
+
+    def pack_content(self):
+        return f"{self.station}|{format_acks(self.acks)}"
+
+    def unpack_content(self, packed):
+        station, acks = packed.split("|", 1)
+
+        self._content = None
+        self._station = check_station(station)
+        self._acks = parse_acks(acks)
+
+
+# smoothed round trip time and retransmit timeout (following RFC 6298)
+class RttEstimator:
+    def __init__(self, initial=DEFAULT_INITIAL_RTO, min_rto=MIN_RTO, max_rto=MAX_RTO):
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial
+
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+
+        rto = self.srtt + 4 * self.rttvar
+        self.rto = min(max(rto, self.min_rto), self.max_rto)
+
+
+class Peer:
+    def __init__(self, name, initial_rto=DEFAULT_INITIAL_RTO, session=None):
+        self.name = name
+        self.session = session
+        self.rtt = RttEstimator(initial_rto)
+        self.last_heard = None
+
+        # frames received from this peer
+        self.cum = None
+        self.received = set()
+
+        self.ack_due = None
+
+    # track a frame from this peer; returns False if it was already received
+    def receive(self, seq, base):
+        if self.cum is None:
+            self.cum = base - 1
+
+        # the peer has given up on anything before base
+        if base - 1 > self.cum:
+            self.cum = base - 1
+            self.received = {idx for idx in self.received if idx > self.cum}
+
+        if seq <= self.cum or seq in self.received:
+            return False
+
+        self.received.add(seq)
+
+        while self.cum + 1 in self.received:
+            self.cum += 1
+            self.received.remove(self.cum)
+
+        # keep the selective ACKs bounded if a gap is never filled
+        while len(self.received) > MAX_SELECTIVE_ACKS:
+            self.received.remove(min(self.received))
+
+        return True
+
+    def ack(self):
+        return (self.cum, sorted(self.received))
+
+
+class PendingFrame:
+    def __init__(self, seq, data, priority, waiting):
+        self.seq = seq
+        self.data = data
+        self.priority = priority
+
+        # peers that have not yet acknowledged this frame
+        self.waiting = waiting
+
+        self.sent_at = None
+        self.deadline = None
+        self.retries = 0
+
+
+# splits incoming data into frames for the reliable layer
+class FrameBuffer(MessageBuffer):
+    def __init__(self, handler):
+        super().__init__()
+        self.handler = handler
+
+    def unpack_frame(self, frame):
+        self.handler(frame)
+
+
+# Events => Handler Function
+#   on_xmit => func(radio, data)
+#   on_recv => func(radio, data)
+#   on_failed => func(radio, data)
+
+
+# reliable delivery over another radio; frames are numbered by each station and
+# every peer acknowledges the frames it receives (ACKs ride along with outgoing
+# frames where possible).  frames that are not acknowledged in time are sent
+# again, up to a limit, with timeouts based on the observed round trip times.
+#
+# frames from stations that do not use this layer are passed through as-is.
+class ReliableRadio(RadioBase):
+    def __init__(
+        self,
+        radio,
+        station,
+        peers=None,
+        window=DEFAULT_WINDOW,
+        ack_delay=DEFAULT_ACK_DELAY,
+        max_retries=DEFAULT_MAX_RETRIES,
+        initial_rto=DEFAULT_INITIAL_RTO,
+        peer_timeout=DEFAULT_PEER_TIMEOUT,
+        tick_interval=DEFAULT_TICK_INTERVAL,
+        clock=time.monotonic,
+    ):
+        super().__init__()
+
+        if window is None or window <= 0:
+            raise ValueError("window must be greater than zero")
+
+        self.logger = logging.getLogger(__name__).getChild("ReliableRadio")
+
+        self.radio = radio
+        self.station = check_station(station)
+        self.session = new_session()
+
+        self.window = window
+        self.ack_delay = ack_delay
+        self.max_retries = max_retries
+        self.initial_rto = initial_rto
+        self.peer_timeout = peer_timeout
+        self.clock = clock
+
+        self.on_failed = Event()
+
+        self.lock = threading.RLock()
+
+        self.next_seq = 0
+        self.pending = OrderedDict()
+        self.backlog = deque()
+
+        # configured peers are always expected to ACK; others once heard
+        self.static_peers = {check_station(peer) for peer in peers or []}
+        self.peers = {}
+
+        self.counters = {
+            "sent": 0,
+            "retransmits": 0,
+            "acked": 0,
+            "failed": 0,
+            "received": 0,
+            "duplicates": 0,
+            "acks_sent": 0,
+        }
+
+        self.frames = FrameBuffer(self._handle_frame)
+        radio.on_recv += self._radio_recv
+
+        self.closing = threading.Event()
+        self.tick_thread = None
+
+        if tick_interval:
+            self.tick_thread = threading.Thread(
+                target=self._tick_worker, args=(tick_interval,), daemon=True
+            )
+            self.tick_thread.start()
+
+    def send(self, data, priority=Priority.CHANNEL):
+        if data is None or len(data) == 0:
+            return False
+
+        # anything that is not a frame cannot be sequenced
+        if split_frame(data) is None:
+            return self.radio.send(data, priority=priority)
+
+        with self.lock:
+            if len(self.pending) >= self.window:
+                self.backlog.append((data, priority))
+            else:
+                self._send_new(data, priority)
+
+        return True
+
+    @property
+    def queue_depth(self):
+        with self.lock:
+            waiting = len(self.backlog)
+
+        return waiting + getattr(self.radio, "queue_depth", 0)
+
+    def stats(self):
+        with self.lock:
+            return {
+                **self.counters,
+                "pending": len(self.pending),
+                "backlog": len(self.backlog),
+                "peers": {
+                    peer.name: {"srtt": peer.rtt.srtt, "rto": peer.rtt.rto}
+                    for peer in self.peers.values()
+                },
+            }
+
+    def close(self):
+        self.closing.set()
+
+        if self.tick_thread is not None:
+            self.tick_thread.join()
+
+        self.radio.on_recv -= self._radio_recv
+        self.radio.close()
+
+    # retransmit frames, send overdue ACKs and refill the window
+    def tick(self):
+        failed = []
+
+        with self.lock:
+            now = self.clock()
+
+            self._expire_peers(now)
+
+            for entry in list(self.pending.values()):
+                if not entry.waiting:
+                    del self.pending[entry.seq]
+
+                elif now >= entry.deadline:
+                    if entry.retries >= self.max_retries:
+                        self.logger.warning(
+                            "no ACK for frame %d from %s; giving up",
+                            entry.seq,
+                            ", ".join(sorted(entry.waiting)),
+                        )
+                        del self.pending[entry.seq]
+                        self.counters["failed"] += 1
+                        failed.append(entry.data)
+
+                    else:
+                        entry.retries += 1
+                        self.counters["retransmits"] += 1
+                        self._transmit(entry)
+
+            self._send_acks(now)
+            self._fill_window()
+
+        for data in failed:
+            self.on_failed(self, data)
+
+    def _tick_worker(self, interval):
+        while not self.closing.wait(interval):
+            self.tick()
+
+    def _peer(self, name):
+        peer = self.peers.get(name)
+
+        if peer is None:
+            self.logger.debug("new peer -- %s", name)
+            peer = self.peers[name] = Peer(name, self.initial_rto)
+
+        return peer
+
+    # the peer that sent a sequenced frame; when the session changes, the
+    # station has restarted and numbers its frames from the beginning again
+    def _session_peer(self, name, session):
+        peer = self._peer(name)
+
+        if peer.session == session:
+            return peer
+
+        if peer.cum is not None:
+            self.logger.info("peer restarted -- %s", name)
+            peer = self.peers[name] = Peer(name, self.initial_rto)
+
+        peer.session = session
+        return peer
+
+    # the peers that are expected to acknowledge new frames
+    def _active_peers(self, now):
+        active = set(self.static_peers)
+
+        for peer in self.peers.values():
+            if peer.last_heard is not None:
+                if now - peer.last_heard < self.peer_timeout:
+                    active.add(peer.name)
+
+        return active
+
+    def _expire_peers(self, now):
+        active = self._active_peers(now)
+
+        for entry in self.pending.values():
+            entry.waiting &= active
+
+        # forget the sequence state of peers that have gone quiet
+        for name, peer in list(self.peers.items()):
+            if peer.last_heard is None or name in active:
+                continue
+
+            if peer.ack_due is None:
+                self.logger.debug("forgetting peer -- %s", name)
+                del self.peers[name]
+
+    def _send_new(self, data, priority):
+        now = self.clock()
+
+        entry = PendingFrame(self.next_seq, data, priority, self._active_peers(now))
+        self.next_seq += 1
+
+        # frames are only kept if someone is expected to ACK them
+        if entry.waiting:
+            self.pending[entry.seq] = entry
+
+        self.counters["sent"] += 1
+        self._transmit(entry)
+
+        self.on_xmit(self, data)
+
+    def _transmit(self, entry):
+        now = self.clock()
+
+        base = next(iter(self.pending), entry.seq)
+        msg = SequencedMessage.wrap(
+            entry.data,
+            self.station,
+            entry.seq,
+            base=base,
+            acks=self._take_acks(),
+            session=self.session,
+        )
+
+        rto = max(
+            (self._peer(name).rtt.rto for name in entry.waiting),
+            default=self.initial_rto,
+        )
+
+        entry.sent_at = now
+        entry.deadline = now + min(rto * 2**entry.retries, MAX_RTO)
+
+        self.radio.send(msg.pack(), priority=entry.priority)
+
+    def _fill_window(self):
+        while self.backlog and len(self.pending) < self.window:
+            data, priority = self.backlog.popleft()
+            self._send_new(data, priority)
+
+    # collect ACKs for all peers that are waiting for one
+    def _take_acks(self):
+        acks = {}
+
+        for peer in self.peers.values():
+            if peer.ack_due is not None:
+                acks[peer.name] = peer.ack()
+                peer.ack_due = None
+
+        return acks
+
+    def _send_acks(self, now):
+        due = any(
+            peer.ack_due is not None and peer.ack_due <= now
+            for peer in self.peers.values()
+        )
+
+        if not due:
+            return
+
+        msg = AckMessage(self.station, self._take_acks())
+
+        self.counters["acks_sent"] += 1
+        self.radio.send(msg.pack(), priority=Priority.CONTROL)
+
+    def _radio_recv(self, radio, data):
+        self.frames.append(data)
+
+    def _handle_frame(self, frame):
+        fields = split_frame(frame)
+
+        if fields is None:
+            return
+
+        version = int(fields[0], 16)
+
+        if version not in (SequencedMessage.version, AckMessage.version):
+            self.on_recv(self, frame)
+            return
+
+        # content is decoded lazily, so it is checked here rather than part
+        # way through handling the frame
+        try:
+            msg = Message.unpack(frame, fields=fields)
+
+            if msg is None:
+                return
+
+            msg.load()
+
+        except ValueError:
+            self.logger.warning("invalid reliable frame -- %s", Dump(frame))
+            return
+
+        if version == SequencedMessage.version:
+            self._handle_sequenced(msg)
+        else:
+            self._handle_ack(msg)
+
+    def _handle_sequenced(self, msg):
+        deliver = True
+
+        # our own frames come back when the radio is a loopback
+        if msg.station != self.station:
+            with self.lock:
+                now = self.clock()
+
+                peer = self._session_peer(msg.station, msg.session)
+                peer.last_heard = now
+
+                self._process_acks(peer, msg.acks, now)
+
+                deliver = peer.receive(msg.seq, msg.base)
+
+                # ACK duplicates too, in case the last ACK was lost
+                if peer.ack_due is None:
+                    peer.ack_due = now + self.ack_delay
+
+                if deliver:
+                    self.counters["received"] += 1
+                else:
+                    self.counters["duplicates"] += 1
+
+                self._fill_window()
+
+        if deliver:
+            self.on_recv(self, msg.unwrap())
+
+    def _handle_ack(self, msg):
+        if msg.station == self.station:
+            return
+
+        with self.lock:
+            now = self.clock()
+
+            peer = self._peer(msg.station)
+            peer.last_heard = now
+
+            self._process_acks(peer, msg.acks, now)
+            self._fill_window()
+
+    def _process_acks(self, peer, acks, now):
+        ack = acks.get(self.station)
+
+        if ack is None:
+            return
+
+        cum, received = ack
+        received = set(received)
+
+        for entry in list(self.pending.values()):
+            if peer.name not in entry.waiting:
+                continue
+
+            if entry.seq > cum and entry.seq not in received:
+                continue
+
+            entry.waiting.discard(peer.name)
+
+            # only frames that were sent once give a clear round trip time
+            if entry.retries == 0:
+                peer.rtt.sample(now - entry.sent_at)
+
+            if not entry.waiting:
+                del self.pending[entry.seq]
+                self.counters["acked"] += 1
@@ -0,0 +1,245 @@
+##
+# juliet - Copyright (c) Jason Heddings. All rights reserved.
+# Licensed under the MIT License. See LICENSE for full terms.
+##
+
+# feeds capture files through a MessageBuffer, either as fast as possible or
+# at the speed they were recorded, and reports what was found:
+#
+#   python -m juliet.replay radio.cap.2 radio.cap.1 radio.cap
+
+import argparse
+import logging
+import sys
+import time
+from collections import Counter
+
+from .capture import CaptureReader, Direction
+from .dedup import DedupCache
+from .message import MessageBuffer
+from .metrics import MetricsRegistry
+
+# in fast mode, consecutive records are joined into blocks of up to this size
+DEFAULT_REPLAY_BLOCK = 64 * 1024
+
+DIRECTIONS = {
+    "recv": (Direction.RECV,),
+    "xmit": (Direction.XMIT,),
+    "all": (Direction.RECV, Direction.XMIT),
+}
+
+
+class ReplayStats:
+    def __init__(self):
+        self.files = 0
+        self.records = 0
+        self.replayed = 0
+        self.bytes = 0
+        self.elapsed = 0.0
+        self.truncated = 0
+
+        self.first_time = None
+        self.last_time = None
+
+        self.messages = Counter()
+
+        self.invalid = 0
+        self.duplicates = 0
+        self.trimmed = 0
+
+    @property
+    def span(self):
+        if self.first_time is None:
+            return 0.0
+
+        return self.last_time - self.first_time
+
+    @property
+    def throughput(self):
+        return self.bytes / self.elapsed if self.elapsed else 0.0
+
+    def report(self):
+        total = sum(self.messages.values())
+        rate = total / self.elapsed if self.elapsed else 0.0
+
+        lines = [
+            f"files:          {self.files} ({self.truncated} truncated)",
+            f"records:        {self.records} ({self.replayed} replayed)",
+            f"captured span:  {format_span(self.span)}",
+            f"replayed:       {self.bytes / 1024 / 1024:0.2f} MiB in "
+            f"{self.elapsed:0.3f} s ({self.throughput / 1024 / 1024:0.2f} MiB/s)",
+            f"messages:       {total} ({rate:0.0f} msg/s)",
+        ]
+
+        for name, count in self.messages.most_common():
+            lines.append(f"  {name:<22} {count}")
+
+        lines.extend(
+            [
+                f"invalid frames: {self.invalid}",
+                f"duplicates:     {self.duplicates}",
+                f"bytes trimmed:  {self.trimmed}",
+            ]
+        )
+
+        return "\n".join(lines)
+
+
+def format_span(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:d}:{minutes:02d}:{seconds:02d}"
+
+
+class Replay:
+    def __init__(
+        self,
+        directions=DIRECTIONS["recv"],
+        speed=None,
+        dedup=False,
+        block_size=DEFAULT_REPLAY_BLOCK,
+        sleep=time.sleep,
+    ):
+        if speed is not None and speed <= 0:
+            raise ValueError("speed must be greater than zero")
+
+        self.directions = set(directions)
+        self.speed = speed
+        self.block_size = block_size
+        self.sleep = sleep
+
+        self.stats = ReplayStats()
+        self.metrics = MetricsRegistry()
+
+        self.msgbuf = MessageBuffer(
+            dedup=DedupCache() if dedup else None, metrics=self.metrics
+        )
+        self.msgbuf.on_message += self._count_message
+
+    # replay the given files in order; returns the stats for all files so far
+    def run(self, paths):
+        started = time.perf_counter()
+
+        for path in paths:
+            with CaptureReader(path) as reader:
+                if self.speed is None:
+                    self._replay_fast(reader)
+                else:
+                    self._replay_paced(reader, started)
+
+                self.stats.files += 1
+
+                if reader.truncated:
+                    self.stats.truncated += 1
+
+        self.stats.elapsed += time.perf_counter() - started
+        self._collect_metrics()
+
+        return self.stats
+
+    def _records(self, reader):
+        stats = self.stats
+
+        for tstamp, direction, data in reader:
+            stats.records += 1
+
+            if stats.first_time is None:
+                stats.first_time = tstamp
+
+            stats.last_time = tstamp
+
+            if direction in self.directions:
+                stats.replayed += 1
+                stats.bytes += len(data)
+                yield tstamp, data
+
+    # join small records into larger blocks; the buffer finds the same frames
+    def _replay_fast(self, reader):
+        block = []
+        size = 0
+
+        for _, data in self._records(reader):
+            block.append(data)
+            size += len(data)
+
+            if size >= self.block_size:
+                self.msgbuf.append(b"".join(block))
+                block.clear()
+                size = 0
+
+        if block:
+            self.msgbuf.append(b"".join(block))
+
+    # wait between records to match the original timing
+    def _replay_paced(self, reader, started):
+        for tstamp, data in self._records(reader):
+            offset = (tstamp - self.stats.first_time) / self.speed
+            delay = started + offset - time.perf_counter()
+
+            if delay > 0:
+                self.sleep(delay)
+
+            self.msgbuf.append(data)
+
+    # decode each message, as the bot would, so that bad content is counted
+    # as an invalid frame (by the buffer) rather than as a message
+    def _count_message(self, mbuf, msg):
+        msg.load()
+        self.stats.messages[type(msg).__name__] += 1
+
+    def _collect_metrics(self):
+        snapshot = self.metrics.snapshot()
+
+        self.stats.invalid = snapshot["buffer_invalid_frames"][()]
+        self.stats.duplicates = snapshot["buffer_duplicate_frames"][()]
+        self.stats.trimmed = snapshot["buffer_bytes_trimmed"][()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m juliet.replay",
+        description="Replay radio capture files through the message parser.",
+    )
+
+    parser.add_argument("files", nargs="+", help="capture files (oldest first)")
+    parser.add_argument(
+        "--direction",
+        choices=sorted(DIRECTIONS),
+        default="recv",
+        help="which records to replay (default: recv)",
+    )
+    parser.add_argument(
+        "--realtime",
+        action="store_const",
+        const=1.0,
+        dest="speed",
+        help="replay at the speed the traffic was captured",
+    )
+    parser.add_argument(
+        "--speed",
+        type=float,
+        help="replay at a multiple of the captured speed (e.g. 10)",
+    )
+    parser.add_argument(
+        "--dedup", action="store_true", help="drop repeated frames while replaying"
+    )
+
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.ERROR)
+
+    replay = Replay(DIRECTIONS[args.direction], speed=args.speed, dedup=args.dedup)
+
+    try:
+        stats = replay.run(args.files)
+    except (OSError, ValueError) as err:
+        print(f"ERROR: {err}", file=sys.stderr)
+        return 1
+
+    print(stats.report())
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,432 @@
+##
+# juliet - Copyright (c) Jason Heddings. All rights reserved.
+# Licensed under the MIT License. See LICENSE for full terms.
+##
+
+import heapq
+import itertools
+import logging
+import math
+import queue
+import random
+import threading
+import time
+
+from .radio import QueuedRadio
+from .xmit import BITS_PER_BYTE, DEFAULT_BURST_SIZE, collect_batch
+
+# roughly the data rate of D-STAR slow data (in bits per second)
+DEFAULT_SIM_BAUD = 1200
+
+# time for a radio to key up before any data is sent
+DEFAULT_KEYUP_DELAY = 0.2
+
+# the largest number of bytes returned by a single read
+DEFAULT_READ_SIZE = 64
+
+# how long past transmissions are kept to look for collisions
+COLLISION_HISTORY = 60
+
+
+# a GPS sentence in the style that D-STAR radios mix into the data stream
+def gps_sentence(rand):
+    if rand.random() < 0.5:
+        fields = (
+            f"GPRMC,{rand.randrange(24):02d}{rand.randrange(60):02d}"
+            f"{rand.randrange(60):02d},A,{rand.uniform(0, 9000):07.2f},N,"
+            f"{rand.uniform(0, 18000):08.2f},W,{rand.uniform(0, 99):05.1f},"
+            f"{rand.uniform(0, 359):05.1f},170326,,,A"
+        )
+
+        crc = 0
+
+        for ch in fields:
+            crc ^= ord(ch)
+
+        return f"${fields}*{crc:02X}\r\n".encode("ascii")
+
+    # DPRS position reports include a station path (with a '>')
+    return (
+        f"$$CRC{rand.getrandbits(16):04X},N0CALL>API282,DSTAR*:"
+        f"!{rand.uniform(0, 9000):07.2f}N/{rand.uniform(0, 18000):08.2f}W>/\r\n"
+    ).encode("ascii")
+
+
+# the state of the path from one radio to another (for burst losses)
+class SimLink:
+    def __init__(self):
+        self.bad = False
+
+
+class Transmission:
+    def __init__(self, radio, data, start, end):
+        self.radio = radio
+        self.data = data
+        self.start = start
+        self.end = end
+
+        # receivers that lost this transmission part way through
+        self.dropped = set()
+
+    def overlaps(self, other):
+        return self.start < other.end and other.start < self.end
+
+
+# a shared radio channel for RadioSim instances; everything sent by one radio
+# is heard by all others after the channel impairments are applied:
+#
+# - data is paced at the given baud rate, after a key-up delay
+# - radios are half-duplex, so a radio cannot hear while it is transmitting
+# - overlapping transmissions collide and are lost (unless carrier_sense is
+#   enabled, in which case radios wait for the channel to be clear)
+# - bits are flipped at random, following the given bit error rate
+# - whole transmissions are lost in bursts (a Gilbert-Elliott model, where
+#   burst_loss is the chance of entering a burst and burst_length is the
+#   average number of transmissions lost once in one)
+# - received data is split across reads of random sizes
+# - GPS sentences are added to the stream at random
+#
+# time is simulated: call run() or run_until_idle() to move it forward, or set
+# realtime to follow the wall clock from a background thread.  runs with the
+# same seed are identical.
+class SimChannel:
+    def __init__(
+        self,
+        baud_rate=DEFAULT_SIM_BAUD,
+        keyup_delay=DEFAULT_KEYUP_DELAY,
+        bit_error_rate=0,
+        burst_loss=0,
+        burst_length=1,
+        read_size=DEFAULT_READ_SIZE,
+        garbage_rate=0,
+        carrier_sense=False,
+        seed=None,
+        realtime=False,
+    ):
+        if baud_rate is None or baud_rate <= 0:
+            raise ValueError("baud rate must be greater than zero")
+
+        if burst_length < 1:
+            raise ValueError("burst length must be at least one")
+
+        self.baud_rate = baud_rate
+        self.byte_time = BITS_PER_BYTE / baud_rate
+        self.keyup_delay = keyup_delay
+
+        self.bit_error_rate = bit_error_rate
+        self.bit_error_scale = -math.log1p(-bit_error_rate) if bit_error_rate < 1 else 0
+        self.burst_loss = burst_loss
+        self.burst_length = burst_length
+        self.read_size = read_size
+        self.garbage_rate = garbage_rate
+        self.carrier_sense = carrier_sense
+
+        self.rand = random.Random(seed)
+        self.logger = logging.getLogger(__name__).getChild("SimChannel")
+
+        self.radios = []
+        self.links = {}
+        self.transmissions = []
+        self.busy_until = 0.0
+
+        self.counters = {
+            "transmissions": 0,
+            "bytes": 0,
+            "collisions": 0,
+            "lost": 0,
+            "bit_errors": 0,
+            "garbage": 0,
+        }
+
+        self.now = 0.0
+        self.events = []
+        self.sequence = itertools.count()
+        self.lock = threading.RLock()
+
+        self.realtime = realtime
+        self.wakeup = threading.Condition(self.lock)
+        self.active = True
+        self.worker = None
+
+        if realtime:
+            self.epoch = time.monotonic()
+            self.worker = threading.Thread(target=self._realtime_worker, daemon=True)
+            self.worker.start()
+
+    def clock(self):
+        if self.realtime:
+            return time.monotonic() - self.epoch
+
+        return self.now
+
+    def radio(self, name=None, **kwargs):
+        return RadioSim(self, name=name, **kwargs)
+
+    def join(self, radio):
+        with self.lock:
+            for other in self.radios:
+                self.links[(radio, other)] = SimLink()
+                self.links[(other, radio)] = SimLink()
+
+            self.radios.append(radio)
+
+    def leave(self, radio):
+        with self.lock:
+            if radio in self.radios:
+                self.radios.remove(radio)
+
+    # run a callback after the given delay (in simulated seconds)
+    def schedule(self, delay, callback, *args):
+        with self.lock:
+            when = self.clock() + max(delay, 0)
+            heapq.heappush(self.events, (when, next(self.sequence), callback, args))
+            self.wakeup.notify()
+
+    # process events for the given number of simulated seconds
+    def run(self, duration):
+        with self.lock:
+            self._run_until(self.now + duration)
+
+    # process events until nothing else is scheduled (or the limit is reached)
+    def run_until_idle(self, limit=3600):
+        with self.lock:
+            deadline = self.now + limit
+
+            while self.events and self.events[0][0] <= deadline:
+                self._run_until(self.events[0][0])
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters)
+
+    def close(self):
+        with self.lock:
+            self.active = False
+            self.wakeup.notify()
+
+        if self.worker is not None:
+            self.worker.join()
+
+    def _run_until(self, until):
+        while self.events and self.events[0][0] <= until:
+            when, _, callback, args = heapq.heappop(self.events)
+            self.now = max(self.now, when)
+            callback(*args)
+
+        self.now = max(self.now, until)
+
+    def _realtime_worker(self):
+        with self.lock:
+            while self.active:
+                now = self.clock()
+
+                if self.events and self.events[0][0] <= now:
+                    when, _, callback, args = heapq.heappop(self.events)
+                    self.now = when
+                    callback(*args)
+                    continue
+
+                timeout = self.events[0][0] - now if self.events else None
+                self.wakeup.wait(timeout)
+
+    # the earliest time that a radio may start to key up
+    def next_clear(self, start):
+        if self.carrier_sense:
+            return max(start, self.busy_until)
+
+        return start
+
+    def transmit(self, radio, data, start):
+        onair = start + self.keyup_delay
+        end = onair + len(data) * self.byte_time
+
+        xmit = Transmission(radio, data, start, end)
+
+        self.transmissions.append(xmit)
+        self.busy_until = max(self.busy_until, end)
+
+        self.counters["transmissions"] += 1
+        self.counters["bytes"] += len(data)
+
+        for other in list(self.radios):
+            if other is not radio:
+                self._deliver(xmit, other, onair)
+
+        return end
+
+    def _deliver(self, xmit, receiver, onair):
+        link = self.links[(xmit.radio, receiver)]
+
+        # burst losses follow the state of each link
+        if link.bad:
+            link.bad = self.rand.random() >= 1 / self.burst_length
+        else:
+            link.bad = self.rand.random() < self.burst_loss
+
+        if link.bad:
+            self.counters["lost"] += 1
+            return
+
+        data = self._add_bit_errors(xmit.data)
+
+        if self.garbage_rate and self.rand.random() < self.garbage_rate:
+            self.counters["garbage"] += 1
+
+            garbage = gps_sentence(self.rand)
+            split = self.rand.randrange(len(data) + 1)
+
+            # noise may also land in the middle of a frame
+            if self.rand.random() < 0.5:
+                data = data[:split] + garbage + data[split:]
+            else:
+                data = garbage + data
+
+        offset = 0
+
+        while offset < len(data):
+            size = self.rand.randint(1, max(self.read_size, 1))
+            chunk = data[offset : offset + size]
+            offset += len(chunk)
+
+            arrival = onair + min(offset, len(xmit.data)) * self.byte_time
+            self.schedule(arrival - self.clock(), self._receive, xmit, receiver, chunk)
+
+    def _add_bit_errors(self, data):
+        if not self.bit_error_rate:
+            return data
+
+        nbits = len(data) * 8
+        errors = 0
+        data = bytearray(data)
+
+        # skip ahead to each flipped bit rather than testing every bit
+        pos = self._next_error(-1)
+
+        while pos < nbits:
+            data[pos // 8] ^= 1 << (pos % 8)
+            errors += 1
+            pos = self._next_error(pos)
+
+        self.counters["bit_errors"] += errors
+
+        return bytes(data)
+
+    def _next_error(self, pos):
+        if self.bit_error_rate >= 1:
+            return pos + 1
+
+        gap = self.rand.expovariate(self.bit_error_scale)
+        return pos + 1 + int(gap)
+
+    def _receive(self, xmit, receiver, chunk):
+        if receiver not in self.radios or receiver in xmit.dropped:
+            return
+
+        self._prune()
+
+        for other in self.transmissions:
+            if other is xmit or not other.overlaps(xmit):
+                continue
+
+            xmit.dropped.add(receiver)
+
+            # half-duplex: the receiver cannot hear while transmitting
+            if other.radio is receiver:
+                self.counters["lost"] += 1
+            else:
+                self.counters["collisions"] += 1
+
+            return
+
+        receiver.on_recv(receiver, chunk)
+
+    def _prune(self):
+        horizon = self.clock() - COLLISION_HISTORY
+
+        if self.transmissions and self.transmissions[0].end < horizon:
+            self.transmissions = [
+                xmit for xmit in self.transmissions if xmit.end >= horizon
+            ]
+
+
+# a radio on a simulated channel; outgoing frames use the same queue, rate limit
+# and batching as a serial radio, in simulated time
+class RadioSim(QueuedRadio):
+    def __init__(
+        self,
+        channel,
+        name=None,
+        xmit_rate=None,
+        xmit_burst=DEFAULT_BURST_SIZE,
+        xmit_gap=0,
+        batch_size=None,
+        lane_weights=None,
+    ):
+        super().__init__(
+            baud_rate=channel.baud_rate,
+            xmit_rate=xmit_rate,
+            xmit_burst=xmit_burst,
+            xmit_gap=xmit_gap,
+            batch_size=batch_size,
+            lane_weights=lane_weights,
+            clock=channel.clock,
+        )
+
+        self.logger = logging.getLogger(__name__).getChild("RadioSim")
+
+        self.name = name
+        self.channel = channel
+
+        self.transmitting = False
+        self.leftover = None
+
+        channel.join(self)
+
+    def __repr__(self):
+        return f"RadioSim({self.name})"
+
+    def close(self):
+        self.channel.leave(self)
+
+    def _wake_transmitter(self):
+        with self.channel.lock:
+            if not self.transmitting:
+                self.transmitting = True
+                self.channel.schedule(0, self._start_batch)
+
+    def _start_batch(self):
+        data = self.leftover
+        self.leftover = None
+
+        if data is None:
+            try:
+                data = self.xmit_queue.get_nowait()
+            except queue.Empty:
+                self.transmitting = False
+                return
+
+        frames, self.leftover = collect_batch(self.xmit_queue, data, 0, self.batch_size)
+        batch = b"".join(frames)
+
+        now = self.channel.clock()
+        start = self.channel.next_clear(now + self.scheduler.delay(len(batch)))
+
+        self.channel.schedule(start - now, self._send_batch, frames, batch)
+
+    def _send_batch(self, frames, batch):
+        # the channel may have become busy while waiting for the scheduler
+        now = self.channel.clock()
+        start = self.channel.next_clear(now)
+
+        if start > now:
+            self.channel.schedule(start - now, self._send_batch, frames, batch)
+            return
+
+        # the scheduler is charged for the batch once it is sent (_batch_sent)
+        end = self.channel.transmit(self, batch, now)
+
+        self.channel.schedule(end - now, self._end_batch, frames, batch)
+
+    def _end_batch(self, frames, batch):
+        self._batch_sent(frames, batch)
+        self._start_batch()
@@ -0,0 +1,43 @@
+##
+# juliet - Copyright (c) Jason Heddings. All rights reserved.
+# Licensed under the MIT License. See LICENSE for full terms.
+##
+
+# helpers for logging raw radio data; radio buffers may be megabytes long, so
+# log messages only ever show the first few bytes
+#
+# per-frame debug messages should also be guarded by checking isEnabledFor
+# first; the logging module caches the result (and resets the cache whenever
+# levels change), so the guard is cheap enough to check for each frame
+
+# the most bytes shown by a dump in log messages
+DEFAULT_DUMP_LIMIT = 32
+
+# printable ASCII is shown as-is; everything else is replaced with a '.'
+printable_table = bytes(ch if 0x20 <= ch < 0x7F else ord(".") for ch in range(256))
+
+
+# hex and ASCII for the start of the data, e.g. '3e 3e 30 3a |>>0:| +120 bytes'
+def hexdump(data, limit=DEFAULT_DUMP_LIMIT):
+    if data is None:
+        return "None"
+
+    shown = bytes(data[:limit])
+    text = f"{shown.hex(' ')} |{shown.translate(printable_table).decode('ascii')}|"
+
+    if len(data) > limit:
+        text += f" +{len(data) - limit} bytes"
+
+    return text
+
+
+# defers the hexdump until (and unless) the log message is formatted
+class Dump:
+    __slots__ = ("data", "limit")
+
+    def __init__(self, data, limit=DEFAULT_DUMP_LIMIT):
+        self.data = data
+        self.limit = limit
+
+    def __str__(self):
+        return hexdump(self.data, self.limit)
@@ -0,0 +1,744 @@
+##
+# juliet - Copyright (c) Jason Heddings. All rights reserved.
+# Licensed under the MIT License. See LICENSE for full terms.
+##
+
+import base64
+import io
+import logging
+import mimetypes
+import os
+import re
+import secrets
+import tempfile
+import threading
+import time
+import zlib
+
+from .message import (
+    CompressedMessage,
+    FileMessage,
+    Message,
+    lazy_field,
+    make_safe_filename,
+)
+
+# the number of (base64) characters carried by each fragment
+DEFAULT_CHUNK_SIZE = 256
+
+# limits for incomplete transfers on the receiving side
+DEFAULT_MAX_BUFFER = 4 * 1024 * 1024
+
+# the largest file (after decompression) written to the download folder
+DEFAULT_MAX_FILE_SIZE = 64 * 1024 * 1024
+DEFAULT_TRANSFER_TIMEOUT = 600
+DEFAULT_RETRY_INTERVAL = 30
+
+# the number of completed transfers kept by the sender for retransmission
+DEFAULT_SEND_CACHE = 8
+
+MAX_FRAGMENTS = 0xFFFF
+
+# the size of reads (and decompressed writes) when streaming files
+STREAM_BLOCK_SIZE = 64 * 1024
+
+# transfer ids are random hex strings of this many bytes
+TRANSFER_ID_BYTES = 4
+
+transfer_id_re = re.compile(f"[0-9a-f]{{{TRANSFER_ID_BYTES * 2}}}")
+
+logger = logging.getLogger(__name__)
+
+
+def new_transfer_id():
+    return secrets.token_hex(TRANSFER_ID_BYTES)
+
+
+# transfer ids arrive over the air and are used to name partial downloads, so
+# anything other than an id from new_transfer_id is rejected
+def check_transfer_id(xfer):
+    if transfer_id_re.fullmatch(xfer) is None:
+        raise ValueError(f"invalid transfer id: {xfer!r}")
+
+    return xfer
+
+
+# format a list of indices as compact ranges, e.g. [1, 2, 3, 7] => "1-3,7"
+def format_ranges(indices):
+    ranges = []
+    start = prev = None
+
+    for idx in sorted(indices):
+        if start is None:
+            start = prev = idx
+        elif idx == prev + 1:
+            prev = idx
+        else:
+            ranges.append(str(start) if start == prev else f"{start}-{prev}")
+            start = prev = idx
+
+    if start is not None:
+        ranges.append(str(start) if start == prev else f"{start}-{prev}")
+
+    return ",".join(ranges)
+
+
+def parse_ranges(text, limit=MAX_FRAGMENTS):
+    indices = []
+
+    if not text:
+        return indices
+
+    for part in text.split(","):
+        first, _, last = part.partition("-")
+        first = int(first)
+        last = int(last) if last else first
+
+        if first < 0 or last < first or last >= limit:
+            raise ValueError("invalid range")
+
+        indices.extend(range(first, last + 1))
+
+    return indices
+
+
+# one numbered piece of a compressed file; fragment 0 also carries the file
+# name and type.  each fragment is a separate frame with its own CRC.
+class FragmentMessage(Message):
+    __slots__ = ("_transfer_id", "_index", "_total", "_filename", "_mimetype")
+
+    version = 8
+
+    transfer_id = lazy_field("transfer_id")
+    index = lazy_field("index")
+    total = lazy_field("total")
+    filename = lazy_field("filename")
+    mimetype = lazy_field("mimetype")
+
+    def __init__(
+        self,
+        content,
+        transfer_id,
+        index,
+        total,
+        filename=None,
+        mimetype=None,
+        sender=None,
+        signature=None,
+        timestamp=None,
+    ):
+        super().__init__(content, sender, signature, timestamp)
+
+        self.transfer_id = transfer_id
+        self.index = index
+        self.total = total
+        self.filename = filename
+        self.mimetype = mimetype
+
+    def pack_content(self):
+        filename = make_safe_filename(self.filename) or ""
+        mimetype = self.mimetype or ""
+        return (
+            f"{self.transfer_id}|{self.index:X}|{self.total:X}|"
+            f"{filename}|{mimetype}|{self.content}"
+        )
+
+    def unpack_content(self, packed):
+        xfer, index, total, filename, mimetype, content = packed.split("|", 5)
+
+        self._transfer_id = check_transfer_id(xfer)
+        self._index = int(index, 16)
+        self._total = int(total, 16)
+        self._filename = make_safe_filename(filename)
+        self._mimetype = mimetype if len(mimetype) > 0 else None
+        self._content = content
+
+        # streamed transfers only send the total with the last fragment
+        if self._total > MAX_FRAGMENTS:
+            raise ValueError("invalid fragment count")
+
+        if self._total and self._index >= self._total:
+            raise ValueError("invalid fragment index")
+
+
+# a request to send the listed fragments of a transfer again
+class ResendMessage(Message):
+    __slots__ = ("_transfer_id", "_missing")
+
+    version = 9
+
+    transfer_id = lazy_field("transfer_id")
+    missing = lazy_field("missing")
+
+    def __init__(
+        self, transfer_id, missing, sender=None, signature=None, timestamp=None
+    ):
+        super().__init__(None, sender, signature, timestamp)
+
+        self.transfer_id = transfer_id
+        self.missing = list(missing)
+
+    def pack_content(self):
+        return f"{self.transfer_id}|{format_ranges(self.missing)}"
+
+    def unpack_content(self, packed):
+        xfer, ranges = packed.split("|", 1)
+
+        self._content = None
+        self._transfer_id = check_transfer_id(xfer)
+        self._missing = parse_ranges(ranges)
+
+
+# incrementally base64 encode a stream of bytes
+class StreamEncoder:
+    def __init__(self):
+        self.carry = b""
+
+    def encode(self, data):
+        data = self.carry + data
+        cut = len(data) - len(data) % 3
+
+        self.carry = data[cut:]
+
+        return str(base64.b64encode(data[:cut]), "ascii")
+
+    def finish(self):
+        data = self.carry
+        self.carry = b""
+
+        return str(base64.b64encode(data), "ascii")
+
+
+# incrementally decode and decompress a transfer, writing the result to `sink`;
+# if a limit is given, writing more than that many bytes is an error
+class StreamDecoder:
+    def __init__(self, sink, limit=None):
+        self.sink = sink
+        self.limit = limit
+        self.carry = ""
+        self.size = 0
+
+        self.decompressor = zlib.decompressobj()
+
+    def write(self, text):
+        text = self.carry + text
+        cut = len(text) - len(text) % 4
+
+        self.carry = text[cut:]
+
+        if cut > 0:
+            self._decompress(base64.b64decode(text[:cut]))
+
+    def finish(self):
+        if self.carry:
+            self._decompress(base64.b64decode(self.carry))
+            self.carry = ""
+
+        self._write(self.decompressor.flush())
+
+        if not self.decompressor.eof:
+            raise ValueError("incomplete transfer data")
+
+    def _decompress(self, data):
+        try:
+            # limit the output of each step (in case of very compressible data)
+            while data:
+                self._write(self.decompressor.decompress(data, STREAM_BLOCK_SIZE))
+                data = self.decompressor.unconsumed_tail
+        except zlib.error as err:
+            raise ValueError("invalid transfer data") from err
+
+    def _write(self, data):
+        if not data:
+            return
+
+        if self.limit is not None and self.size + len(data) > self.limit:
+            raise ValueError("transfer is too large")
+
+        self.sink.write(data)
+        self.size += len(data)
+
+
+# read a binary file object and produce the fragments for sending it; the
+# file is compressed and encoded as it is read, so only a small part of it is
+# ever held in memory.  since the number of fragments is not known until the
+# end, only the last fragment carries the total (the others use 0).
+def stream_fragments(
+    fileobj,
+    transfer_id,
+    filename=None,
+    mimetype=None,
+    sender=None,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+):
+    compressor = zlib.compressobj()
+    encoder = StreamEncoder()
+
+    def make_fragment(chunk, index, total=0):
+        return FragmentMessage(
+            chunk,
+            transfer_id,
+            index,
+            total,
+            filename=filename if index == 0 else None,
+            mimetype=mimetype if index == 0 else None,
+            sender=sender,
+        )
+
+    pending = ""
+    index = 0
+    done = False
+
+    while not done:
+        block = fileobj.read(STREAM_BLOCK_SIZE)
+
+        if block:
+            pending += encoder.encode(compressor.compress(block))
+        else:
+            pending += encoder.encode(compressor.flush())
+            pending += encoder.finish()
+            done = True
+
+        # always keep some data back for the last fragment
+        offset = 0
+
+        while len(pending) - offset > chunk_size:
+            yield make_fragment(pending[offset : offset + chunk_size], index)
+
+            offset += chunk_size
+            index += 1
+
+            if index >= MAX_FRAGMENTS:
+                raise ValueError("file is too large for a single transfer")
+
+        pending = pending[offset:]
+
+    yield make_fragment(pending, index, index + 1)
+
+
+# split a file into fragments for sending
+def make_fragments(
+    content,
+    filename=None,
+    mimetype=None,
+    sender=None,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    transfer_id=None,
+):
+    if transfer_id is None:
+        transfer_id = new_transfer_id()
+
+    if mimetype is None and filename is not None:
+        mimetype = guess_mimetype(filename)
+
+    payload = CompressedMessage.compress(content)
+    chunks = [
+        payload[idx : idx + chunk_size] for idx in range(0, len(payload), chunk_size)
+    ] or [""]
+
+    if len(chunks) > MAX_FRAGMENTS:
+        raise ValueError("file is too large for a single transfer")
+
+    fragments = []
+
+    for index, chunk in enumerate(chunks):
+        frag = FragmentMessage(
+            chunk,
+            transfer_id,
+            index,
+            len(chunks),
+            filename=filename if index == 0 else None,
+            mimetype=mimetype if index == 0 else None,
+            sender=sender,
+        )
+
+        fragments.append(frag)
+
+    return fragments
+
+
+def guess_mimetype(filename):
+    guess = mimetypes.guess_type(filename)
+    return guess[0] or "application/octet-stream"
+
+
+# a file on disk that is sent as a stream; fragments are produced again from
+# the file when they need to be resent rather than being kept in memory
+class StreamSource:
+    def __init__(self, path, transfer_id, filename, mimetype, sender, chunk_size):
+        self.path = path
+        self.transfer_id = transfer_id
+        self.filename = filename
+        self.mimetype = mimetype
+        self.sender = sender
+        self.chunk_size = chunk_size
+
+    def fragments(self):
+        with open(self.path, "rb") as fp:
+            yield from stream_fragments(
+                fp,
+                self.transfer_id,
+                filename=self.filename,
+                mimetype=self.mimetype,
+                sender=self.sender,
+                chunk_size=self.chunk_size,
+            )
+
+    def select(self, indices):
+        if not indices:
+            return
+
+        wanted = set(indices)
+        last = max(wanted)
+
+        for frag in self.fragments():
+            # requests past the end are answered with the last fragment
+            if frag.index in wanted or (frag.total and last >= frag.index):
+                yield frag
+
+            if frag.index >= last:
+                break
+
+
+# keeps recently sent transfers so missing fragments can be sent again
+class TransferSender:
+    def __init__(self, max_transfers=DEFAULT_SEND_CACHE):
+        self.max_transfers = max_transfers
+        self.transfers = {}
+
+        self.lock = threading.Lock()
+        self.logger = logger.getChild("TransferSender")
+
+    def fragment(self, content, filename=None, mimetype=None, sender=None, **kwargs):
+        fragments = make_fragments(
+            content, filename=filename, mimetype=mimetype, sender=sender, **kwargs
+        )
+
+        self._remember(fragments[0].transfer_id, fragments)
+
+        self.logger.debug(
+            "new transfer %s -- %d fragment(s)",
+            fragments[0].transfer_id,
+            len(fragments),
+        )
+
+        return fragments
+
+    # stream a file from disk; returns a generator of fragments
+    def stream(
+        self,
+        path,
+        filename=None,
+        mimetype=None,
+        sender=None,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+    ):
+        if filename is None:
+            filename = os.path.basename(path)
+
+        if mimetype is None:
+            mimetype = guess_mimetype(filename)
+
+        source = StreamSource(
+            path, new_transfer_id(), filename, mimetype, sender, chunk_size
+        )
+
+        self._remember(source.transfer_id, source)
+
+        self.logger.debug("new stream %s -- %s", source.transfer_id, path)
+
+        return source.fragments()
+
+    # returns the fragments requested by a ResendMessage
+    def resend(self, request):
+        with self.lock:
+            source = self.transfers.get(request.transfer_id)
+
+        if source is None:
+            self.logger.debug("unknown transfer: %s", request.transfer_id)
+            return []
+
+        if isinstance(source, StreamSource):
+            return list(source.select(request.missing))
+
+        return [source[idx] for idx in request.missing if idx < len(source)]
+
+    def _remember(self, transfer_id, source):
+        with self.lock:
+            self.transfers[transfer_id] = source
+
+            # dicts keep insertion order, so the first entry is the oldest
+            while len(self.transfers) > self.max_transfers:
+                del self.transfers[next(iter(self.transfers))]
+
+
+# a file that was received and saved to disk
+class ReceivedFile:
+    def __init__(self, path, filename, mimetype, sender, timestamp, size):
+        self.path = path
+        self.filename = filename
+        self.mimetype = mimetype
+        self.sender = sender
+        self.timestamp = timestamp
+        self.size = size
+
+
+class PartialTransfer:
+    def __init__(self, transfer_id, sender, now, sink=None, path=None, limit=None):
+        self.transfer_id = transfer_id
+        self.sender = sender
+        self.total = None
+
+        # fragments are decoded in order; others wait in pending
+        self.next_index = 0
+        self.pending = {}
+
+        self.path = path
+        self.sink = io.BytesIO() if sink is None else sink
+        self.decoder = StreamDecoder(self.sink, limit)
+
+        self.filename = None
+        self.mimetype = None
+        self.timestamp = None
+
+        self.started = now
+        self.updated = now
+        self.requested = now
+
+    @property
+    def complete(self):
+        return self.total is not None and self.next_index >= self.total
+
+    # the number of bytes held in memory by this transfer
+    @property
+    def size(self):
+        pending = sum(len(chunk) for chunk in self.pending.values())
+
+        if self.path is None:
+            return pending + self.decoder.size
+
+        return pending
+
+    def missing(self):
+        if self.total is None:
+            # ask for the next fragment past the end to learn the total
+            end = max(self.pending, default=self.next_index - 1) + 2
+        else:
+            end = self.total
+
+        return [idx for idx in range(self.next_index, end) if idx not in self.pending]
+
+    def add(self, frag, now):
+        if frag.index < self.next_index or frag.index in self.pending:
+            return
+
+        if frag.total:
+            if self.total is not None and self.total != frag.total:
+                raise ValueError("fragment count mismatch")
+
+            self.total = frag.total
+
+        if frag.index == 0:
+            self.filename = frag.filename
+            self.mimetype = frag.mimetype
+            self.timestamp = frag.timestamp
+
+        self.pending[frag.index] = frag.content
+        self.updated = now
+
+        while self.next_index in self.pending:
+            self.decoder.write(self.pending.pop(self.next_index))
+            self.next_index += 1
+
+    def assemble(self):
+        self.decoder.finish()
+
+        if self.path is None:
+            content = self.sink.getvalue().decode("utf-8")
+
+            return FileMessage(
+                content,
+                filename=self.filename,
+                mimetype=self.mimetype,
+                sender=self.sender,
+                timestamp=self.timestamp,
+            )
+
+        self.sink.close()
+
+        return ReceivedFile(
+            self.path,
+            self.filename,
+            self.mimetype,
+            self.sender,
+            self.timestamp,
+            self.decoder.size,
+        )
+
+    def discard(self):
+        if self.path is not None:
+            self.sink.close()
+            os.remove(self.path)
+
+
+# collects fragments from the radio and rebuilds the original files
+#
+# by default, files are rebuilt in memory and returned as FileMessage's; if a
+# download folder is given, files are written there as fragments arrive and
+# returned as ReceivedFile's instead
+#
+# data held in memory for incomplete transfers is limited to `max_buffer` bytes
+# (the least recently updated transfer is dropped first), files written to the
+# download folder are limited to `max_file_size` bytes and transfers expire
+# after `timeout` seconds without progress
+class Reassembler:
+    def __init__(
+        self,
+        max_buffer=DEFAULT_MAX_BUFFER,
+        timeout=DEFAULT_TRANSFER_TIMEOUT,
+        retry_interval=DEFAULT_RETRY_INTERVAL,
+        download_dir=None,
+        max_file_size=DEFAULT_MAX_FILE_SIZE,
+        clock=time.monotonic,
+    ):
+        self.max_buffer = max_buffer
+        self.max_file_size = max_file_size
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self.download_dir = download_dir
+        self.clock = clock
+
+        self.transfers = {}
+
+        self.lock = threading.Lock()
+        self.logger = logger.getChild("Reassembler")
+
+        if download_dir is not None:
+            os.makedirs(download_dir, exist_ok=True)
+
+    @property
+    def buffered(self):
+        with self.lock:
+            return sum(xfer.size for xfer in self.transfers.values())
+
+    # add a fragment; returns the received file if this completes a transfer
+    def add(self, frag):
+        now = self.clock()
+        key = (frag.sender, frag.transfer_id)
+
+        with self.lock:
+            xfer = self.transfers.get(key)
+
+            if xfer is None:
+                xfer = self._start(frag, now)
+                self.transfers[key] = xfer
+
+            try:
+                xfer.add(frag, now)
+
+                if not xfer.complete:
+                    self._enforce_budget(key)
+                    return None
+
+                self.transfers.pop(key)
+                result = xfer.assemble()
+
+            except ValueError:
+                self.logger.warning("invalid transfer data: %s", frag.transfer_id)
+                self._drop(key, xfer)
+                return None
+
+        self.logger.debug("transfer complete: %s", frag.transfer_id)
+
+        if isinstance(result, ReceivedFile):
+            result.path = self._save(result)
+
+        return result
+
+    # drop transfers that have not made progress within the timeout
+    def expire(self):
+        now = self.clock()
+        expired = []
+
+        with self.lock:
+            for key, xfer in list(self.transfers.items()):
+                if now - xfer.updated > self.timeout:
+                    self.logger.info("transfer timed out: %s", xfer.transfer_id)
+                    self._drop(key, xfer)
+                    expired.append(xfer.transfer_id)
+
+        return expired
+
+    # build requests for missing fragments of transfers that have stalled
+    def resend_requests(self, sender=None):
+        now = self.clock()
+        requests = []
+
+        with self.lock:
+            for xfer in self.transfers.values():
+                if now - xfer.updated < self.retry_interval:
+                    continue
+
+                if now - xfer.requested < self.retry_interval:
+                    continue
+
+                xfer.requested = now
+
+                request = ResendMessage(xfer.transfer_id, xfer.missing(), sender=sender)
+                requests.append(request)
+
+        return requests
+
+    def _start(self, frag, now):
+        if self.download_dir is None:
+            return PartialTransfer(frag.transfer_id, frag.sender, now)
+
+        # transfers are kept for each sender, who may happen to use the same id
+        # as another; each partial file gets a new name, opened exclusively
+        sender = make_safe_filename(frag.sender) or "unknown"
+        prefix = f"{sender}-{frag.transfer_id}-"
+
+        fd, path = tempfile.mkstemp(".part", prefix, self.download_dir)
+        sink = os.fdopen(fd, "wb")
+
+        return PartialTransfer(
+            frag.transfer_id, frag.sender, now, sink, path, self.max_file_size
+        )
+
+    # move a completed download to its final name (without replacing files)
+    def _save(self, received):
+        name = make_safe_filename(received.filename) or received.path
+        base, ext = os.path.splitext(os.path.basename(name))
+
+        target = os.path.join(self.download_dir, base + ext)
+        count = 1
+
+        while os.path.exists(target):
+            target = os.path.join(self.download_dir, f"{base}-{count}{ext}")
+            count += 1
+
+        os.rename(received.path, target)
+
+        return target
+
+    def _drop(self, key, xfer):
+        self.transfers.pop(key, None)
+        xfer.discard()
+
+    def _enforce_budget(self, current):
+        buffered = sum(xfer.size for xfer in self.transfers.values())
+
+        while buffered > self.max_buffer and self.transfers:
+            oldest = min(self.transfers, key=lambda key: self.transfers[key].updated)
+
+            # prefer to drop other transfers before the active one
+            if oldest == current and len(self.transfers) > 1:
+                others = [key for key in self.transfers if key != current]
+                oldest = min(others, key=lambda key: self.transfers[key].updated)
+
+            xfer = self.transfers[oldest]
+
+            self.logger.warning("buffer full; dropping transfer %s", xfer.transfer_id)
+
+            buffered -= xfer.size
+            self._drop(oldest, xfer)
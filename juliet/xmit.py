@@ -0,0 +1,295 @@
+##
+# juliet - Copyright (c) Jason Heddings. All rights reserved.
+# Licensed under the MIT License. See LICENSE for full terms.
+##
+
+import queue
+import threading
+import time
+from collections import deque
+from enum import IntEnum
+
+# serial frames are 8N1 -- 10 bits on the wire for each byte
+BITS_PER_BYTE = 10
+
+DEFAULT_BURST_SIZE = 512
+DEFAULT_FRAME_GAP = 0.1
+
+# by default, only frames that are already waiting are combined
+DEFAULT_BATCH_WINDOW = 0
+
+# the number of bytes a lane may send per round for each unit of weight
+LANE_QUANTUM = 128
+
+
+class Priority(IntEnum):
+    CONTROL = 0
+    DIRECT = 1
+    CHANNEL = 2
+    BULK = 3
+
+
+# relative share of the transmitter for each lane when all lanes are busy
+DEFAULT_LANE_WEIGHTS = {
+    Priority.CONTROL: 8,
+    Priority.DIRECT: 4,
+    Priority.CHANNEL: 2,
+    Priority.BULK: 1,
+}
+
+
+def baud_to_rate(baud_rate):
+    return baud_rate / BITS_PER_BYTE
+
+
+# limit transmissions to an average byte rate with an allowed burst size and
+# (optionally) a minimum gap between frames
+class TokenBucket:
+    def __init__(self, rate, burst=DEFAULT_BURST_SIZE, gap=0, clock=time.monotonic):
+        if rate is None or rate <= 0:
+            raise ValueError("rate must be greater than zero")
+
+        if burst is None or burst <= 0:
+            raise ValueError("burst must be greater than zero")
+
+        self.rate = rate
+        self.burst = burst
+        self.gap = gap or 0
+
+        self.clock = clock
+        self.lock = threading.Lock()
+
+        self.tokens = burst
+        self.updated = clock()
+        self.last_xmit = None
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+
+        if elapsed > 0:
+            self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+    # the number of seconds until a frame of the given size may be sent
+    def delay(self, size):
+        with self.lock:
+            now = self.clock()
+            self._refill(now)
+
+            # frames larger than the burst only need a full bucket
+            needed = min(size, self.burst)
+            wait = max(0, (needed - self.tokens) / self.rate)
+
+            if self.gap and self.last_xmit is not None:
+                wait = max(wait, self.last_xmit + self.gap - now)
+
+            return wait
+
+    # take tokens for a frame that is being sent now
+    def consume(self, size):
+        with self.lock:
+            now = self.clock()
+            self._refill(now)
+
+            # the bucket may go negative for oversized frames
+            self.tokens -= size
+            self.last_xmit = now
+
+    # estimate the time needed to send the given number of bytes / frames
+    def drain_time(self, size, frames=1):
+        with self.lock:
+            self._refill(self.clock())
+
+            wait = max(0, (size - self.tokens) / self.rate)
+
+            if self.gap and frames > 1:
+                wait = max(wait, (frames - 1) * self.gap)
+
+            return wait
+
+
+class LaneStats:
+    def __init__(self):
+        self.frames = 0
+        self.bytes = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def avg_wait(self):
+        return self.total_wait / self.frames if self.frames else 0.0
+
+    def record(self, size, wait):
+        self.frames += 1
+        self.bytes += size
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+
+class Lane:
+    def __init__(self, priority, weight):
+        self.priority = priority
+        self.quantum = weight * LANE_QUANTUM
+
+        self.frames = deque()
+        self.deficit = 0
+
+        self.stats = LaneStats()
+
+
+# a transmit queue with a lane for each priority; lanes are drained using
+# deficit round robin so that each busy lane gets a share of the bytes sent
+# in proportion to its weight (and bulk traffic cannot starve the others)
+#
+# this follows the queue.Queue interface used by the transmit worker
+class TransmitQueue:
+    def __init__(self, weights=None, clock=time.monotonic):
+        weights = {**DEFAULT_LANE_WEIGHTS, **(weights or {})}
+
+        self.lanes = [Lane(prio, weights[prio]) for prio in Priority]
+        self.clock = clock
+
+        self.current = 0
+        self.granted = False
+        self.count = 0
+
+        self.not_empty = threading.Condition(threading.Lock())
+
+    def put(self, data, priority=Priority.CHANNEL):
+        # the shutdown marker always goes first
+        if data is None:
+            priority = Priority.CONTROL
+
+        lane = self.lanes[Priority(priority)]
+
+        with self.not_empty:
+            lane.frames.append((data, self.clock()))
+            self.count += 1
+
+            self.not_empty.notify()
+
+    def get(self, block=True, timeout=None):
+        with self.not_empty:
+            if not block:
+                if self.count == 0:
+                    raise queue.Empty
+
+            elif timeout is None:
+                while self.count == 0:
+                    self.not_empty.wait()
+
+            else:
+                deadline = time.monotonic() + timeout
+
+                while self.count == 0:
+                    remaining = deadline - time.monotonic()
+
+                    if remaining <= 0:
+                        raise queue.Empty
+
+                    self.not_empty.wait(remaining)
+
+            return self._next()
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def qsize(self):
+        with self.not_empty:
+            return self.count
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def depth(self, priority):
+        with self.not_empty:
+            return len(self.lanes[priority].frames)
+
+    def stats(self):
+        with self.not_empty:
+            return {
+                lane.priority.name.lower(): {
+                    "depth": len(lane.frames),
+                    "frames": lane.stats.frames,
+                    "bytes": lane.stats.bytes,
+                    "avg_wait": lane.stats.avg_wait,
+                    "max_wait": lane.stats.max_wait,
+                }
+                for lane in self.lanes
+            }
+
+    # select the next frame using deficit round robin; the caller must hold
+    # the lock and there must be at least one frame available
+    def _next(self):
+        while True:
+            lane = self.lanes[self.current]
+
+            if not lane.frames:
+                lane.deficit = 0
+                self._advance()
+                continue
+
+            # each lane receives its quantum once per turn
+            if not self.granted:
+                lane.deficit += lane.quantum
+                self.granted = True
+
+            data, queued = lane.frames[0]
+            size = 0 if data is None else len(data)
+
+            if lane.deficit < size:
+                self._advance()
+                continue
+
+            lane.frames.popleft()
+            lane.deficit -= size
+
+            self.count -= 1
+
+            lane.stats.record(size, self.clock() - queued)
+
+            if not lane.frames:
+                lane.deficit = 0
+                self._advance()
+
+            return data
+
+    def _advance(self):
+        self.current = (self.current + 1) % len(self.lanes)
+        self.granted = False
+
+
+# collect frames from the queue to send along with the first frame; frames are
+# gathered for up to `window` seconds or until `max_size` bytes are collected
+#
+# returns the list of frames and any frame that did not fit in the batch (which
+# should be used to start the next batch)
+def collect_batch(xmit_queue, first, window=0, max_size=DEFAULT_BURST_SIZE):
+    frames = [first]
+    size = len(first)
+
+    deadline = time.monotonic() + window
+
+    while size < max_size:
+        timeout = deadline - time.monotonic()
+
+        try:
+            if timeout > 0:
+                data = xmit_queue.get(timeout=timeout)
+            else:
+                data = xmit_queue.get_nowait()
+        except queue.Empty:
+            break
+
+        # leave the shutdown marker for the worker loop
+        if data is None:
+            xmit_queue.put(None)
+            break
+
+        if size + len(data) > max_size:
+            return (frames, data)
+
+        frames.append(data)
+        size += len(data)
+
+    return (frames, None)
@@ -0,0 +1,216 @@
+"""Unit test module for Juliet."""
+
+import logging
+import os
+import tempfile
+import unittest
+
+from juliet.capture import CaptureReader, CaptureSink, Direction, read_capture
+from juliet.message import TextMessage
+from juliet.radio import RadioLoop
+
+# keep logging output to a minumim for testing
+logging.basicConfig(level=logging.FATAL)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1616164623.0
+
+    def __call__(self):
+        self.now += 0.5
+        return self.now
+
+
+class CaptureSinkTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "radio.cap")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_radio_traffic(self):
+        radio = RadioLoop()
+
+        capture = CaptureSink(self.path, clock=FakeClock())
+        capture.attach(radio)
+
+        data = TextMessage("hello world").pack()
+        radio.send(data)
+
+        capture.detach(radio)
+        radio.send(b"not captured")
+
+        capture.close()
+
+        records = list(read_capture(self.path))
+
+        assert records == [
+            (1616164623.5, Direction.XMIT, data),
+            (1616164624.0, Direction.RECV, data),
+        ]
+
+        assert capture.records == 2
+        assert capture.bytes == 2 * len(data)
+
+    def test_append(self):
+        for text in (b"first", b"second"):
+            capture = CaptureSink(self.path)
+            capture.write(Direction.RECV, text)
+            capture.close()
+
+        records = [data for _, _, data in read_capture(self.path)]
+        assert records == [b"first", b"second"]
+
+    def test_partial_record(self):
+        capture = CaptureSink(self.path)
+        capture.write(Direction.RECV, b"complete")
+        capture.write(Direction.RECV, b"interrupted")
+        capture.close()
+
+        # lose the end of the last record
+        with open(self.path, "r+b") as fp:
+            fp.truncate(os.path.getsize(self.path) - 4)
+
+        records = [data for _, _, data in read_capture(self.path)]
+        assert records == [b"complete"]
+
+    def test_append_after_partial_record(self):
+        capture = CaptureSink(self.path)
+        capture.write(Direction.RECV, b"complete")
+        capture.write(Direction.RECV, b"interrupted")
+        capture.close()
+
+        with open(self.path, "r+b") as fp:
+            fp.truncate(os.path.getsize(self.path) - 4)
+
+        # the next session starts after the last complete record
+        capture = CaptureSink(self.path)
+        capture.write(Direction.RECV, b"restarted")
+        capture.close()
+
+        with CaptureReader(self.path) as reader:
+            records = [data for _, _, data in reader]
+
+            assert records == [b"complete", b"restarted"]
+            assert not reader.truncated
+
+    def test_append_after_partial_header(self):
+        with open(self.path, "wb") as fp:
+            fp.write(b"JC")
+
+        capture = CaptureSink(self.path)
+        capture.write(Direction.RECV, b"hello")
+        capture.close()
+
+        assert [data for _, _, data in read_capture(self.path)] == [b"hello"]
+
+    def test_not_capture(self):
+        with open(self.path, "wb") as fp:
+            fp.write(b"plain text log")
+
+        with self.assertRaises(ValueError):
+            list(read_capture(self.path))
+
+        # other files are never appended to
+        self.assertRaises(ValueError, CaptureSink, self.path)
+
+        with open(self.path, "rb") as fp:
+            assert fp.read() == b"plain text log"
+
+    def test_closed(self):
+        capture = CaptureSink(self.path)
+        capture.close()
+
+        # late events from the radio are ignored
+        capture.write(Direction.RECV, b"late")
+        capture.close()
+
+        assert list(read_capture(self.path)) == []
+
+
+class CaptureRotationTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "radio.cap")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_rotate(self):
+        capture = CaptureSink(self.path, max_bytes=100, backups=2)
+
+        for idx in range(10):
+            capture.write(Direction.RECV, b"%d" % idx + b"x" * 40)
+
+        capture.close()
+
+        # each file holds two records; only the newest files are kept
+        assert capture.rotations == 5
+        assert sorted(os.listdir(self.tmpdir.name)) == [
+            "radio.cap",
+            "radio.cap.1",
+            "radio.cap.2",
+        ]
+
+        def first(path):
+            return [data[:1] for _, _, data in read_capture(path)]
+
+        assert first(self.path + ".2") == [b"6", b"7"]
+        assert first(self.path + ".1") == [b"8", b"9"]
+        assert first(self.path) == []
+
+    def test_no_backups(self):
+        capture = CaptureSink(self.path, max_bytes=100, backups=0)
+
+        for _ in range(5):
+            capture.write(Direction.RECV, b"x" * 40)
+
+        capture.close()
+
+        assert os.listdir(self.tmpdir.name) == ["radio.cap"]
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            CaptureSink(self.path, max_bytes=2)
+
+        with self.assertRaises(ValueError):
+            CaptureSink(self.path, backups=-1)
+
+
+class CaptureReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "radio.cap")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_truncated(self):
+        capture = CaptureSink(self.path)
+        capture.write(Direction.RECV, b"complete")
+        capture.write(Direction.XMIT, b"interrupted")
+        capture.close()
+
+        with open(self.path, "r+b") as fp:
+            fp.truncate(os.path.getsize(self.path) - 4)
+
+        with CaptureReader(self.path) as reader:
+            records = list(reader)
+
+            assert reader.truncated
+            assert [data for _, _, data in records] == [b"complete"]
+
+    def test_empty(self):
+        open(self.path, "wb").close()
+
+        with self.assertRaises(ValueError):
+            CaptureReader(self.path)
+
+    def test_version(self):
+        with open(self.path, "wb") as fp:
+            fp.write(b"JCAP\x63")
+
+        with self.assertRaises(ValueError):
+            CaptureReader(self.path)
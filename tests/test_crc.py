@@ -0,0 +1,87 @@
+"""Unit test module for Juliet."""
+
+import logging
+import random
+import unittest
+
+from juliet import crc
+
+# keep logging output to a minumim for testing
+logging.basicConfig(level=logging.FATAL)
+
+
+def reference_checksum(*parts):
+    value = 0xFFFF
+
+    for part in parts:
+        if part:
+            value = crc.crc16_bitwise(part, value)
+
+    return value
+
+
+class CRC16Test(unittest.TestCase):
+    def setUp(self):
+        self.rand = random.Random(1621)
+
+        self.engines = [crc.crc16_table, crc.crc16_sliced]
+
+        if crc.crc16_native is not None:
+            self.engines.append(crc.crc16_native)
+
+    def random_bytes(self, length):
+        return bytes(self.rand.getrandbits(8) for _ in range(length))
+
+    def test_known_value(self):
+        value = crc.checksum("unittest", "20210319143703", "hello world", None)
+        assert value == 0x36FB
+
+    def test_empty_data(self):
+        for engine in self.engines:
+            assert engine(b"") == crc.crc16_bitwise(b"")
+            assert engine(b"", 0x1234) == crc.crc16_bitwise(b"", 0x1234)
+
+    def test_all_single_bytes(self):
+        for value in range(256):
+            data = bytes([value])
+            expected = crc.crc16_bitwise(data)
+
+            for engine in self.engines:
+                assert engine(data) == expected
+
+    def test_random_data(self):
+        # cover both sides of the wide table cutoff and odd / even tails
+        for length in list(range(0, 70)) + [255, 256, 1023, 4096, 65537]:
+            data = self.random_bytes(length)
+            init = self.rand.getrandbits(16)
+
+            expected = crc.crc16_bitwise(data, init)
+
+            for engine in self.engines:
+                assert engine(data, init) == expected, (engine, length)
+
+    def test_input_types(self):
+        text = "нєℓℓσ ωσяℓ∂ -- hello world -- 你好世界 -- 😀🙃😳🤔"
+        expected = crc.crc16_bitwise(text)
+
+        for engine in self.engines:
+            assert engine(text) == expected
+            assert engine(text.encode("utf-8")) == expected
+            assert engine(bytearray(text, "utf-8")) == expected
+            assert engine(memoryview(text.encode("utf-8"))) == expected
+
+    def test_custom_poly(self):
+        data = self.random_bytes(100)
+        value = crc.crc16(data, poly=0x8005)
+        assert value == crc.crc16_bitwise(data, poly=0x8005)
+
+    def test_checksum_parts(self):
+        for _ in range(50):
+            parts = [
+                self.random_bytes(self.rand.randrange(0, 300))
+                for _ in range(self.rand.randrange(1, 5))
+            ]
+
+            parts.insert(self.rand.randrange(0, len(parts)), None)
+
+            assert crc.checksum(*parts) == reference_checksum(*parts)
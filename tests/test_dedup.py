@@ -0,0 +1,141 @@
+"""Unit test module for Juliet."""
+
+import logging
+import unittest
+
+from juliet.dedup import DedupCache
+from juliet.message import Message, MessageBuffer, TextMessage
+
+# keep logging output to a minumim for testing
+logging.basicConfig(level=logging.FATAL)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class DedupCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = DedupCache(maxsize=3, ttl=10, clock=self.clock)
+
+    def test_hits_and_misses(self):
+        assert not self.cache.is_duplicate("a")
+        self.cache.remember("a")
+
+        assert self.cache.is_duplicate("a")
+        assert self.cache.is_duplicate("a")
+        assert not self.cache.is_duplicate("b")
+
+        stats = self.cache.stats()
+        assert stats["hits"] == 2
+        assert stats["misses"] == 2
+        assert stats["size"] == 1
+
+    def test_ttl_expiry(self):
+        self.cache.remember("a")
+
+        self.clock.advance(9)
+        assert self.cache.is_duplicate("a")
+
+        # seeing a copy does not extend the lifetime of the entry
+        self.cache.remember("a")
+
+        self.clock.advance(2)
+        assert not self.cache.is_duplicate("a")
+
+        # expired entries are removed as new ones are added
+        self.cache.remember("b")
+        assert len(self.cache) == 1
+
+    def test_lru_eviction(self):
+        for key in "abc":
+            self.cache.remember(key)
+
+        # a hit moves the entry to the end of the line
+        assert self.cache.is_duplicate("a")
+
+        self.cache.remember("d")
+
+        assert len(self.cache) == 3
+        assert self.cache.is_duplicate("a")
+        assert not self.cache.is_duplicate("b")
+        assert self.cache.is_duplicate("c")
+        assert self.cache.is_duplicate("d")
+
+    def test_invalid_params(self):
+        with self.assertRaises(ValueError):
+            DedupCache(maxsize=0)
+
+        with self.assertRaises(ValueError):
+            DedupCache(ttl=0)
+
+
+class DuplicateFrameTest(unittest.TestCase):
+    def setUp(self):
+        self.inbox = []
+
+        self.cache = DedupCache()
+        self.msgbuf = MessageBuffer(dedup=self.cache)
+        self.msgbuf.on_message += lambda mbuf, msg: self.inbox.append(msg)
+
+    def test_drop_duplicates(self):
+        first = TextMessage("hello world", sender="unittest").pack()
+        second = TextMessage("goodbye world", sender="unittest").pack()
+
+        self.msgbuf.append(first + first + second)
+        self.msgbuf.append(first)
+
+        assert [msg.content for msg in self.inbox] == ["hello world", "goodbye world"]
+
+        stats = self.cache.stats()
+        assert stats["hits"] == 2
+        assert stats["misses"] == 2
+
+    def test_duplicates_are_not_decoded(self):
+        frame = TextMessage("hello world", sender="unittest").pack()
+        self.msgbuf.append(frame)
+
+        unpacked = []
+        original = Message.unpack
+
+        def unpack(*args, **kwargs):
+            unpacked.append(args)
+            return original(*args, **kwargs)
+
+        Message.unpack = unpack
+
+        try:
+            self.msgbuf.append(frame)
+        finally:
+            Message.unpack = original
+
+        assert len(self.inbox) == 1
+        assert unpacked == []
+
+    def test_corrupt_copy(self):
+        frame = TextMessage("hello world", sender="unittest").pack()
+        corrupt = frame.replace(b"hello", b"jello")
+
+        # a copy that fails the checksum does not hide the real frame
+        self.msgbuf.append(corrupt)
+        self.msgbuf.append(frame)
+
+        assert len(self.inbox) == 1
+        assert self.inbox[0].content == "hello world"
+
+    def test_no_cache(self):
+        msgbuf = MessageBuffer()
+        msgbuf.on_message += lambda mbuf, msg: self.inbox.append(msg)
+
+        frame = TextMessage("hello world", sender="unittest").pack()
+        msgbuf.append(frame + frame)
+
+        assert len(self.inbox) == 2
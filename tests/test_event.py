@@ -0,0 +1,201 @@
+"""Unit test module for Juliet."""
+
+import logging
+import threading
+import unittest
+import weakref
+
+from juliet.event import Event, EventDispatcher, Overflow
+
+# keep logging output to a minumim for testing
+logging.basicConfig(level=logging.FATAL)
+
+
+class EventTest(unittest.TestCase):
+    def test_inline_handlers(self):
+        calls = []
+
+        event = Event()
+        event += lambda value: calls.append(("first", value))
+        event += lambda value: calls.append(("second", value))
+
+        event(42)
+
+        # handlers run before the call returns
+        assert calls == [("first", 42), ("second", 42)]
+
+    def test_remove_handler(self):
+        calls = []
+
+        def handler(value):
+            calls.append(value)
+
+        event = Event()
+        event += handler
+        event(1)
+
+        event -= handler
+        event(2)
+
+        assert calls == [1]
+
+    def test_handler_stats(self):
+        def handler(value):
+            if value < 0:
+                raise ValueError("negative")
+
+        event = Event(timing=True)
+        event += handler
+
+        event(1)
+        event(2)
+
+        with self.assertRaises(ValueError):
+            event(-1)
+
+        stats = event.stats()[handler.__qualname__]
+
+        assert stats["calls"] == 3
+        assert stats["errors"] == 1
+        assert stats["max_time"] >= stats["avg_time"] >= 0
+
+        # removed handlers are not kept alive by their stats
+        ref = weakref.ref(handler)
+
+        event -= handler
+        del handler
+
+        assert ref() is None
+
+    def test_inline_not_timed(self):
+        event = Event()
+        event += lambda value: None
+
+        event(1)
+
+        assert event.stats() == {}
+
+
+class EventDispatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.started = threading.Event()
+
+    # occupy the worker until the test releases it
+    def block_worker(self, dispatcher):
+        def wait():
+            self.started.set()
+            self.release.wait(5)
+
+        dispatcher.submit(wait)
+        assert self.started.wait(5)
+
+    def test_dispatch_order(self):
+        calls = []
+        dispatcher = EventDispatcher()
+
+        event = Event(dispatcher=dispatcher)
+        event += calls.append
+
+        for value in range(100):
+            event(value)
+
+        dispatcher.close()
+
+        assert calls == list(range(100))
+        assert dispatcher.stats()["dispatched"] == 100
+
+        # handlers on a dispatcher are always timed
+        assert event.stats()["list.append"]["calls"] == 100
+
+    def test_handlers_run_on_worker(self):
+        threads = []
+        dispatcher = EventDispatcher()
+
+        event = Event(dispatcher=dispatcher)
+        event += lambda: threads.append(threading.current_thread())
+
+        event()
+        dispatcher.close()
+
+        assert threads == [dispatcher.worker]
+
+    def test_drop_newest(self):
+        calls = []
+        dispatcher = EventDispatcher(maxsize=2, overflow=Overflow.DROP_NEWEST)
+
+        self.block_worker(dispatcher)
+
+        assert dispatcher.submit(calls.append, (1,))
+        assert dispatcher.submit(calls.append, (2,))
+        assert not dispatcher.submit(calls.append, (3,))
+
+        self.release.set()
+        dispatcher.close()
+
+        assert calls == [1, 2]
+        assert dispatcher.stats()["dropped"] == 1
+
+    def test_drop_oldest(self):
+        calls = []
+        dispatcher = EventDispatcher(maxsize=2, overflow="drop_oldest")
+
+        self.block_worker(dispatcher)
+
+        for value in range(5):
+            assert dispatcher.submit(calls.append, (value,))
+
+        self.release.set()
+        dispatcher.close()
+
+        assert calls == [3, 4]
+        assert dispatcher.stats()["dropped"] == 3
+
+    def test_block(self):
+        calls = []
+        dispatcher = EventDispatcher(maxsize=1, overflow=Overflow.BLOCK)
+
+        self.block_worker(dispatcher)
+        dispatcher.submit(calls.append, (1,))
+
+        # the next submit waits for room in the queue
+        producer = threading.Thread(target=dispatcher.submit, args=(calls.append, (2,)))
+        producer.start()
+        producer.join(0.1)
+
+        assert producer.is_alive()
+
+        self.release.set()
+        producer.join(5)
+
+        dispatcher.close()
+
+        assert calls == [1, 2]
+        assert dispatcher.stats()["dropped"] == 0
+
+    def test_handler_errors(self):
+        calls = []
+        dispatcher = EventDispatcher()
+
+        event = Event(dispatcher=dispatcher)
+        event += lambda value: 1 / value
+        event += calls.append
+
+        event(0)
+        event(1)
+
+        dispatcher.close()
+
+        # a failed call does not stop the worker
+        assert calls == [1]
+
+    def test_closed_dispatcher(self):
+        dispatcher = EventDispatcher()
+        dispatcher.close()
+
+        assert not dispatcher.worker.is_alive()
+        assert not dispatcher.submit(print)
+
+    def test_invalid_size(self):
+        with self.assertRaises(ValueError):
+            EventDispatcher(maxsize=0)
@@ -0,0 +1,256 @@
+"""Unit test module for Juliet."""
+
+import logging
+import random
+import string
+import threading
+import unittest
+
+import irc.bot
+import irc.client
+
+from juliet import Juliet
+from juliet.gateway import RoutingTable
+from juliet.message import (
+    ChannelMessage,
+    DeflateChannelMessage,
+    Message,
+    RingMessageBuffer,
+    TextMessage,
+)
+from juliet.metrics import MetricsRegistry
+from juliet.radio import RadioBase
+from juliet.transfer import FragmentMessage, ResendMessage
+
+# keep logging output to a minumim for testing
+logging.basicConfig(level=logging.FATAL)
+
+# compresses well, so the deflated version is the shortest
+LONG_TEXT = "calling all stations, calling all stations " * 4
+
+
+class FakeConnection:
+    def __init__(self):
+        self.sent = []
+
+    def notice(self, target, text):
+        self.sent.append(("notice", target, text))
+
+    def privmsg(self, target, text):
+        self.sent.append(("privmsg", target, text))
+
+
+# records frames sent to the radio; received data is delivered by the test
+class FakeRadio(RadioBase):
+    def __init__(self):
+        super().__init__()
+        self.sent = []
+
+    def send(self, data, priority=None):
+        self.sent.append(data)
+
+    def recv(self, data):
+        self.on_recv(self, data)
+
+
+def pubmsg(channel, text, nick="W0JHX"):
+    source = irc.client.NickMask(f"{nick}!{nick.lower()}@localhost")
+    return irc.client.Event("pubmsg", source, channel, [text])
+
+
+class RoutingTableTest(unittest.TestCase):
+    def test_unrouted_channels(self):
+        routes = RoutingTable()
+
+        assert len(routes) == 0
+        assert routes.allows("#cqcqcq", "vhf")
+        assert routes.allows("#cqcqcq", "uhf")
+
+    def test_routes(self):
+        routes = RoutingTable({"#CQCQCQ": ["vhf", "uhf"], "#local": "vhf"})
+
+        assert routes.allows("#CQCQCQ", "uhf")
+        assert routes.allows("#local", "vhf")
+        assert not routes.allows("#local", "uhf")
+        assert routes.radio_names() == {"vhf", "uhf"}
+
+        routes.remove("#local")
+        assert routes.allows("#local", "uhf")
+
+    def test_case_insensitive(self):
+        routes = RoutingTable({"#Local": "vhf"})
+
+        assert "#LOCAL" in routes
+        assert not routes.allows("#local", "uhf")
+
+
+class GatewayTest(unittest.TestCase):
+    def setUp(self):
+        self.metrics = MetricsRegistry()
+        self.conn = FakeConnection()
+
+        self.vhf = FakeRadio()
+        self.uhf = FakeRadio()
+
+        self.jules = Juliet(
+            "unittest",
+            self.vhf,
+            "localhost",
+            metrics=self.metrics,
+            radio_name="vhf",
+            routes={"#local": "vhf"},
+        )
+        self.jules.add_radio("uhf", self.uhf)
+
+        self.jules.connection = self.conn
+        self.jules.channels["#cqcqcq"] = irc.bot.Channel()
+        self.jules.channels["#local"] = irc.bot.Channel()
+
+    def notices(self):
+        return [sent for sent in self.conn.sent if sent[0] == "notice"]
+
+    def test_ports(self):
+        jules = self.jules
+
+        assert list(jules.ports) == ["vhf", "uhf"]
+        assert jules.radio is self.vhf
+        assert jules.msgbuf is jules.ports["vhf"].msgbuf
+        assert jules.ports["uhf"].msgbuf is not jules.msgbuf
+
+        # names and radios may only be used once
+        self.assertRaises(ValueError, jules.add_radio, "uhf", FakeRadio())
+        self.assertRaises(ValueError, jules.add_radio, "hf", self.uhf)
+
+    def test_pubmsg_routing(self):
+        self.jules.on_pubmsg(self.conn, pubmsg("#local", "hello vhf"))
+
+        assert len(self.vhf.sent) == 1
+        assert self.uhf.sent == []
+
+        # channels without a route are carried on every radio
+        self.jules.on_pubmsg(self.conn, pubmsg("#cqcqcq", "hello all"))
+
+        assert len(self.vhf.sent) == 2
+        assert self.uhf.sent == [self.vhf.sent[-1]]
+
+    def test_compress_per_port(self):
+        hf = FakeRadio()
+        self.jules.add_radio("hf", hf, compress=False)
+
+        self.jules.on_pubmsg(self.conn, pubmsg("#cqcqcq", LONG_TEXT))
+
+        assert isinstance(Message.unpack(self.uhf.sent[0]), DeflateChannelMessage)
+        assert type(Message.unpack(hf.sent[0])) is ChannelMessage
+        assert Message.unpack(hf.sent[0]).content == LONG_TEXT
+
+    def test_xmit_all_ports(self):
+        self.jules._do_command(self.conn, "W0JHX", "xmit", ["hello", "world"])
+
+        assert len(self.vhf.sent) == 1
+        assert self.uhf.sent == self.vhf.sent
+        assert Message.unpack(self.uhf.sent[0]).content == "hello world"
+
+    def test_received_once(self):
+        frame = ChannelMessage("hello", channel="#cqcqcq", sender="KD0ABC").pack()
+
+        # the same frame heard on both radios is only posted once
+        self.vhf.recv(frame)
+        self.uhf.recv(frame)
+
+        assert self.notices() == [("notice", "#cqcqcq", "[KD0ABC] hello")]
+
+        snap = self.metrics.snapshot()
+        assert snap["buffer_frames"] == {
+            (("radio", "uhf"),): 0,
+            (("radio", "vhf"),): 1,
+        }
+        assert snap["buffer_duplicate_frames"] == {
+            (("radio", "uhf"),): 1,
+            (("radio", "vhf"),): 0,
+        }
+
+    def test_cross_relay(self):
+        vhf = FakeRadio()
+        uhf = FakeRadio()
+
+        # each radio relays to the other
+        jules = Juliet("unittest", vhf, "localhost", radio_name="vhf", relay=["uhf"])
+        jules.add_radio("uhf", uhf, relay=["vhf"])
+        jules.connection = self.conn
+        jules.channels["#cqcqcq"] = irc.bot.Channel()
+
+        frame = ChannelMessage("hello", channel="#cqcqcq", sender="KD0ABC").pack()
+        vhf.recv(frame + b"noise")
+
+        assert uhf.sent == [frame]
+        assert vhf.sent == []
+
+        # the relayed copy comes back on the other radio, but goes no further
+        uhf.recv(frame)
+
+        assert vhf.sent == []
+        assert len(self.notices()) == 1
+
+    def test_relay_follows_routes(self):
+        hf = FakeRadio()
+        self.jules.add_radio("hf", hf, relay=["vhf", "uhf"])
+
+        local = ChannelMessage("hello", channel="#local", sender="KD0ABC").pack()
+        text = TextMessage("hello", sender="KD0ABC").pack()
+
+        hf.recv(local + text)
+
+        # channel messages are only relayed where the channel is routed
+        assert self.vhf.sent == [local, text]
+        assert self.uhf.sent == [text]
+
+        snap = self.metrics.snapshot()
+        assert snap["juliet_radio_relayed"] == {
+            (("radio", "uhf"), ("source", "hf")): 1,
+            (("radio", "vhf"), ("source", "hf")): 2,
+        }
+
+    def test_relay_ring_buffer(self):
+        hf = FakeRadio()
+        port = self.jules.add_radio("hf", hf, ring_buffer=256, relay=["uhf"])
+
+        assert isinstance(port.msgbuf, RingMessageBuffer)
+
+        frames = [TextMessage(f"hello {idx}").pack() for idx in range(8)]
+
+        for frame in frames:
+            hf.recv(frame)
+
+        # relayed frames are copied out of the ring before it is reused
+        assert self.uhf.sent == frames
+
+    def test_resend_same_port(self):
+        rand = random.Random(1621)
+        content = "".join(rand.choices(string.ascii_letters, k=2048))
+        transfer_id = self.jules.send_file(content, filename="notes.txt")
+
+        count = len(self.vhf.sent)
+        assert count > 1 and self.uhf.sent == self.vhf.sent
+
+        request = ResendMessage(transfer_id, [0], sender="KD0ABC")
+        self.uhf.recv(request.pack())
+
+        # only the radio that asked gets the fragment again
+        assert len(self.vhf.sent) == count
+        assert len(self.uhf.sent) == count + 1
+
+        frag = Message.unpack(self.uhf.sent[-1])
+        assert isinstance(frag, FragmentMessage)
+        assert frag.index == 0
+
+    def test_slow_port(self):
+        frame = ChannelMessage("hello", channel="#cqcqcq", sender="KD0ABC").pack()
+
+        # hold up the vhf buffer, as a long parse would; uhf is not affected
+        with self.jules.ports["vhf"].msgbuf.lock:
+            thread = threading.Thread(target=self.uhf.recv, args=(frame,))
+            thread.start()
+            thread.join(timeout=5)
+
+            assert not thread.is_alive()
+            assert self.notices() == [("notice", "#cqcqcq", "[KD0ABC] hello")]
@@ -0,0 +1,433 @@
+"""Unit test module for Juliet."""
+
+import logging
+import os
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timezone
+
+import irc.bot
+import irc.client
+
+from juliet import MAX_HISTORY_LINES, Juliet
+from juliet.capture import Direction
+from juliet.history import (
+    SELECT_CHANNEL_SINCE,
+    SELECT_RECENT,
+    SELECT_SENDER,
+    SELECT_SINCE,
+    SELECT_VISIBLE_SINCE,
+    HistoryEntry,
+    MessageHistory,
+    format_entry,
+    parse_since,
+)
+from juliet.metrics import MetricsRegistry
+from juliet.radio import RadioLoop
+
+# keep logging output to a minumim for testing
+logging.basicConfig(level=logging.FATAL)
+
+# 2021-03-19 14:37:03 UTC
+START_TIME = 1616164623
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = START_TIME
+
+    def __call__(self):
+        return self.now
+
+
+class FakeConnection:
+    def __init__(self):
+        self.sent = []
+
+    def notice(self, target, text):
+        self.sent.append(("notice", target, text))
+
+    def privmsg(self, target, text):
+        self.sent.append(("privmsg", target, text))
+
+
+class MessageHistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "history.db")
+        self.clock = FakeClock()
+
+        self.history = MessageHistory(self.path, clock=self.clock)
+
+    def tearDown(self):
+        self.history.close()
+        self.tmpdir.cleanup()
+
+    def record(self, count, channel="#cqcqcq", sender="W0JHX", step=60):
+        for idx in range(count):
+            self.history.record(Direction.RECV, channel, sender, f"msg {idx}", "vhf")
+            self.clock.now += step
+
+    def test_recent(self):
+        self.record(10)
+        self.record(5, channel="#other")
+
+        assert self.history.flush(timeout=5)
+
+        entries = self.history.recent("#cqcqcq", 3)
+
+        # the most recent messages, oldest first
+        assert [entry.content for entry in entries] == ["msg 7", "msg 8", "msg 9"]
+        assert entries[0] == HistoryEntry(
+            START_TIME + 7 * 60, Direction.RECV, "#cqcqcq", "W0JHX", "msg 7", "vhf"
+        )
+
+        # channel names are not case sensitive
+        assert len(self.history.recent("#OTHER", 50)) == 5
+        assert self.history.recent("#unknown", 50) == []
+
+    def test_since(self):
+        self.record(10)
+        self.record(10, channel="#other")
+
+        assert self.history.flush(timeout=5)
+
+        # the first channel ends at START_TIME + 9 min
+        start = START_TIME + 8 * 60
+        entries = self.history.since(start)
+
+        assert [entry.content for entry in entries[:2]] == ["msg 8", "msg 9"]
+        assert len(entries) == 12
+
+        entries = self.history.since(start, channel="#other")
+        assert len(entries) == 10
+
+        entries = self.history.since(start, limit=3)
+        assert [entry.channel for entry in entries] == ["#cqcqcq"] * 2 + ["#other"]
+
+    def test_by_sender(self):
+        self.record(3, sender="W0JHX")
+        self.record(3, sender="KD0ABC")
+
+        assert self.history.flush(timeout=5)
+
+        entries = self.history.by_sender("KD0ABC", 2)
+        assert [entry.content for entry in entries] == ["msg 1", "msg 2"]
+
+    def test_direct_messages(self):
+        self.history.record(Direction.XMIT, None, "W0JHX", "hello")
+
+        assert self.history.flush(timeout=5)
+
+        (entry,) = self.history.since(0)
+        assert entry.channel is None
+        assert entry.direction == Direction.XMIT
+
+    def test_visible_since(self):
+        self.record(3)
+        self.record(3, channel="#other")
+        self.history.record(Direction.XMIT, None, "W0JHX", "mine")
+        self.history.record(Direction.XMIT, None, "KD0ABC", "theirs")
+
+        assert self.history.flush(timeout=5)
+
+        entries = self.history.visible_since(0, ["#CQCQCQ"], "W0JHX")
+
+        assert [(entry.channel, entry.content) for entry in entries] == [
+            ("#cqcqcq", "msg 0"),
+            ("#cqcqcq", "msg 1"),
+            ("#cqcqcq", "msg 2"),
+            (None, "mine"),
+        ]
+
+        entries = self.history.visible_since(0, [], "KD0ABC")
+        assert [entry.content for entry in entries] == ["theirs"]
+
+        assert len(self.history.visible_since(0, ["#cqcqcq", "#other"], None, 4)) == 4
+
+    def test_reopen(self):
+        self.record(5)
+        self.history.close()
+
+        self.history = MessageHistory(self.path, clock=self.clock)
+        self.record(1)
+
+        assert self.history.flush(timeout=5)
+        assert len(self.history.recent("#cqcqcq", 50)) == 6
+
+    def test_batches(self):
+        metrics = MetricsRegistry()
+
+        self.history.close()
+        self.history = MessageHistory(self.path, batch_size=4, metrics=metrics)
+
+        release = threading.Event()
+        writing = threading.Event()
+        write = self.history._write
+
+        def slow_write(batch):
+            writing.set()
+            release.wait(5)
+            write(batch)
+
+        self.history._write = slow_write
+
+        # one message goes straight to the writer; the others wait for it
+        self.record(1)
+        assert writing.wait(5)
+        self.record(9)
+
+        release.set()
+        assert self.history.flush(timeout=5)
+
+        snap = metrics.snapshot()
+
+        assert snap["history_recorded"] == {(): 10}
+        assert snap["history_batches"] == {(): 4}
+        assert snap["history_queue_depth"] == {(): 0}
+
+    def test_full_queue(self):
+        self.history.close()
+        self.history = MessageHistory(self.path, maxsize=2)
+
+        release = threading.Event()
+        writing = threading.Event()
+        write = self.history._write
+
+        def slow_write(batch):
+            writing.set()
+            release.wait(5)
+            write(batch)
+
+        self.history._write = slow_write
+
+        self.record(1)
+        assert writing.wait(5)
+
+        # the writer is busy, so only two more messages fit in the queue
+        assert self.history.record(Direction.RECV, "#cqcqcq", "W0JHX", "a")
+        assert self.history.record(Direction.RECV, "#cqcqcq", "W0JHX", "b")
+        assert not self.history.record(Direction.RECV, "#cqcqcq", "W0JHX", "c")
+
+        release.set()
+        assert self.history.flush(timeout=5)
+
+        assert self.history.stats() == {"depth": 0, "recorded": 3, "dropped": 1}
+
+    def test_closed(self):
+        self.history.close()
+
+        assert not self.history.record(Direction.RECV, "#cqcqcq", "W0JHX", "late")
+        assert self.history.recent("#cqcqcq", 50) == []
+
+        # closing again does nothing
+        self.history.close()
+
+    def test_indexed_queries(self):
+        for sql, params in (
+            (SELECT_RECENT, ("#cqcqcq", 50)),
+            (SELECT_SENDER, ("W0JHX", 50)),
+            (SELECT_SINCE, (START_TIME, 50)),
+            (SELECT_CHANNEL_SINCE, ("#cqcqcq", START_TIME, 50)),
+        ):
+            plan = self.query_plan(sql, params)
+
+            # the rows come from an index, already in order
+            assert "USING COVERING INDEX" in plan or "USING INDEX" in plan, plan
+            assert "TEMP B-TREE" not in plan, plan
+
+        sql = SELECT_VISIBLE_SINCE.format(channels="?,?")
+        plan = self.query_plan(sql, (START_TIME, "#cqcqcq", "#other", "W0JHX", 50))
+
+        # each part of the query is searched in its own index
+        assert "USING INDEX messages_channel" in plan, plan
+        assert "USING INDEX messages_sender" in plan, plan
+
+    def query_plan(self, sql, params):
+        reader = self.history.reader
+        rows = reader.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+
+        return " ".join(row[-1] for row in rows)
+
+    def test_invalid_params(self):
+        self.assertRaises(ValueError, MessageHistory, self.path, batch_size=0)
+        self.assertRaises(ValueError, MessageHistory, self.path, maxsize=0)
+
+
+class ParseSinceTest(unittest.TestCase):
+    def test_durations(self):
+        assert parse_since("30s", now=START_TIME) == START_TIME - 30
+        assert parse_since("30m", now=START_TIME) == START_TIME - 1800
+        assert parse_since("2h", now=START_TIME) == START_TIME - 7200
+        assert parse_since("1d", now=START_TIME) == START_TIME - 86400
+
+    def test_time_of_day(self):
+        # earlier today (now is 14:37:03 UTC)
+        assert parse_since("14:30", now=START_TIME) == START_TIME - 423
+        assert parse_since("14:37:00", now=START_TIME) == START_TIME - 3
+
+        # a later time is yesterday
+        assert parse_since("15:00", now=START_TIME) == START_TIME - 86400 + 1377
+
+    def test_date_and_time(self):
+        expected = datetime(2021, 3, 18, 9, 15, tzinfo=timezone.utc).timestamp()
+
+        assert parse_since("2021-03-18T09:15", now=START_TIME) == expected
+        assert parse_since("2021-03-18 09:15:00+00:00", now=START_TIME) == expected
+
+    def test_invalid(self):
+        for text in ("soon", "25:00", "12:61", "30x", "2021-13-01"):
+            self.assertRaises(ValueError, parse_since, text, START_TIME)
+
+    def test_format_entry(self):
+        entry = HistoryEntry(
+            START_TIME, Direction.RECV, "#cqcqcq", "W0JHX", "hello", "vhf"
+        )
+
+        assert format_entry(entry) == "[2021-03-19 14:37:03] #cqcqcq <W0JHX> hello"
+        assert (
+            format_entry(entry, channel=False) == "[2021-03-19 14:37:03] <W0JHX> hello"
+        )
+
+        direct = entry._replace(channel=None)
+        assert format_entry(direct).startswith("[2021-03-19 14:37:03] (direct) ")
+
+
+class HistoryCommandTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.history = MessageHistory(os.path.join(self.tmpdir.name, "history.db"))
+        self.conn = FakeConnection()
+
+        self.jules = Juliet("unittest", RadioLoop(), "localhost", history=self.history)
+        self.jules.connection = self.conn
+        self.join("#joined", "KD0ABC")
+
+    def tearDown(self):
+        self.history.close()
+        self.tmpdir.cleanup()
+
+    def join(self, channel, *nicks):
+        chan = self.jules.channels.setdefault(channel, irc.bot.Channel())
+
+        for nick in nicks:
+            chan.add_user(nick)
+
+    def command(self, cmd, *params):
+        del self.conn.sent[:]
+        self.jules._do_command(self.conn, "KD0ABC", cmd, list(params))
+        return [text for kind, _, text in self.conn.sent if kind == "privmsg"]
+
+    def test_both_directions(self):
+        source = irc.client.NickMask("W0JHX!w0jhx@localhost")
+        event = irc.client.Event("pubmsg", source, "#joined", ["hello world"])
+
+        # the loopback radio hands the message straight back
+        self.jules.on_pubmsg(self.conn, event)
+        self.command("xmit", "direct", "text")
+
+        assert self.history.flush(timeout=5)
+
+        entries = self.history.since(0)
+
+        assert [(e.direction, e.channel, e.content) for e in entries] == [
+            (Direction.XMIT, "#joined", "hello world"),
+            (Direction.RECV, "#joined", "hello world"),
+            (Direction.XMIT, None, "direct text"),
+        ]
+        assert entries[1].radio == "radio"
+
+    def test_history_command(self):
+        for idx in range(5):
+            self.history.record(Direction.RECV, "#joined", "W0JHX", f"msg {idx}")
+
+        assert self.history.flush(timeout=5)
+
+        lines = self.command("history", "#joined", "2")
+
+        assert len(lines) == 2
+        assert lines[0].endswith("<W0JHX> msg 3")
+        assert lines[1].endswith("<W0JHX> msg 4")
+
+        assert len(self.command("history", "#joined")) == 5
+
+        self.join("#empty", "KD0ABC")
+        assert self.command("history", "#empty") == ["No history for #empty."]
+        assert self.command("history") == ["Usage: history <#channel> [count]"]
+        assert self.command("history", "#joined", "lots") == [
+            "Usage: history <#channel> [count]"
+        ]
+
+    def test_since_command(self):
+        self.join("#busy", "KD0ABC")
+        self.join("#empty", "KD0ABC")
+
+        for idx in range(MAX_HISTORY_LINES + 5):
+            self.history.record(Direction.RECV, "#busy", "W0JHX", f"msg {idx}")
+
+        self.history.record(Direction.RECV, "#joined", "W0JHX", "hello")
+
+        assert self.history.flush(timeout=5)
+
+        lines = self.command("since", "1h", "#joined")
+        assert len(lines) == 1
+        assert lines[0].endswith("<W0JHX> hello")
+
+        # long answers are cut short
+        lines = self.command("since", "1h")
+        assert len(lines) == MAX_HISTORY_LINES + 1
+        assert " #busy <W0JHX> msg 0" in lines[0]
+        assert lines[-1] == "More messages were left out; try a later time."
+
+        assert self.command("since", "1h", "#empty") == ["No messages since then."]
+        assert self.command("since") == ["Usage: since <time> [#channel]"]
+        assert self.command("since", "soon") == [
+            'Sorry, I don\'t understand the time "soon"'
+        ]
+
+    def test_since_private(self):
+        self.history.record(Direction.RECV, "#joined", "W0JHX", "hello")
+        self.history.record(Direction.RECV, "#secret", "W0JHX", "hidden")
+        self.history.record(Direction.XMIT, None, "W0JHX", "not for you")
+        self.history.record(Direction.XMIT, None, "KD0ABC", "my own")
+
+        assert self.history.flush(timeout=5)
+
+        # only channels we are on and our own direct messages are shown
+        lines = self.command("since", "1d")
+
+        assert len(lines) == 2
+        assert lines[0].endswith(" #joined <W0JHX> hello")
+        assert lines[1].endswith(" (direct) <KD0ABC> my own")
+
+    def test_private_channels(self):
+        # we have left #parted; #private is keyed, and the asker is not on it
+        self.join("#private", "W0JHX")
+
+        for channel in ("#parted", "#private"):
+            self.history.record(Direction.RECV, channel, "W0JHX", "secret")
+
+        assert self.history.flush(timeout=5)
+
+        for channel in ("#parted", "#PRIVATE"):
+            denied = [f"You must be on {channel} to see its history."]
+
+            assert self.command("history", channel) == denied
+            assert self.command("since", "1d", channel) == denied
+
+        assert self.command("since", "1d") == ["No messages since then."]
+
+        # once on the channel, its history can be read
+        self.join("#private", "KD0ABC")
+
+        assert len(self.command("history", "#private")) == 1
+        assert len(self.command("since", "1d")) == 1
+
+    def test_disabled(self):
+        jules = Juliet("unittest", RadioLoop(), "localhost")
+
+        for cmd in ("history", "since"):
+            del self.conn.sent[:]
+            jules._do_command(self.conn, "KD0ABC", cmd, ["#joined"])
+            assert self.conn.sent == [("privmsg", "KD0ABC", "History is not enabled.")]
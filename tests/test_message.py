@@ -1,14 +1,40 @@
 import logging
+import random
 import string
+import tracemalloc
 import unittest
+import urllib.parse
+from datetime import datetime, timedelta, timezone
 
+from juliet.dedup import DedupCache
 from juliet.message import (
     ChannelMessage,
+    CompressedMessage,
     CompressedTextMessage,
+    DeflateChannelMessage,
+    DeflateTextMessage,
     FileMessage,
+    Message,
     MessageBuffer,
+    RingMessageBuffer,
     TextMessage,
+    char_entities,
+    char_escape,
+    char_unescape,
+    format_epoch,
+    format_timestamp,
+    frame_spans,
+    make_safe_filename,
+    message_types,
+    msg_frame_re,
+    pack_frame,
+    packed_msg_re,
+    parse_epoch,
+    parse_timestamp,
+    select_shortest,
+    split_frame,
 )
+from juliet.metrics import MetricsRegistry
 
 # keep logging output to a minumim for testing
 logging.basicConfig(level=logging.FATAL)
@@ -104,6 +130,194 @@ class MessageBufferTest(unittest.TestCase):
 
         assert self.inbox is None
 
+    def test_bad_content(self):
+        metrics = MetricsRegistry()
+        msgbuf = MessageBuffer(metrics=metrics)
+        channels = []
+
+        msgbuf.on_message += lambda mbuf, msg: channels.append(msg.channel)
+
+        # the checksum is valid, but the channel content has no separator
+        bad = pack_frame(ChannelMessage.version, "unittest", 1616164623, "nospace")
+        good = ChannelMessage("hello", channel="#cq", sender="unittest").pack()
+
+        msgbuf.append(bad + good)
+
+        assert channels == ["#cq"]
+        assert msgbuf.buffer_size() == 0
+
+        snap = metrics.snapshot()
+        assert snap["buffer_invalid_frames"] == {(): 1}
+        assert snap["buffer_frames"] == {(): 1}
+
+    def test_discard_garbage(self):
+        self.inbox = None
+        self.msgbuf.reset()
+
+        self.msgbuf.append(b"$GPRMC,143703,A,4807.038,N,01131.000,E*6A\r\n" * 100)
+        assert len(self.msgbuf.buffer) <= 1
+
+        self.msgbuf.append(b"junk>>0:36FB:unittest:20210")
+        assert self.msgbuf.buffer == b">>0:36FB:unittest:20210"
+
+        self.msgbuf.append(b"319143703:hello world:<<more junk>")
+        assert len(self.inbox) == 1
+        assert self.msgbuf.buffer == b">"
+
+    def test_frame_scanner(self):
+        rand = random.Random(2021)
+
+        for _ in range(200):
+            stream = bytes(rand.choice(b"<<>>ab:") for _ in range(rand.randrange(200)))
+
+            # the reference: a regex search over the complete stream
+            expected = [match.group(0) for match in msg_frame_re.finditer(stream)]
+
+            # feed the stream to the scanner in random chunks
+            msgbuf = MessageBuffer()
+            frames = []
+            offset = 0
+
+            while offset < len(stream):
+                chunk = rand.randrange(1, 10)
+                msgbuf.buffer += stream[offset : offset + chunk]
+                offset += chunk
+
+                frame = msgbuf.next_frame()
+
+                while frame:
+                    frames.append(frame)
+                    frame = msgbuf.next_frame()
+
+                msgbuf.compact()
+
+            assert frames == expected, stream
+
+
+class RingMessageBufferTest(unittest.TestCase):
+    def setUp(self):
+        self.inbox = []
+
+        self.msgbuf = RingMessageBuffer(size=256)
+        self.msgbuf.on_message += lambda mbuf, msg: self.inbox.append(msg)
+
+    def test_split_message(self):
+        self.msgbuf.append(b">>0:36FB:unittest:20210")
+        assert self.inbox == []
+
+        self.msgbuf.append(b"319143703:hello world:<<")
+        assert len(self.inbox) == 1
+
+        msg = self.inbox[0]
+
+        assert msg.sender == "unittest"
+        assert msg.content == "hello world"
+        assert self.msgbuf.buffer_size() == 0
+
+    def test_messages_outlive_ring(self):
+        frames = [
+            TextMessage(f"message {idx}", sender="W0JHX").pack() for idx in range(50)
+        ]
+
+        # the ring is reused many times over, which must not change the messages
+        for frame in frames:
+            self.msgbuf.append(frame[:7])
+            self.msgbuf.append(frame[7:])
+
+        expected = [Message.unpack(frame) for frame in frames]
+        assert self.inbox == expected
+
+    def test_same_as_buffer(self):
+        rand = random.Random(1621)
+
+        parts = []
+
+        for idx in range(200):
+            frame = TextMessage(f"message {idx} " * rand.randrange(1, 8)).pack()
+
+            if idx % 10 == 3:
+                frame = frame.replace(b"message", b"mess4ge")
+
+            parts.append(frame)
+            parts.append(bytes(rand.choice(b"<<>>ab:\r\n") for _ in range(8)))
+
+        stream = b"".join(parts)
+
+        expected = []
+        msgbuf = MessageBuffer()
+        msgbuf.on_message += lambda mbuf, msg: expected.append(msg)
+        msgbuf.append(stream)
+
+        offset = 0
+
+        while offset < len(stream):
+            chunk = rand.randrange(1, 300)
+            self.msgbuf.append(stream[offset : offset + chunk])
+            offset += chunk
+
+        assert len(expected) == 180
+        assert self.inbox == expected
+
+    def test_oversized_frame(self):
+        metrics = MetricsRegistry()
+
+        msgbuf = RingMessageBuffer(size=64, metrics=metrics)
+        msgbuf.on_message += lambda mbuf, msg: self.inbox.append(msg)
+
+        large = TextMessage("x" * 100).pack()
+        small = TextMessage("hello").pack()
+
+        msgbuf.append(large[:40])
+        msgbuf.append(large[40:] + small)
+
+        assert [msg.content for msg in self.inbox] == ["hello"]
+        assert metrics.snapshot()["buffer_bytes_trimmed"][()] > 0
+        assert metrics.snapshot()["buffer_size"][()] == 0
+
+    def test_dedup(self):
+        msgbuf = RingMessageBuffer(size=256, dedup=DedupCache())
+        msgbuf.on_message += lambda mbuf, msg: self.inbox.append(msg)
+
+        first = TextMessage("hello world", sender="unittest").pack()
+        second = TextMessage("goodbye world", sender="unittest").pack()
+
+        msgbuf.append(first + first + second)
+        msgbuf.append(first)
+
+        assert [msg.content for msg in self.inbox] == ["hello world", "goodbye world"]
+
+    # the peak memory used while receiving a stream of frames
+    def peak_memory(self, msgbuf, chunks):
+        tracemalloc.start()
+
+        try:
+            for chunk in chunks:
+                msgbuf.append(chunk)
+
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def test_allocations(self):
+        content = "".join(random.Random(1621).choices(string.ascii_letters, k=16384))
+        stream = b"".join(TextMessage(content).pack() for _ in range(8))
+        chunks = [stream[idx : idx + 1024] for idx in range(0, len(stream), 1024)]
+
+        ring = RingMessageBuffer(size=64 * 1024)
+        ring.on_message += lambda mbuf, msg: self.inbox.append(len(msg.content))
+
+        growing = MessageBuffer()
+        growing.on_message += lambda mbuf, msg: self.inbox.append(len(msg.content))
+
+        ring_peak = self.peak_memory(ring, chunks)
+        growing_peak = self.peak_memory(growing, chunks)
+
+        assert self.inbox == [16384] * 16
+
+        # decoding the content (twice, when loaded) is the only copy of a frame
+        assert ring_peak < 3 * len(content)
+        assert ring_peak < growing_peak / 2
+
 
 class MessageTest(unittest.TestCase):
     def test_printable_characters(self):
@@ -162,6 +376,87 @@ class MessageTest(unittest.TestCase):
 
         assert orig == copy
 
+    def test_deflate_text_message(self):
+        texts = [
+            "",
+            "hi",
+            "good morning everyone, checking in from Denver",
+            "<<Lorem ipsum:dolor sit amet>>",
+            "你好世界 😀🙃😳🤔",
+            string.printable * 4,
+        ]
+
+        for text in texts:
+            orig = DeflateTextMessage(text, sender="unittest")
+            packed = orig.pack()
+            copy = Message.unpack(packed)
+
+            assert isinstance(copy, DeflateTextMessage)
+            assert copy.content == text
+            assert orig == copy
+
+            # the encoded content must not contain any framing characters
+            content = split_frame(packed)[4]
+            assert b"<" not in content
+            assert b">" not in content
+            assert b":" not in content
+
+    def test_deflate_channel_message(self):
+        orig = DeflateChannelMessage("see you on the air", "#CQCQCQ", sender="unittest")
+        packed = orig.pack()
+        copy = Message.unpack(packed)
+
+        assert isinstance(copy, ChannelMessage)
+        assert copy.channel == "#CQCQCQ"
+        assert copy.content == "see you on the air"
+
+        assert orig == copy
+
+    def test_deflate_channel_lazy(self):
+        version = DeflateChannelMessage.version
+        bad = pack_frame(version, "unittest", 1616164623, '#cq "not deflated"')
+
+        copy = Message.unpack(bad)
+
+        # the channel is read without inflating the content
+        assert copy.channel == "#cq"
+
+        for _ in range(2):
+            self.assertRaises(ValueError, getattr, copy, "content")
+
+        # the content of a valid message is only inflated once
+        orig = DeflateChannelMessage("see you on the air", "#cq", sender="unittest")
+        copy = Message.unpack(orig.pack())
+
+        assert copy.channel == "#cq"
+        assert copy._deflated is not None
+
+        assert copy.content == "see you on the air"
+        assert copy._deflated is None
+
+    def test_preset_dictionary(self):
+        text = "good morning everyone, checking in with no traffic"
+
+        plain = TextMessage(text, sender="unittest")
+        deflate = DeflateTextMessage(text, sender="unittest")
+        compressed = CompressedTextMessage(text, sender="unittest")
+
+        assert len(deflate.pack()) < len(plain.pack())
+        assert len(deflate.pack()) < len(compressed.pack())
+
+    def test_select_shortest(self):
+        text = "checking in from the EOC, standing by for traffic"
+        plain = TextMessage(text)
+        deflate = DeflateTextMessage(text)
+
+        assert select_shortest(plain, deflate) is deflate
+
+        # very short messages are not worth compressing
+        plain = TextMessage("ok")
+        deflate = DeflateTextMessage("ok")
+
+        assert select_shortest(plain, deflate) is plain
+
     def test_channel_message(self):
         text = "hello world"
         channel = "#general"
@@ -188,6 +483,46 @@ class MessageTest(unittest.TestCase):
         assert orig.content == content
         assert content == copy.content
 
+    def test_message_registry(self):
+        assert message_types[TextMessage.version] is TextMessage
+        assert message_types[ChannelMessage.version] is ChannelMessage
+
+        # CompressedMessage does not declare a version of its own
+        assert CompressedMessage not in message_types.values()
+
+        with self.assertRaises(ValueError):
+
+            class DuplicateMessage(TextMessage):
+                version = TextMessage.version
+
+    def test_lazy_content(self):
+        # corrupt the compressed data without touching the header...
+        class BrokenMessage(CompressedTextMessage):
+            def pack_content(self):
+                return "bm90IHpsaWIgZGF0YQ=="
+
+        broken = BrokenMessage("hello world", sender="unittest")
+        packed = broken.pack()
+
+        # the message unpacks without decompressing the content
+        copy = Message.unpack(packed)
+        assert isinstance(copy, CompressedTextMessage)
+        assert copy.sender == "unittest"
+
+        with self.assertRaises(ValueError):
+            assert copy.content is None
+
+        # reading the fields again fails the same way
+        with self.assertRaises(ValueError):
+            assert copy.content is None
+
+        bad = pack_frame(ChannelMessage.version, "unittest", 1616164623, "nospace")
+        copy = Message.unpack(bad)
+
+        for _ in range(2):
+            self.assertRaises(ValueError, getattr, copy, "channel")
+            self.assertRaises(ValueError, getattr, copy, "content")
+
     def check_standard_text_msg(self, text):
         orig = TextMessage(text, sender="unittest")
         packed = orig.pack()
@@ -201,3 +536,313 @@ class MessageTest(unittest.TestCase):
         assert text == copy.content
 
         assert orig == copy
+
+
+class FrameParserTest(unittest.TestCase):
+    pieces = [
+        b">>",
+        b"<<",
+        b":",
+        b"::",
+        b"0",
+        b"7",
+        b"Af",
+        b"g",
+        b"Z",
+        b"36FB",
+        b"unittest",
+        b"-|~",
+        b" ",
+        b"\n",
+        b"\\",
+        b"20210319143703",
+        b"2021031914370",
+        "é😀".encode(),
+        b"\xff",
+    ]
+
+    def reference(self, text):
+        match = packed_msg_re.match(text)
+
+        if match is None:
+            return None
+
+        groups = match.group("ver", "crc", "sender", "time", "msg", "sig")
+        return tuple(None if grp is None else bytes(grp, "utf-8") for grp in groups)
+
+    def random_frame(self, rand):
+        if rand.random() < 0.5:
+            parts = [rand.choice(self.pieces) for _ in range(rand.randrange(12))]
+            return b"".join(parts)
+
+        # mostly well-formed frames with random fields
+        fields = [
+            rand.choice([b"0", b"3", b"1f", b"", b"x"]),
+            rand.choice([b"36FB", b"", b"zz", b"-"]),
+            rand.choice([b"unittest", b"", b"a|b", b"no space"]),
+            rand.choice([b"20210319143703", b"", b"2021", b"2021031914370a"]),
+            b"".join(rand.choice(self.pieces) for _ in range(rand.randrange(5))),
+            rand.choice([b"", b"sig", b"s:g", b"<<"]),
+        ]
+
+        return b">>" + b":".join(fields) + rand.choice([b"<<", b"<<\n", b"<", b""])
+
+    def test_differential(self):
+        rand = random.Random(1403)
+
+        for _ in range(20000):
+            data = self.random_frame(rand)
+
+            try:
+                text = str(data, "utf-8")
+            except UnicodeDecodeError:
+                assert Message.unpack(data, verify_crc=False) is None
+                continue
+
+            assert split_frame(data) == self.reference(text), data
+
+    def test_spans(self):
+        rand = random.Random(1403)
+
+        for _ in range(20000):
+            data = self.random_frame(rand)
+            fields = split_frame(data)
+            spans = frame_spans(memoryview(data))
+
+            if fields is None:
+                assert spans is None, data
+                continue
+
+            found = tuple(data[start:end] or None for start, end in spans)
+            assert found == fields, data
+
+    def test_unpack_view(self):
+        rand = random.Random(1403)
+
+        for _ in range(2000):
+            msg = ChannelMessage(
+                random_text(rand, rand.randrange(1, 32)),
+                channel="#general",
+                sender=rand.choice([None, "W0JHX"]),
+            )
+            frame = msg.pack()
+            view = memoryview(bytearray(b"junk" + frame + b"junk"))[4:-4]
+
+            assert Message.unpack(view) == msg
+            assert Message.unpack(view) == Message.unpack(frame)
+
+        # invalid frames are handled the same way as bytes
+        corrupt = bytearray(frame.replace(b"#general", b"#genera1"))
+
+        with self.assertRaises(ValueError):
+            Message.unpack(memoryview(corrupt))
+
+        assert Message.unpack(memoryview(b">>0:\xff<<")) is None
+
+    def test_parse_fields(self):
+        data = b">>3:F00D:unittest:20210319143703:#general hello: world:<<"
+        fields = split_frame(data)
+
+        assert fields == (
+            b"3",
+            b"F00D",
+            b"unittest",
+            b"20210319143703",
+            b"#general hello: world",
+            None,
+        )
+
+    def test_parse_timestamp(self):
+        tstamp = parse_timestamp("20210319143703")
+        assert tstamp == datetime(2021, 3, 19, 14, 37, 3, tzinfo=timezone.utc)
+
+        assert parse_timestamp(b"20210319143703") == tstamp
+
+        for bad in ("20211319143703", "20210230143703", "20210319246000", "2021"):
+            with self.assertRaises(ValueError):
+                parse_timestamp(bad)
+
+
+class TimestampTest(unittest.TestCase):
+    def test_epoch_roundtrip(self):
+        rand = random.Random(1621)
+
+        for _ in range(1000):
+            seconds = rand.randrange(0, 4102444800)
+            tstamp = datetime.fromtimestamp(seconds, tz=timezone.utc)
+
+            text = format_epoch(seconds)
+
+            assert text == tstamp.strftime("%Y%m%d%H%M%S")
+            assert parse_epoch(text) == seconds
+            assert parse_epoch(text.encode("ascii")) == seconds
+
+    def test_leap_day(self):
+        seconds = parse_epoch("20240229235959")
+        assert format_epoch(seconds + 1) == "20240301000000"
+
+    def test_invalid_epoch(self):
+        for bad in ("20210319240000", "20210319236000", "20210319235960", None):
+            with self.assertRaises(ValueError):
+                parse_epoch(bad)
+
+    def test_format_timestamp(self):
+        tstamp = datetime(
+            2021, 3, 19, 8, 37, 3, 999, tzinfo=timezone(-timedelta(hours=6))
+        )
+        assert format_timestamp(tstamp) == "20210319143703"
+
+    def test_message_time(self):
+        tstamp = datetime(2021, 3, 19, 14, 37, 3, 500000, tzinfo=timezone.utc)
+        msg = TextMessage("hello world", timestamp=tstamp)
+
+        # messages are only accurate to the second
+        assert msg.timestamp == tstamp.replace(microsecond=0)
+        assert msg.epoch == 1616164623
+
+        # the time may also be given in seconds
+        assert TextMessage("hello world", timestamp=1616164623) == msg
+
+        msg.epoch = 1616164624
+        assert msg.timestamp == datetime(2021, 3, 19, 14, 37, 4, tzinfo=timezone.utc)
+
+        msg.timestamp = tstamp
+        assert msg.epoch == 1616164623
+
+    def test_unpacked_time(self):
+        msg = ChannelMessage("hello", channel="#general", timestamp=1616164623)
+        copy = Message.unpack(msg.pack())
+
+        assert copy.epoch == 1616164623
+        assert copy.timestamp.tzinfo == timezone.utc
+        assert copy == msg
+
+
+class MessageSlotsTest(unittest.TestCase):
+    def test_no_dict(self):
+        for msg_type in message_types.values():
+            assert "__dict__" not in dir(msg_type), msg_type
+
+        msg = ChannelMessage("hello", channel="#general")
+
+        with self.assertRaises(AttributeError):
+            msg.extra = True
+
+    def test_equality(self):
+        msg = ChannelMessage("hello", channel="#general", timestamp=1616164623)
+
+        same = ChannelMessage("hello", channel="#general", timestamp=1616164623)
+        other = ChannelMessage("hello", channel="#random", timestamp=1616164623)
+        later = ChannelMessage("hello", channel="#general", timestamp=1616164624)
+
+        assert msg == same
+        assert msg != other
+        assert msg != later
+        assert msg != TextMessage("hello", timestamp=1616164623)
+
+    def test_subclass_without_slots(self):
+        class TaggedMessage(TextMessage):
+            pass
+
+        msg = TaggedMessage("hello", timestamp=1616164623)
+        msg.tag = "a"
+
+        copy = TaggedMessage("hello", timestamp=1616164623)
+        copy.tag = "b"
+
+        assert msg != copy
+
+
+# random text, weighted towards the characters that need escaping
+def random_text(rand, length):
+    alphabet = string.printable + "%%%%::<<>>\r\n" + "äß€日本😀"
+    return "".join(rand.choice(alphabet) for _ in range(length))
+
+
+class EscapeTest(unittest.TestCase):
+    def test_roundtrip(self):
+        rand = random.Random(1621)
+
+        for _ in range(2000):
+            text = random_text(rand, rand.randrange(0, 64))
+            escaped = char_escape(text)
+
+            assert char_unescape(escaped) == text
+
+            # no protocol characters are left in the escaped text
+            for ch in ":<>\r\n":
+                assert ch not in escaped
+
+    def test_escaped_entities(self):
+        for ch, entity in char_entities.items():
+            assert char_escape(ch) == entity
+            assert char_unescape(entity) == ch
+
+        assert char_escape("50% at 12:30") == "50%25 at 12%3A30"
+        assert char_unescape("%253A") == "%3A"
+
+    def test_unquote_compatible(self):
+        rand = random.Random(1621)
+
+        # receivers that decode with urllib get the same text back
+        for _ in range(1000):
+            text = random_text(rand, rand.randrange(0, 64))
+            assert urllib.parse.unquote(char_escape(text)) == text
+
+    def test_unescape_left_to_right(self):
+        rand = random.Random(1621)
+        entities = {entity[1:]: ch for ch, entity in char_entities.items()}
+
+        # decode each % in turn, as a reader would
+        def expected(text):
+            first, *rest = text.split("%")
+            parts = [first]
+
+            for part in rest:
+                ch = entities.get(part[:2])
+                parts.append("%" + part if ch is None else ch + part[2:])
+
+            return "".join(parts)
+
+        for _ in range(5000):
+            text = "".join(rand.choice("ab%%%235ACDE0") for _ in range(12))
+            assert char_unescape(text) == expected(text)
+
+    def test_unescape_plain(self):
+        text = "good morning everyone"
+        assert char_unescape(text) is text
+
+    def test_unescape_unknown(self):
+        # senders that do not escape % leave other codes in the text
+        assert char_unescape("100%") == "100%"
+        assert char_unescape("%") == "%"
+        assert char_unescape("%%3A") == "%:"
+        assert char_unescape("%20%3a%41") == "%20%3a%41"
+        assert char_unescape("%3") == "%3"
+
+
+class SafeFilenameTest(unittest.TestCase):
+    def test_safe_filename(self):
+        assert make_safe_filename(None) is None
+        assert make_safe_filename("") is None
+
+        assert make_safe_filename("notes.txt") == "notes.txt"
+        assert make_safe_filename(" my_notes - v2.txt ") == "my_notes - v2.txt"
+        assert make_safe_filename("../../etc/passwd") == "....etcpasswd"
+        assert make_safe_filename("a:b<c>d|e?.txt") == "abcde.txt"
+        assert make_safe_filename("résumé.pdf") == "résumé.pdf"
+        assert make_safe_filename("/\\") == ""
+
+    def test_matches_isalnum(self):
+        rand = random.Random(1621)
+
+        def expected(name):
+            safe = "".join(c for c in name if c.isalnum() or c in ".-_ ")
+            return safe.strip()
+
+        for _ in range(2000):
+            name = "".join(
+                chr(rand.randrange(0x20, 0x3000)) for _ in range(rand.randrange(1, 32))
+            )
+
+            assert make_safe_filename(name) == expected(name)
@@ -0,0 +1,240 @@
+"""Unit test module for Juliet."""
+
+import logging
+import unittest
+import urllib.error
+import urllib.request
+
+import irc.bot
+import irc.client
+
+from juliet import Juliet
+from juliet.message import ChannelMessage, MessageBuffer, TextMessage
+from juliet.metrics import (
+    NULL_METRIC,
+    NULL_REGISTRY,
+    Histogram,
+    MetricsRegistry,
+    MetricsServer,
+)
+from juliet.radio import RadioLoop
+
+# keep logging output to a minumim for testing
+logging.basicConfig(level=logging.FATAL)
+
+
+class FakeConnection:
+    def __init__(self):
+        self.sent = []
+
+    def notice(self, target, text):
+        self.sent.append(("notice", target, text))
+
+    def privmsg(self, target, text):
+        self.sent.append(("privmsg", target, text))
+
+
+class MetricsRegistryTest(unittest.TestCase):
+    def test_counter(self):
+        metrics = MetricsRegistry()
+
+        counter = metrics.counter("frames")
+        counter.inc()
+        counter.inc(4)
+
+        # the same name returns the same counter
+        assert metrics.counter("frames") is counter
+        assert metrics.snapshot()["frames"] == {(): 5}
+
+    def test_labels(self):
+        metrics = MetricsRegistry()
+
+        metrics.counter("relayed", channel="#a").inc()
+        metrics.counter("relayed", channel="#b").inc(2)
+        metrics.counter("relayed", channel="#a").inc()
+
+        assert metrics.snapshot()["relayed"] == {
+            (("channel", "#a"),): 2,
+            (("channel", "#b"),): 2,
+        }
+
+    def test_gauge(self):
+        metrics = MetricsRegistry()
+        items = [1, 2, 3]
+
+        metrics.gauge("depth", lambda: len(items))
+        metrics.gauge("level").set(7)
+
+        assert metrics.snapshot()["depth"] == {(): 3}
+        assert metrics.snapshot()["level"] == {(): 7}
+
+        items.clear()
+        assert metrics.snapshot()["depth"] == {(): 0}
+
+    def test_kind_mismatch(self):
+        metrics = MetricsRegistry()
+        metrics.counter("frames")
+
+        with self.assertRaises(ValueError):
+            metrics.histogram("frames")
+
+    def test_histogram(self):
+        hist = Histogram(buckets=(0.1, 1, 10))
+
+        for value in (0.05, 0.5, 0.5, 5, 50):
+            hist.observe(value)
+
+        snap = hist.snapshot()
+
+        assert snap["count"] == 5
+        assert snap["sum"] == 56.05
+        assert list(snap["buckets"].values()) == [1, 2, 1, 1]
+
+        assert hist.quantile(0.5) == 1
+        assert hist.quantile(0.8) == 10
+
+        # past the last bucket
+        assert hist.quantile(1.0) is None
+
+    def test_render(self):
+        metrics = MetricsRegistry()
+
+        metrics.counter("relayed", channel="#a").inc(3)
+        metrics.histogram("latency", buckets=(0.1, 1)).observe(0.5)
+
+        text = metrics.render()
+
+        assert "# TYPE relayed counter\n" in text
+        assert 'relayed{channel="#a"} 3\n' in text
+        assert "# TYPE latency histogram\n" in text
+        assert 'latency_bucket{le="0.1"} 0\n' in text
+        assert 'latency_bucket{le="1"} 1\n' in text
+        assert 'latency_bucket{le="+Inf"} 1\n' in text
+        assert "latency_count 1\n" in text
+
+    def test_render_escapes(self):
+        metrics = MetricsRegistry()
+
+        metrics.counter("relayed", channel='#a"b\\c\nd').inc()
+
+        # label values may not break the line or the quotes around them
+        assert 'relayed{channel="#a\\"b\\\\c\\nd"} 1\n' in metrics.render()
+
+    def test_summary(self):
+        metrics = MetricsRegistry()
+
+        metrics.counter("radio_bytes_in").inc(10)
+        metrics.counter("buffer_frames").inc(2)
+
+        assert metrics.summary() == ["buffer_frames = 2", "radio_bytes_in = 10"]
+        assert metrics.summary("radio") == ["radio_bytes_in = 10"]
+
+    def test_null_registry(self):
+        assert not NULL_REGISTRY.enabled
+        assert NULL_REGISTRY.counter("frames") is NULL_METRIC
+        assert NULL_REGISTRY.histogram("latency") is NULL_METRIC
+
+        NULL_REGISTRY.counter("frames").inc()
+        NULL_REGISTRY.gauge("depth", lambda: 1)
+
+        assert NULL_REGISTRY.snapshot() == {}
+        assert NULL_REGISTRY.labeled(radio="vhf") is NULL_REGISTRY
+
+    def test_labeled(self):
+        metrics = MetricsRegistry()
+
+        vhf = metrics.labeled(radio="vhf")
+        uhf = metrics.labeled(radio="uhf")
+
+        assert vhf.enabled
+
+        vhf.counter("frames").inc()
+        uhf.counter("frames").inc(2)
+        vhf.labeled(lane="bulk").counter("frames").inc(3)
+        vhf.gauge("depth", lambda: 4)
+        uhf.histogram("latency", buckets=(0.1, 1)).observe(0.5)
+
+        snap = metrics.snapshot()
+
+        assert snap["frames"] == {
+            (("radio", "uhf"),): 2,
+            (("radio", "vhf"),): 1,
+            (("lane", "bulk"), ("radio", "vhf")): 3,
+        }
+        assert snap["depth"] == {(("radio", "vhf"),): 4}
+        assert snap["latency"][(("radio", "uhf"),)]["count"] == 1
+
+
+class MetricsServerTest(unittest.TestCase):
+    def test_http(self):
+        metrics = MetricsRegistry()
+        metrics.counter("frames").inc(3)
+
+        server = MetricsServer(metrics, port=0)
+        url = f"http://127.0.0.1:{server.port}"
+
+        try:
+            with urllib.request.urlopen(f"{url}/metrics", timeout=5) as resp:
+                assert resp.status == 200
+                assert resp.read().decode("utf-8") == metrics.render()
+
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(f"{url}/other", timeout=5)
+
+        finally:
+            server.close()
+
+
+class InstrumentationTest(unittest.TestCase):
+    def test_message_buffer(self):
+        metrics = MetricsRegistry()
+        msgbuf = MessageBuffer(maxlen=1024, metrics=metrics)
+
+        good = TextMessage("hello world").pack()
+        bad = good.replace(b"hello", b"jello")
+
+        msgbuf.append(good + b"junk" + bad + b"x" * 2000)
+
+        snap = metrics.snapshot()
+
+        assert snap["buffer_frames"] == {(): 1}
+        assert snap["buffer_invalid_frames"] == {(): 1}
+        assert snap["buffer_bytes_in"] == {(): len(good) + 4 + len(bad) + 2000}
+        assert snap["buffer_size"] == {(): 1}
+
+    def test_radio_loop(self):
+        metrics = MetricsRegistry()
+        conn = FakeConnection()
+
+        jules = Juliet("unittest", RadioLoop(), "localhost", metrics=metrics)
+        jules.connection = conn
+        jules.channels["#joined"] = irc.bot.Channel()
+
+        source = irc.client.NickMask("W0JHX!w0jhx@localhost")
+        event = irc.client.Event("pubmsg", source, "#joined", ["hello world"])
+
+        # the loopback radio hands the message straight back
+        jules.on_pubmsg(conn, event)
+
+        msg = ChannelMessage("hello", channel="#other", sender="W0JHX")
+        jules._radio_recv(jules.radio, msg.pack())
+
+        snap = metrics.snapshot()
+
+        assert snap["juliet_relayed"] == {
+            (("channel", "#joined"), ("to", "irc")): 1,
+            (("channel", "#joined"), ("to", "radio")): 1,
+        }
+        assert snap["juliet_dropped"] == {(): 1}
+        assert snap["juliet_recv_latency_seconds"][()]["count"] == 1
+
+        # the metrics command replies with a summary
+        jules._do_command(conn, "W0JHX", "metrics", ["juliet_dropped"])
+        assert conn.sent[-1] == ("privmsg", "W0JHX", "juliet_dropped = 1")
+
+    def test_disabled(self):
+        conn = FakeConnection()
+        jules = Juliet("unittest", RadioLoop(), "localhost")
+
+        jules._do_command(conn, "W0JHX", "metrics", [])
+        assert conn.sent == [("privmsg", "W0JHX", "Metrics are not enabled.")]
@@ -1,5 +1,8 @@
 import os
+import select
+import threading
 import time
+import tty
 import unittest
 
 import serial
@@ -86,3 +89,117 @@ class RadioCommTest(unittest.TestCase, InboxMixin):
         time.sleep(2)  # yield to recv thread
 
         self.check_inbox(bytes("hello\n", "utf-8"), bytes("world\n", "utf-8"))
+
+
+# shared tests for serial radios using a pty pair in place of the radio
+class PtyRadioMixin(InboxMixin):
+    radio_class = None
+
+    def setUp(self):
+        self.master, slave = os.openpty()
+        tty.setraw(self.master)
+
+        self.received = threading.Event()
+
+        self.radio = self.radio_class(os.ttyname(slave), xmit_gap=0)
+        self.radio.on_recv += self.recv_msg
+        self.radio.on_recv += lambda radio, data: self.received.set()
+
+        os.close(slave)
+
+    def tearDown(self):
+        self.radio.close()
+        os.close(self.master)
+
+    def read_master(self, size, timeout=5):
+        data = b""
+        deadline = time.monotonic() + timeout
+
+        while len(data) < size and time.monotonic() < deadline:
+            ready, _, _ = select.select([self.master], [], [], 0.1)
+
+            if ready:
+                data += os.read(self.master, size - len(data))
+
+        return data
+
+    def wait_for_inbox(self, size, timeout=5):
+        deadline = time.monotonic() + timeout
+
+        while time.monotonic() < deadline:
+            if self.inbox is not None and len(b"".join(self.inbox)) >= size:
+                break
+
+            self.received.wait(0.1)
+            self.received.clear()
+
+        return b"".join(self.inbox or [])
+
+    def test_basic_pty_read(self):
+        self.inbox = None
+        data = b"hello world!"
+
+        os.write(self.master, data)
+
+        assert self.wait_for_inbox(len(data)) == data
+
+    def test_basic_pty_write(self):
+        sent = []
+        done = threading.Event()
+
+        self.radio.on_xmit += lambda radio, data: sent.append(data)
+        self.radio.on_xmit += lambda radio, data: done.set()
+
+        assert self.radio.send(b"hello world!")
+        assert self.read_master(12) == b"hello world!"
+
+        assert done.wait(5)
+        assert sent == [b"hello world!"]
+
+    def test_full_duplex(self):
+        self.inbox = None
+
+        outgoing = bytes(range(256)) * 64
+        incoming = bytes(reversed(range(256))) * 64
+
+        radio = self.radio_class(
+            self.radio.comm.port, xmit_rate=1e9, xmit_burst=len(outgoing)
+        )
+        radio.on_recv += self.recv_msg
+
+        # replace the default radio so both directions use the large burst
+        self.radio.close()
+        self.radio = radio
+
+        radio.send(outgoing)
+
+        writer = threading.Thread(target=os.write, args=(self.master, incoming))
+        writer.start()
+
+        assert self.read_master(len(outgoing)) == outgoing
+        writer.join()
+
+        assert self.wait_for_inbox(len(incoming)) == incoming
+
+    def test_close_is_prompt(self):
+        # a frame that cannot be sent for a long time is dropped on close
+        radio = self.radio
+        radio.scheduler.tokens = -1e6
+
+        radio.send(b"never sent")
+
+        start = time.monotonic()
+        radio.close()
+
+        assert time.monotonic() - start < 1
+
+        # closing twice is harmless
+        radio.close()
+
+
+class RadioAsyncTest(PtyRadioMixin, unittest.TestCase):
+    radio_class = juliet.radio.RadioAsync
+
+
+class RadioCommPtyTest(PtyRadioMixin, unittest.TestCase):
+    radio_class = juliet.radio.RadioComm
@@ -0,0 +1,429 @@
+"""Unit test module for Juliet."""
+
+import logging
+import random
+import unittest
+
+from juliet.message import Message, TextMessage, pack_frame, split_frame
+from juliet.radio import RadioBase, RadioLoop
+from juliet.reliable import (
+    AckMessage,
+    Peer,
+    ReliableRadio,
+    RttEstimator,
+    SequencedMessage,
+    format_acks,
+    parse_acks,
+)
+
+# keep logging output to a minumim for testing
+logging.basicConfig(level=logging.FATAL)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+# a shared channel that delivers each frame to every other station (unless
+# the frame is lost); frames are delivered in order when the link is flushed
+class LossyLink:
+    def __init__(self, loss=0.0, seed=1621):
+        self.loss = loss
+        self.rand = random.Random(seed)
+        self.radios = []
+        self.queue = []
+        self.sent = []
+
+    def radio(self):
+        radio = LinkRadio(self)
+        self.radios.append(radio)
+        return radio
+
+    def flush(self):
+        while self.queue:
+            source, data = self.queue.pop(0)
+
+            for radio in self.radios:
+                if radio is not source and self.rand.random() >= self.loss:
+                    radio.on_recv(radio, data)
+
+
+class LinkRadio(RadioBase):
+    def __init__(self, link):
+        super().__init__()
+        self.link = link
+
+    def send(self, data, priority=None):
+        self.link.sent.append(data)
+        self.link.queue.append((self, data))
+        self.on_xmit(self, data)
+        return True
+
+
+def frame(text, sender="unittest"):
+    return TextMessage(text, sender=sender).pack()
+
+
+def frame_version(data):
+    return int(split_frame(data)[0], 16)
+
+
+class AckFormatTest(unittest.TestCase):
+    def test_ack_roundtrip(self):
+        acks = {"W0JHX": (12, [14, 15, 16, 20]), "KD0ABC/P": (-1, [])}
+
+        text = format_acks(acks)
+        assert text == "KD0ABC/P=-1;W0JHX=12+14-16,20"
+
+        assert parse_acks(text) == acks
+        assert parse_acks("") == {}
+
+    def test_invalid_acks(self):
+        with self.assertRaises(ValueError):
+            parse_acks("bad:name=1")
+
+        with self.assertRaises(ValueError):
+            parse_acks("W0JHX=1+0-999999999")
+
+    def test_sequenced_message(self):
+        data = frame("hello world")
+
+        msg = SequencedMessage.wrap(data, "W0JHX", 7, base=3, acks={"N0CALL": (4, [6])})
+        copy = Message.unpack(msg.pack())
+
+        assert isinstance(copy, SequencedMessage)
+        assert copy.station == "W0JHX"
+        assert copy.seq == 7
+        assert copy.base == 3
+        assert copy.acks == {"N0CALL": (4, [6])}
+        assert copy.session is None
+
+        # the original frame is rebuilt exactly
+        assert copy.unwrap() == data
+
+        msg = SequencedMessage.wrap(data, "W0JHX", 7, session="0a1b2c3d")
+        assert Message.unpack(msg.pack()).session == "0a1b2c3d"
+
+        msg = SequencedMessage.wrap(data, "W0JHX", 7, session="../x")
+        self.assertRaises(ValueError, getattr, Message.unpack(msg.pack()), "seq")
+
+    def test_ack_message(self):
+        msg = AckMessage("W0JHX", {"N0CALL": (4, [6, 7])})
+        copy = Message.unpack(msg.pack())
+
+        assert isinstance(copy, AckMessage)
+        assert copy.sender == "W0JHX"
+        assert copy.acks == {"N0CALL": (4, [6, 7])}
+
+
+class RttEstimatorTest(unittest.TestCase):
+    def test_initial_rto(self):
+        rtt = RttEstimator(initial=3)
+        assert rtt.rto == 3
+
+    def test_adapts_to_samples(self):
+        rtt = RttEstimator(initial=5, min_rto=0.1)
+
+        for _ in range(20):
+            rtt.sample(2.0)
+
+        assert abs(rtt.srtt - 2.0) < 0.01
+        assert 2.0 < rtt.rto < 3.0
+
+        # a slower link raises the timeout
+        for _ in range(20):
+            rtt.sample(6.0)
+
+        assert rtt.rto > 6.0
+
+    def test_rto_limits(self):
+        rtt = RttEstimator(min_rto=1, max_rto=10)
+
+        rtt.sample(0.01)
+        assert rtt.rto == 1
+
+        rtt.sample(100)
+        assert rtt.rto == 10
+
+
+class PeerTest(unittest.TestCase):
+    def test_in_order(self):
+        peer = Peer("W0JHX")
+
+        for seq in range(5):
+            assert peer.receive(seq, 0)
+
+        assert peer.ack() == (4, [])
+
+    def test_out_of_order(self):
+        peer = Peer("W0JHX")
+
+        assert peer.receive(0, 0)
+        assert peer.receive(2, 0)
+        assert peer.receive(4, 0)
+        assert peer.ack() == (0, [2, 4])
+
+        assert not peer.receive(2, 0)
+
+        assert peer.receive(1, 0)
+        assert peer.ack() == (2, [4])
+
+    def test_sender_gave_up(self):
+        peer = Peer("W0JHX")
+
+        assert peer.receive(0, 0)
+        assert peer.receive(3, 0)
+
+        # frames 1 and 2 will never be sent again
+        assert peer.receive(4, 3)
+        assert peer.ack() == (4, [])
+
+    def test_late_join(self):
+        peer = Peer("W0JHX")
+
+        assert peer.receive(10, 9)
+        assert peer.receive(9, 9)
+        assert peer.ack() == (10, [])
+
+
+class ReliableRadioTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.inbox = {}
+
+    def make_radio(self, link, station, **kwargs):
+        kwargs.setdefault("tick_interval", None)
+        kwargs.setdefault("clock", self.clock)
+
+        radio = ReliableRadio(link.radio(), station, **kwargs)
+
+        inbox = self.inbox.setdefault(station, [])
+        radio.on_recv += lambda radio, data: inbox.append(data)
+
+        return radio
+
+    def run_link(self, link, radios, seconds, step=0.5):
+        for _ in range(int(seconds / step)):
+            link.flush()
+
+            self.clock.advance(step)
+
+            for radio in radios:
+                radio.tick()
+
+        link.flush()
+
+    def test_radio_loop(self):
+        inbox = []
+
+        radio = ReliableRadio(RadioLoop(), "W0JHX", tick_interval=None)
+        radio.on_recv += lambda radio, data: inbox.append(data)
+
+        data = frame("hello world")
+        radio.send(data)
+
+        # the loopback delivers our own frame; nobody needs to ACK it
+        assert inbox == [data]
+        assert radio.stats()["pending"] == 0
+
+        radio.close()
+
+    def test_lossless_delivery(self):
+        link = LossyLink()
+
+        alpha = self.make_radio(link, "ALPHA", peers=["BRAVO"])
+        bravo = self.make_radio(link, "BRAVO", peers=["ALPHA"])
+
+        frames = [frame(f"message {idx}") for idx in range(5)]
+
+        for data in frames:
+            alpha.send(data)
+
+        self.run_link(link, [alpha, bravo], 5)
+
+        assert self.inbox["BRAVO"] == frames
+
+        stats = alpha.stats()
+        assert stats["acked"] == 5
+        assert stats["retransmits"] == 0
+        assert stats["pending"] == 0
+
+        # the round trip time is measured from the ACKs
+        assert stats["peers"]["BRAVO"]["srtt"] is not None
+
+    def test_lossy_delivery(self):
+        link = LossyLink(loss=0.3)
+
+        alpha = self.make_radio(link, "ALPHA", peers=["BRAVO"], max_retries=20)
+        bravo = self.make_radio(link, "BRAVO", peers=["ALPHA"])
+
+        frames = [frame(f"message {idx}") for idx in range(50)]
+
+        for data in frames:
+            alpha.send(data)
+
+        self.run_link(link, [alpha, bravo], 600)
+
+        # every frame arrives exactly once (though not always in order)
+        assert sorted(self.inbox["BRAVO"]) == sorted(frames)
+
+        stats = alpha.stats()
+        assert stats["acked"] == 50
+        assert stats["failed"] == 0
+        assert stats["retransmits"] > 0
+
+        assert bravo.stats()["duplicates"] > 0
+
+    def test_window(self):
+        link = LossyLink(loss=1.0)
+
+        alpha = self.make_radio(link, "ALPHA", peers=["BRAVO"], window=4)
+
+        for idx in range(10):
+            alpha.send(frame(f"message {idx}"))
+
+        stats = alpha.stats()
+        assert stats["pending"] == 4
+        assert stats["backlog"] == 6
+
+        assert alpha.queue_depth == 6
+
+    def test_give_up(self):
+        link = LossyLink(loss=1.0)
+
+        failed = []
+
+        alpha = self.make_radio(link, "ALPHA", peers=["BRAVO"], max_retries=2)
+        alpha.on_failed += lambda radio, data: failed.append(data)
+
+        data = frame("hello world")
+        alpha.send(data)
+
+        self.run_link(link, [alpha], 600)
+
+        assert failed == [data]
+
+        stats = alpha.stats()
+        assert stats["retransmits"] == 2
+        assert stats["failed"] == 1
+        assert stats["pending"] == 0
+
+    def test_piggyback_acks(self):
+        link = LossyLink()
+
+        alpha = self.make_radio(link, "ALPHA", peers=["BRAVO"])
+        bravo = self.make_radio(link, "BRAVO", peers=["ALPHA"], ack_delay=10)
+
+        alpha.send(frame("ping"))
+        link.flush()
+
+        # the reply carries the ACK, so no separate ACK is needed
+        bravo.send(frame("pong"))
+        link.flush()
+
+        assert alpha.stats()["pending"] == 0
+        assert bravo.stats()["acks_sent"] == 0
+
+        versions = [frame_version(data) for data in link.sent]
+        assert AckMessage.version not in versions
+
+    def test_learn_peers(self):
+        link = LossyLink()
+
+        alpha = self.make_radio(link, "ALPHA")
+        bravo = self.make_radio(link, "BRAVO")
+
+        # nobody is known yet, so the first frame is not tracked
+        alpha.send(frame("hello"))
+        assert alpha.stats()["pending"] == 0
+
+        self.run_link(link, [alpha, bravo], 5)
+
+        # once heard, BRAVO is expected to ACK new frames
+        alpha.send(frame("again"))
+        assert alpha.stats()["pending"] == 1
+
+        self.run_link(link, [alpha, bravo], 5)
+        assert alpha.stats()["pending"] == 0
+
+    def test_restart(self):
+        link = LossyLink()
+
+        alpha = self.make_radio(link, "ALPHA", peers=["BRAVO"])
+        bravo = self.make_radio(link, "BRAVO", peers=["ALPHA"])
+
+        for idx in range(5):
+            alpha.send(frame(f"before {idx}"))
+
+        self.run_link(link, [alpha, bravo], 5)
+
+        # a new instance numbers its frames from 0 again
+        link.radios.remove(alpha.radio)
+        alpha = self.make_radio(link, "ALPHA", peers=["BRAVO"])
+
+        after = [frame(f"after {idx}") for idx in range(5)]
+
+        for data in after:
+            alpha.send(data)
+
+        self.run_link(link, [alpha, bravo], 5)
+
+        assert self.inbox["BRAVO"][5:] == after
+        assert alpha.stats()["acked"] == 5
+
+    def test_forget_quiet_peers(self):
+        link = LossyLink()
+
+        alpha = self.make_radio(link, "ALPHA", peer_timeout=60)
+        bravo = self.make_radio(link, "BRAVO", peer_timeout=60)
+
+        alpha.send(frame("hello"))
+        self.run_link(link, [alpha, bravo], 5)
+
+        assert "ALPHA" in bravo.peers
+
+        self.run_link(link, [alpha, bravo], 120, step=10)
+        assert bravo.peers == {}
+
+    def test_passthrough(self):
+        link = LossyLink()
+
+        plain = link.radio()
+        self.make_radio(link, "ALPHA")
+
+        data = frame("hello world")
+        plain.send(data)
+        link.flush()
+
+        # frames from stations without the reliable layer are unchanged
+        assert self.inbox["ALPHA"] == [data]
+
+    def test_bad_content(self):
+        link = LossyLink()
+
+        plain = link.radio()
+        alpha = self.make_radio(link, "ALPHA")
+
+        version = SequencedMessage.version
+        garbled = pack_frame(version, "BRAVO", 1616164623, "xx")
+        garbled = garbled.replace(b":xx:", b":\xff\xfe:")
+
+        data = frame("hello world")
+
+        # content that is not UTF-8 or cannot be decoded does not stop the frames
+        # that follow it
+        plain.send(garbled)
+        plain.send(pack_frame(version, "BRAVO", 1616164623, "nonsense"))
+        plain.send(pack_frame(AckMessage.version, "BRAVO", 1616164623, "A:x"))
+        plain.send(data)
+        link.flush()
+
+        assert self.inbox["ALPHA"] == [data]
+        assert alpha.stats()["peers"] == {}
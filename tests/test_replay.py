@@ -0,0 +1,136 @@
+"""Unit test module for Juliet."""
+
+import contextlib
+import io
+import logging
+import os
+import tempfile
+import unittest
+
+from juliet.capture import CaptureSink, Direction
+from juliet.message import ChannelMessage, TextMessage, pack_frame
+from juliet.replay import DIRECTIONS, Replay, main
+
+# keep logging output to a minumim for testing
+logging.basicConfig(level=logging.FATAL)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1616164623.0
+
+    def __call__(self):
+        self.now += 2.0
+        return self.now
+
+
+class ReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "radio.cap")
+
+        text = TextMessage("hello world").pack()
+        channel = ChannelMessage("hello channel", channel="#cq").pack()
+        invalid = TextMessage("goodbye").pack().replace(b"goodbye", b"go0dbye")
+
+        capture = CaptureSink(self.path, clock=FakeClock())
+
+        # a frame split across two reads, with noise in between frames
+        capture.write(Direction.RECV, text[:10])
+        capture.write(Direction.RECV, text[10:] + b"$GPRMC,junk*00\r\n")
+        capture.write(Direction.RECV, channel)
+        capture.write(Direction.RECV, channel)
+        capture.write(Direction.RECV, invalid)
+        capture.write(Direction.XMIT, text)
+
+        capture.close()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_fast(self):
+        stats = Replay().run([self.path])
+
+        assert stats.files == 1
+        assert stats.records == 6
+        assert stats.replayed == 5
+        assert stats.span == 10.0
+
+        assert stats.messages == {"TextMessage": 1, "ChannelMessage": 2}
+        assert stats.invalid == 1
+        assert stats.duplicates == 0
+
+    def test_small_blocks(self):
+        # the result does not depend on how the records are joined
+        stats = Replay(block_size=1).run([self.path])
+
+        assert stats.messages == {"TextMessage": 1, "ChannelMessage": 2}
+        assert stats.invalid == 1
+
+    def test_dedup(self):
+        stats = Replay(dedup=True).run([self.path])
+
+        assert stats.messages == {"TextMessage": 1, "ChannelMessage": 1}
+        assert stats.duplicates == 1
+
+    def test_bad_content(self):
+        bad = pack_frame(ChannelMessage.version, "unittest", 1616164623, "nospace")
+
+        capture = CaptureSink(self.path, clock=FakeClock())
+        capture.write(Direction.RECV, bad)
+        capture.close()
+
+        # the frame passes the checksum, but its content cannot be decoded
+        stats = Replay().run([self.path])
+
+        assert stats.messages == {"TextMessage": 1, "ChannelMessage": 2}
+        assert stats.invalid == 2
+
+    def test_directions(self):
+        stats = Replay(DIRECTIONS["xmit"]).run([self.path])
+
+        assert stats.replayed == 1
+        assert stats.messages == {"TextMessage": 1}
+
+        stats = Replay(DIRECTIONS["all"]).run([self.path])
+        assert stats.replayed == 6
+
+    def test_paced(self):
+        delays = []
+
+        replay = Replay(speed=10, sleep=delays.append)
+        stats = replay.run([self.path])
+
+        # records were captured 2 seconds apart; at 10x, that is 0.2 seconds
+        assert len(delays) == 4
+        assert all(0 < delay <= 0.8 for delay in delays)
+        assert delays == sorted(delays)
+
+        assert stats.messages == {"TextMessage": 1, "ChannelMessage": 2}
+
+    def test_multiple_files(self):
+        stats = Replay().run([self.path, self.path])
+
+        assert stats.files == 2
+        assert stats.replayed == 10
+        assert stats.messages["ChannelMessage"] == 4
+
+    def test_main(self):
+        output = io.StringIO()
+
+        with contextlib.redirect_stdout(output):
+            assert main([self.path, "--dedup"]) == 0
+
+        report = output.getvalue()
+
+        assert "records:        6 (5 replayed)" in report
+        assert "invalid frames: 1" in report
+        assert "duplicates:     1" in report
+
+    def test_main_error(self):
+        errors = io.StringIO()
+
+        with contextlib.redirect_stderr(errors):
+            assert main([self.path + ".missing"]) == 1
+
+        assert errors.getvalue().startswith("ERROR:")
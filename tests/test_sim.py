@@ -0,0 +1,300 @@
+"""Unit test module for Juliet."""
+
+import logging
+import random
+import threading
+import unittest
+
+from juliet.message import MessageBuffer, TextMessage
+from juliet.reliable import ReliableRadio
+from juliet.sim import SimChannel, gps_sentence
+
+# keep logging output to a minumim for testing
+logging.basicConfig(level=logging.FATAL)
+
+
+class Inbox:
+    def __init__(self, radio):
+        self.chunks = []
+        self.times = []
+        self.radio = radio
+
+        radio.on_recv += self.recv
+
+    def recv(self, radio, data):
+        self.chunks.append(data)
+        self.times.append(radio.channel.clock())
+
+    @property
+    def data(self):
+        return b"".join(self.chunks)
+
+
+def frame(text, sender="unittest"):
+    return TextMessage(text, sender=sender).pack()
+
+
+class SimChannelTest(unittest.TestCase):
+    def test_baud_pacing(self):
+        channel = SimChannel(baud_rate=1200, keyup_delay=0.2, seed=1)
+
+        alpha = channel.radio("alpha")
+        bravo = Inbox(channel.radio("bravo"))
+
+        sent = []
+        alpha.on_xmit += lambda radio, data: sent.append(channel.clock())
+
+        data = bytes(120)
+        alpha.send(data)
+
+        channel.run_until_idle()
+
+        # 120 bytes at 10 bits per byte take one second after key-up
+        assert bravo.data == data
+        assert abs(bravo.times[-1] - 1.2) < 1e-9
+        assert abs(sent[0] - 1.2) < 1e-9
+
+        # the first chunk arrives as soon as its bytes have been sent
+        size = len(bravo.chunks[0])
+        assert abs(bravo.times[0] - (0.2 + size / 120)) < 1e-9
+
+    def test_xmit_rate(self):
+        # fast enough that the time on the air does not matter
+        channel = SimChannel(baud_rate=10_000_000, keyup_delay=0, seed=1)
+
+        alpha = channel.radio("alpha", xmit_rate=1000, xmit_burst=100, batch_size=100)
+        bravo = Inbox(channel.radio("bravo"))
+
+        for _ in range(20):
+            alpha.send(bytes(100))
+
+        channel.run_until_idle()
+
+        # the first 100 bytes go out at once, the rest at 1000 bytes per second
+        assert len(bravo.data) == 2000
+        assert 1.9 <= bravo.times[-1] < 2.0
+
+    def test_split_reads(self):
+        channel = SimChannel(read_size=8, seed=1)
+
+        alpha = channel.radio("alpha")
+        bravo = Inbox(channel.radio("bravo"))
+
+        data = frame("hello world" * 10)
+        alpha.send(data)
+
+        channel.run_until_idle()
+
+        assert bravo.data == data
+        assert len(bravo.chunks) > 1
+        assert max(len(chunk) for chunk in bravo.chunks) <= 8
+
+    def test_deterministic(self):
+        def run(seed):
+            channel = SimChannel(
+                bit_error_rate=0.001, burst_loss=0.1, garbage_rate=0.3, seed=seed
+            )
+
+            alpha = channel.radio("alpha")
+            bravo = Inbox(channel.radio("bravo"))
+
+            for idx in range(20):
+                alpha.send(frame(f"message {idx}"))
+
+            channel.run_until_idle()
+
+            return (bravo.chunks, bravo.times, channel.stats())
+
+        assert run(1621) == run(1621)
+        assert run(1621) != run(1622)
+
+    def test_bit_errors(self):
+        channel = SimChannel(bit_error_rate=0.01, seed=1)
+
+        alpha = channel.radio("alpha")
+        bravo = Inbox(channel.radio("bravo"))
+
+        data = bytes(1000)
+        alpha.send(data)
+
+        channel.run_until_idle()
+
+        errors = sum(bin(byte).count("1") for byte in bravo.data)
+
+        assert len(bravo.data) == len(data)
+        assert errors == channel.stats()["bit_errors"]
+        assert 40 < errors < 120
+
+    def test_burst_loss(self):
+        channel = SimChannel(burst_loss=0.2, burst_length=4, seed=1)
+
+        alpha = channel.radio("alpha", batch_size=1)
+        bravo = MessageBuffer()
+
+        received = []
+        bravo.on_message += lambda mbuf, msg: received.append(int(msg.content))
+
+        channel.radio("bravo").on_recv += lambda radio, data: bravo.append(data)
+
+        for idx in range(200):
+            alpha.send(frame(str(idx)))
+
+        channel.run_until_idle()
+
+        lost = sorted(set(range(200)) - set(received))
+
+        assert len(received) + len(lost) == 200
+        assert channel.stats()["lost"] == len(lost)
+
+        # losses come in runs rather than one at a time
+        runs = sum(1 for idx in lost if idx - 1 not in lost)
+        assert runs < len(lost) / 2
+
+    def test_collisions(self):
+        channel = SimChannel(seed=1)
+
+        alpha = channel.radio("alpha")
+        bravo = channel.radio("bravo")
+        charlie = Inbox(channel.radio("charlie"))
+
+        alpha.send(frame("from alpha"))
+        bravo.send(frame("from bravo"))
+
+        channel.run_until_idle()
+
+        assert charlie.data == b""
+        assert channel.stats()["collisions"] == 2
+
+    def test_carrier_sense(self):
+        channel = SimChannel(carrier_sense=True, seed=1)
+
+        alpha = channel.radio("alpha")
+        bravo = channel.radio("bravo")
+        charlie = Inbox(channel.radio("charlie"))
+
+        alpha.send(frame("from alpha"))
+        bravo.send(frame("from bravo"))
+
+        channel.run_until_idle()
+
+        assert charlie.data == frame("from alpha") + frame("from bravo")
+        assert channel.stats()["collisions"] == 0
+
+    def test_half_duplex(self):
+        channel = SimChannel(carrier_sense=False, seed=1)
+
+        alpha = Inbox(channel.radio("alpha"))
+        bravo = Inbox(channel.radio("bravo"))
+
+        alpha.radio.send(bytes(100))
+        channel.run(0.5)
+
+        # bravo keys up while alpha is still sending
+        bravo.radio.send(bytes(10))
+        channel.run_until_idle()
+
+        assert alpha.data == b""
+        assert channel.stats()["lost"] >= 1
+
+    def test_gps_garbage(self):
+        channel = SimChannel(garbage_rate=1, seed=7)
+
+        alpha = channel.radio("alpha", batch_size=1)
+        bravo = Inbox(channel.radio("bravo"))
+
+        msgbuf = MessageBuffer()
+        received = []
+
+        msgbuf.on_message += lambda mbuf, msg: received.append(msg.content)
+        bravo.radio.on_recv += lambda radio, data: msgbuf.append(data)
+
+        texts = [f"message {idx}" for idx in range(20)]
+
+        for text in texts:
+            alpha.send(frame(text))
+
+        channel.run_until_idle()
+
+        assert channel.stats()["garbage"] == 20
+        assert b"$GPRMC" in bravo.data or b"$$CRC" in bravo.data
+
+        # noise between frames is ignored; noise inside a frame breaks it
+        assert 0 < len(received) < 20
+        assert set(received) <= set(texts)
+
+    def test_gps_sentence(self):
+        rand = random.Random(1)
+
+        for _ in range(10):
+            sentence = gps_sentence(rand)
+
+            assert sentence.startswith(b"$")
+            assert sentence.endswith(b"\r\n")
+
+    def test_reliable_delivery(self):
+        channel = SimChannel(
+            burst_loss=0.1, burst_length=3, carrier_sense=True, seed=1621
+        )
+
+        def reliable(name, peer):
+            radio = ReliableRadio(
+                channel.radio(name),
+                name,
+                peers=[peer],
+                max_retries=20,
+                tick_interval=None,
+                clock=channel.clock,
+            )
+
+            def tick():
+                radio.tick()
+                channel.schedule(0.5, tick)
+
+            channel.schedule(0.5, tick)
+
+            return radio
+
+        alpha = reliable("ALPHA", "BRAVO")
+        bravo = reliable("BRAVO", "ALPHA")
+
+        received = []
+        bravo.on_recv += lambda radio, data: received.append(data)
+
+        frames = [frame(f"message {idx}") for idx in range(30)]
+
+        for data in frames:
+            alpha.send(data)
+
+        channel.run(900)
+
+        assert sorted(received) == sorted(frames)
+        assert alpha.stats()["failed"] == 0
+        assert alpha.stats()["pending"] == 0
+
+
+class RealtimeChannelTest(unittest.TestCase):
+    def test_realtime(self):
+        channel = SimChannel(baud_rate=9600, keyup_delay=0.05, realtime=True, seed=1)
+
+        alpha = channel.radio("alpha")
+        bravo = channel.radio("bravo")
+
+        received = []
+        done = threading.Event()
+
+        def recv(radio, data):
+            received.append(data)
+
+            if len(b"".join(received)) >= 96:
+                done.set()
+
+        bravo.on_recv += recv
+
+        alpha.send(bytes(96))
+
+        # 96 bytes at 9600 baud take 0.1 seconds after key-up
+        assert done.wait(5)
+        assert b"".join(received) == bytes(96)
+        assert channel.clock() >= 0.15
+
+        channel.close()
@@ -0,0 +1,65 @@
+"""Unit test module for Juliet."""
+
+import logging
+import unittest
+
+from juliet.message import MessageBuffer
+from juliet.trace import Dump, hexdump
+
+# keep logging output to a minumim for testing
+logging.basicConfig(level=logging.FATAL)
+
+
+class HexdumpTest(unittest.TestCase):
+    def test_short(self):
+        assert hexdump(b">>0:") == "3e 3e 30 3a |>>0:|"
+
+    def test_unprintable(self):
+        assert hexdump(b"a\r\n\xff") == "61 0d 0a ff |a...|"
+
+    def test_limit(self):
+        text = hexdump(b"x" * 1000, limit=4)
+        assert text == "78 78 78 78 |xxxx| +996 bytes"
+
+    def test_none(self):
+        assert hexdump(None) == "None"
+
+    def test_bytearray(self):
+        assert hexdump(bytearray(b"ok")) == "6f 6b |ok|"
+
+    def test_dump(self):
+        dump = Dump(b"hello world", limit=5)
+        assert str(dump) == "68 65 6c 6c 6f |hello| +6 bytes"
+
+
+class CountingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__(level=logging.DEBUG)
+        self.sizes = []
+
+    def emit(self, record):
+        self.sizes.append(len(record.getMessage()))
+
+
+class BoundedLoggingTest(unittest.TestCase):
+    def test_large_buffer(self):
+        handler = CountingHandler()
+        logger = logging.getLogger("juliet.message")
+
+        logger.addHandler(handler)
+        logger.setLevel(logging.DEBUG)
+
+        try:
+            msgbuf = MessageBuffer()
+            msgbuf.append(b">>0:FFFF:unittest:20210319143703:")
+
+            for _ in range(10):
+                msgbuf.append(b"x" * 100 * 1024)
+
+        finally:
+            logger.removeHandler(handler)
+            logger.setLevel(logging.NOTSET)
+
+        # debug messages never include the contents of the buffer
+        assert handler.sizes
+        assert max(handler.sizes) < 200
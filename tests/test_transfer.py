@@ -0,0 +1,480 @@
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from juliet.dedup import DedupCache
+from juliet.message import FileMessage, Message, MessageBuffer
+from juliet.metrics import MetricsRegistry
+from juliet.transfer import (
+    FragmentMessage,
+    Reassembler,
+    ReceivedFile,
+    ResendMessage,
+    TransferSender,
+    format_ranges,
+    make_fragments,
+    parse_ranges,
+)
+
+# keep logging output to a minumim for testing
+logging.basicConfig(level=logging.FATAL)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+def random_text(rand, length):
+    return "".join(rand.choice("abcdef:<>|\n0123456789 ") for _ in range(length))
+
+
+def transmit(msg):
+    return Message.unpack(msg.pack())
+
+
+class RangesTest(unittest.TestCase):
+    def test_format_ranges(self):
+        assert format_ranges([]) == ""
+        assert format_ranges([4]) == "4"
+        assert format_ranges([7, 1, 2, 3, 9, 10]) == "1-3,7,9-10"
+
+    def test_parse_ranges(self):
+        assert parse_ranges("") == []
+        assert parse_ranges("1-3,7,9-10") == [1, 2, 3, 7, 9, 10]
+
+        with self.assertRaises(ValueError):
+            parse_ranges("5-2")
+
+        with self.assertRaises(ValueError):
+            parse_ranges("-1")
+
+
+class TransferTest(unittest.TestCase):
+    def setUp(self):
+        self.rand = random.Random(73)
+        self.clock = FakeClock()
+        self.content = random_text(self.rand, 20000)
+
+    def test_fragment_round_trip(self):
+        frags = make_fragments(self.content, filename="notes.txt", sender="W0JHX")
+        assert len(frags) > 1
+
+        copy = transmit(frags[0])
+
+        assert isinstance(copy, FragmentMessage)
+        assert copy.transfer_id == frags[0].transfer_id
+        assert copy.index == 0
+        assert copy.total == len(frags)
+        assert copy.filename == "notes.txt"
+        assert copy.mimetype == "text/plain"
+        assert copy.content == frags[0].content
+
+    def test_reassemble_out_of_order(self):
+        frags = make_fragments(self.content, filename="notes.txt", sender="W0JHX")
+        self.rand.shuffle(frags)
+
+        reasm = Reassembler(clock=self.clock)
+        result = None
+
+        for frag in frags:
+            assert result is None
+            result = reasm.add(transmit(frag))
+
+        assert isinstance(result, FileMessage)
+        assert result.content == self.content
+        assert result.filename == "notes.txt"
+        assert result.sender == "W0JHX"
+
+        assert reasm.buffered == 0
+        assert len(reasm.transfers) == 0
+
+    def test_corrupt_fragment(self):
+        frags = make_fragments(self.content, sender="W0JHX", chunk_size=64)
+
+        inbox = []
+        msgbuf = MessageBuffer()
+        msgbuf.on_message += lambda mbuf, msg: inbox.append(msg)
+
+        for idx, frag in enumerate(frags):
+            data = bytearray(frag.pack())
+
+            # flip a bit in the content of one fragment
+            if idx == 3:
+                data[-10] ^= 0x01
+
+            msgbuf.append(bytes(data))
+
+        # only the damaged fragment is lost...
+        assert len(inbox) == len(frags) - 1
+        assert 3 not in [msg.index for msg in inbox]
+
+    def test_dedup_fragments(self):
+        content = random_text(self.rand, 100000)
+        frags = make_fragments(content, sender="W0JHX", chunk_size=64)
+
+        # the fragments share a header, other than their 16 bit checksums
+        assert len(frags) > 1000
+        assert len({frag.epoch for frag in frags}) == 1
+
+        reasm = Reassembler(clock=self.clock)
+        results = []
+
+        msgbuf = MessageBuffer(dedup=DedupCache())
+        msgbuf.on_message += lambda mbuf, msg: results.append(reasm.add(msg))
+
+        for frag in frags:
+            msgbuf.append(frag.pack())
+
+        # no fragment is mistaken for a copy of another
+        assert results[-1].content == content
+        assert len(results) == len(frags)
+
+    def test_selective_resend(self):
+        sender = TransferSender()
+        frags = sender.fragment(self.content, filename="notes.txt", sender="W0JHX")
+
+        lost = {1, 5, 6, len(frags) - 1}
+
+        reasm = Reassembler(retry_interval=30, clock=self.clock)
+
+        for frag in frags:
+            if frag.index not in lost:
+                assert reasm.add(transmit(frag)) is None
+
+        # no requests until the transfer stalls
+        assert reasm.resend_requests() == []
+
+        self.clock.advance(31)
+        requests = reasm.resend_requests(sender="KD0ABC")
+
+        assert len(requests) == 1
+        request = transmit(requests[0])
+
+        assert isinstance(request, ResendMessage)
+        assert request.missing == sorted(lost)
+
+        # requests are not repeated immediately
+        assert reasm.resend_requests() == []
+
+        result = None
+
+        for frag in sender.resend(request):
+            result = reasm.add(transmit(frag))
+
+        assert result.content == self.content
+
+    def test_duplicate_fragments(self):
+        frags = make_fragments(self.content, sender="W0JHX")
+        reasm = Reassembler(clock=self.clock)
+
+        reasm.add(transmit(frags[0]))
+        buffered = reasm.buffered
+
+        reasm.add(transmit(frags[0]))
+        assert reasm.buffered == buffered
+
+    def test_transfer_timeout(self):
+        frags = make_fragments(self.content, sender="W0JHX")
+        reasm = Reassembler(timeout=60, clock=self.clock)
+
+        reasm.add(transmit(frags[0]))
+
+        self.clock.advance(30)
+        assert reasm.expire() == []
+
+        self.clock.advance(31)
+        assert reasm.expire() == [frags[0].transfer_id]
+        assert reasm.buffered == 0
+
+    def test_buffer_budget(self):
+        first = make_fragments(self.content, sender="W0JHX")
+        second = make_fragments(self.content, sender="W0JHX")
+
+        reasm = Reassembler(max_buffer=1000, clock=self.clock)
+
+        for frag in first[:3]:
+            reasm.add(transmit(frag))
+
+        self.clock.advance(1)
+
+        for frag in second[:3]:
+            reasm.add(transmit(frag))
+
+        # the older transfer is dropped to make room
+        keys = [key[1] for key in reasm.transfers]
+
+        assert keys == [second[0].transfer_id]
+        assert reasm.buffered <= 1000
+
+    def test_sender_cache(self):
+        sender = TransferSender(max_transfers=2)
+
+        ids = [sender.fragment(f"hello {idx}")[0].transfer_id for idx in range(3)]
+
+        assert ids[0] not in sender.transfers
+        assert sender.resend(ResendMessage(ids[0], [0])) == []
+        assert len(sender.resend(ResendMessage(ids[2], [0]))) == 1
+
+
+# stream a large, generated file through the transfer code and report the peak
+# RSS of the process; the file is never written to disk by the sender
+RSS_SCRIPT = """
+import resource, sys, tempfile
+
+from juliet.message import Message
+from juliet.transfer import Reassembler, stream_fragments
+
+class Source:
+    def __init__(self, size):
+        self.remaining = size
+        self.line = 0
+
+    def read(self, size):
+        lines = []
+        length = 0
+
+        while length < min(size, self.remaining):
+            line = b"%08d lorem ipsum dolor sit amet consectetur\\n" % self.line
+            lines.append(line)
+            length += len(line)
+            self.line += 1
+
+        data = b"".join(lines)[: self.remaining]
+        self.remaining -= len(data)
+        return data
+
+size = int(sys.argv[1])
+
+with tempfile.TemporaryDirectory() as tmpdir:
+    reasm = Reassembler(download_dir=tmpdir, max_file_size=None)
+    result = None
+
+    for frag in stream_fragments(Source(size), "0a1b2c3d", "big.txt", chunk_size=4096):
+        result = reasm.add(Message.unpack(frag.pack()))
+
+    assert result.size == size, result.size
+
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+class StreamTransferTest(unittest.TestCase):
+    def setUp(self):
+        self.rand = random.Random(1621)
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+        self.source = os.path.join(self.tmpdir.name, "source.bin")
+        self.downloads = os.path.join(self.tmpdir.name, "downloads")
+        os.mkdir(self.downloads)
+
+        # a mix of compressible and random data
+        with open(self.source, "wb") as fp:
+            for idx in range(200):
+                fp.write(b"line %d of the test file\n" % idx)
+                fp.write(self.rand.randbytes(self.rand.randrange(2000)))
+
+        with open(self.source, "rb") as fp:
+            self.content = fp.read()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_stream_to_disk(self):
+        sender = TransferSender()
+        frags = list(sender.stream(self.source, sender="W0JHX", chunk_size=512))
+
+        assert all(frag.total == 0 for frag in frags[:-1])
+        assert frags[-1].total == len(frags)
+        assert frags[0].filename == "source.bin"
+
+        reasm = Reassembler(download_dir=self.downloads)
+        self.rand.shuffle(frags)
+
+        result = None
+
+        for frag in frags:
+            assert result is None
+            result = reasm.add(transmit(frag))
+
+        assert isinstance(result, ReceivedFile)
+        assert result.path == os.path.join(self.downloads, "source.bin")
+        assert result.size == len(self.content)
+
+        with open(result.path, "rb") as fp:
+            assert fp.read() == self.content
+
+        # no partial files are left behind
+        assert os.listdir(self.downloads) == ["source.bin"]
+
+    def test_stream_no_overwrite(self):
+        sender = TransferSender()
+        reasm = Reassembler(download_dir=self.downloads)
+
+        for _ in range(2):
+            for frag in sender.stream(self.source):
+                result = reasm.add(transmit(frag))
+
+        assert result.path == os.path.join(self.downloads, "source-1.bin")
+
+    def test_stream_resend(self):
+        sender = TransferSender()
+        frags = list(sender.stream(self.source, sender="W0JHX", chunk_size=512))
+
+        clock = FakeClock()
+        reasm = Reassembler(download_dir=self.downloads, clock=clock)
+
+        # lose a fragment in the middle and the last one (with the total)
+        lost = {3, len(frags) - 1}
+
+        for frag in frags:
+            if frag.index not in lost:
+                assert reasm.add(transmit(frag)) is None
+
+        clock.advance(60)
+        request = transmit(reasm.resend_requests()[0])
+
+        assert request.missing == [3, len(frags) - 1]
+
+        result = None
+
+        for frag in sender.resend(request):
+            result = reasm.add(transmit(frag))
+
+        assert result.size == len(self.content)
+
+    def test_stream_unknown_total(self):
+        sender = TransferSender()
+        frags = list(sender.stream(self.source, sender="W0JHX", chunk_size=512))
+
+        clock = FakeClock()
+        reasm = Reassembler(download_dir=self.downloads, clock=clock)
+
+        # lose the last two fragments; the receiver cannot know the total
+        for frag in frags[:-2]:
+            reasm.add(transmit(frag))
+
+        clock.advance(60)
+        request = transmit(reasm.resend_requests()[0])
+
+        assert request.missing == [len(frags) - 2]
+
+        resent = sender.resend(request)
+        assert [frag.index for frag in resent] == [len(frags) - 2]
+
+        reasm.add(transmit(resent[0]))
+
+        # the next request reaches past the end and finds the total
+        clock.advance(60)
+        request = transmit(reasm.resend_requests()[0])
+
+        resent = sender.resend(request)
+        assert resent[-1].total == len(frags)
+
+        result = reasm.add(transmit(resent[-1]))
+        assert result.size == len(self.content)
+
+    def test_transfer_id_traversal(self):
+        frag = FragmentMessage("aGVsbG8=", "../escaped", 0, 2, sender="W0JHX")
+        request = ResendMessage("../escaped", [0], sender="W0JHX")
+
+        for msg in (frag, request):
+            self.assertRaises(ValueError, getattr, transmit(msg), "transfer_id")
+
+        metrics = MetricsRegistry()
+        msgbuf = MessageBuffer(metrics=metrics)
+
+        reasm = Reassembler(download_dir=self.downloads)
+        msgbuf.on_message += lambda mbuf, msg: reasm.add(msg)
+
+        good = make_fragments(
+            "hello world", sender="W0JHX", chunk_size=8, transfer_id="0a1b2c3d"
+        )
+        msgbuf.append(frag.pack() + good[0].pack())
+
+        # the bad frame is dropped and nothing is written outside downloads
+        snap = metrics.snapshot()
+        assert snap["buffer_invalid_frames"] == {(): 1}
+        assert snap["buffer_frames"] == {(): 1}
+        assert not os.path.exists(os.path.join(self.tmpdir.name, "escaped.part"))
+        (partial,) = os.listdir(self.downloads)
+        assert partial.startswith("W0JHX-0a1b2c3d-")
+
+    def test_same_transfer_id(self):
+        sender = TransferSender()
+        reasm = Reassembler(download_dir=self.downloads)
+
+        # two stations that happen to pick the same id
+        first = list(sender.stream(self.source, sender="W0JHX", chunk_size=512))
+        other = make_fragments(
+            "a different file", sender="KD0ABC", transfer_id=first[0].transfer_id
+        )
+
+        for frag in first[:-1]:
+            assert reasm.add(transmit(frag)) is None
+
+        received = reasm.add(transmit(other[0]))
+
+        with open(received.path, "rb") as fp:
+            assert fp.read() == b"a different file"
+
+        result = reasm.add(transmit(first[-1]))
+
+        with open(result.path, "rb") as fp:
+            assert fp.read() == self.content
+
+    def test_max_file_size(self):
+        sender = TransferSender()
+        frags = list(sender.stream(self.source, chunk_size=512))
+
+        limit = len(self.content) // 2
+        reasm = Reassembler(download_dir=self.downloads, max_file_size=limit)
+
+        for frag in frags:
+            assert reasm.add(transmit(frag)) is None
+
+            # the transfer is dropped once it passes the limit
+            for name in os.listdir(self.downloads):
+                path = os.path.join(self.downloads, name)
+                assert os.path.getsize(path) <= limit
+
+    def test_expire_removes_partial_file(self):
+        sender = TransferSender()
+        frags = list(sender.stream(self.source, chunk_size=512))
+
+        clock = FakeClock()
+        reasm = Reassembler(download_dir=self.downloads, timeout=60, clock=clock)
+
+        reasm.add(transmit(frags[0]))
+        assert len(os.listdir(self.downloads)) == 1
+
+        clock.advance(61)
+        reasm.expire()
+
+        assert os.listdir(self.downloads) == []
+
+    @unittest.skipIf(sys.platform != "linux", "RSS measurement requires Linux")
+    def test_stream_memory(self):
+        size = 100 * 1024 * 1024
+
+        result = subprocess.run(
+            [sys.executable, "-c", RSS_SCRIPT, str(size)],
+            capture_output=True,
+            check=True,
+            text=True,
+        )
+
+        # ru_maxrss is reported in KiB on Linux
+        peak = int(result.stdout.strip()) * 1024
+
+        assert peak < 64 * 1024 * 1024, peak
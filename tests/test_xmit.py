@@ -0,0 +1,255 @@
+import queue
+import threading
+import time
+import unittest
+
+from juliet.xmit import (
+    Priority,
+    TokenBucket,
+    TransmitQueue,
+    baud_to_rate,
+    collect_batch,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class TokenBucketTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_baud_rate(self):
+        assert baud_to_rate(9600) == 960
+
+    def test_initial_burst(self):
+        bucket = TokenBucket(100, burst=500, clock=self.clock)
+
+        assert bucket.delay(500) == 0
+
+        bucket.consume(500)
+        assert bucket.delay(100) == 1.0
+
+    def test_refill_rate(self):
+        bucket = TokenBucket(100, burst=500, clock=self.clock)
+        bucket.consume(500)
+
+        self.clock.advance(0.5)
+        assert bucket.delay(50) == 0
+        assert bucket.delay(100) == 0.5
+
+        # the bucket never fills past the burst size
+        self.clock.advance(60)
+        assert bucket.delay(500) == 0
+        assert bucket.tokens == 500
+
+    def test_oversized_frame(self):
+        bucket = TokenBucket(100, burst=500, clock=self.clock)
+
+        # a full bucket allows a large frame, but the debt must be repaid
+        assert bucket.delay(2000) == 0
+        bucket.consume(2000)
+
+        assert bucket.delay(100) == 16.0
+
+    def test_frame_gap(self):
+        bucket = TokenBucket(1000, burst=500, gap=0.25, clock=self.clock)
+
+        assert bucket.delay(10) == 0
+        bucket.consume(10)
+
+        assert bucket.delay(10) == 0.25
+
+        self.clock.advance(0.1)
+        assert abs(bucket.delay(10) - 0.15) < 1e-9
+
+        self.clock.advance(0.15)
+        assert bucket.delay(10) == 0
+
+    def test_drain_time(self):
+        bucket = TokenBucket(100, burst=200, gap=0.5, clock=self.clock)
+
+        assert bucket.drain_time(0, 0) == 0
+        assert bucket.drain_time(700, 2) == 5.0
+        assert bucket.drain_time(100, 10) == 4.5
+
+    def test_invalid_settings(self):
+        with self.assertRaises(ValueError):
+            TokenBucket(0)
+
+        with self.assertRaises(ValueError):
+            TokenBucket(100, burst=0)
+
+
+class CollectBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.queue = queue.Queue()
+
+    def test_single_frame(self):
+        frames, extra = collect_batch(self.queue, b"hello")
+
+        assert frames == [b"hello"]
+        assert extra is None
+
+    def test_queued_frames(self):
+        for data in (b"two", b"three", b"four"):
+            self.queue.put(data)
+
+        frames, extra = collect_batch(self.queue, b"one", max_size=100)
+
+        assert frames == [b"one", b"two", b"three", b"four"]
+        assert extra is None
+        assert self.queue.empty()
+
+    def test_max_size(self):
+        for data in (b"2222", b"3333", b"4444"):
+            self.queue.put(data)
+
+        frames, extra = collect_batch(self.queue, b"1111", max_size=10)
+
+        assert frames == [b"1111", b"2222"]
+        assert extra == b"3333"
+        assert self.queue.get() == b"4444"
+
+    def test_batch_window(self):
+        def delayed_put():
+            time.sleep(0.05)
+            self.queue.put(b"late")
+
+        thread = threading.Thread(target=delayed_put)
+        thread.start()
+
+        frames, extra = collect_batch(self.queue, b"early", window=0.5)
+        thread.join()
+
+        assert frames == [b"early", b"late"]
+
+    def test_shutdown_marker(self):
+        self.queue.put(b"two")
+        self.queue.put(None)
+        self.queue.put(b"three")
+
+        frames, extra = collect_batch(self.queue, b"one", max_size=100)
+
+        assert frames == [b"one", b"two"]
+        assert extra is None
+
+        # the marker must still reach the worker
+        assert self.queue.get() == b"three"
+        assert self.queue.get() is None
+
+
+class TransmitQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.queue = TransmitQueue()
+
+    def drain(self):
+        frames = []
+
+        while not self.queue.empty():
+            frames.append(self.queue.get_nowait())
+
+        return frames
+
+    def test_empty_queue(self):
+        assert self.queue.empty()
+
+        with self.assertRaises(queue.Empty):
+            self.queue.get_nowait()
+
+        with self.assertRaises(queue.Empty):
+            self.queue.get(timeout=0.01)
+
+    def test_single_lane_order(self):
+        for idx in range(10):
+            self.queue.put(b"frame %d" % idx, Priority.BULK)
+
+        assert self.drain() == [b"frame %d" % idx for idx in range(10)]
+
+    def test_control_first(self):
+        self.queue.put(b"bulk", Priority.BULK)
+        self.queue.put(b"chat", Priority.CHANNEL)
+        self.queue.put(b"ctrl", Priority.CONTROL)
+
+        assert self.drain() == [b"ctrl", b"chat", b"bulk"]
+
+    def test_bulk_not_starved(self):
+        for _ in range(100):
+            self.queue.put(b"x" * 100, Priority.CHANNEL)
+
+        for _ in range(10):
+            self.queue.put(b"y" * 100, Priority.BULK)
+
+        frames = self.drain()
+
+        # bulk traffic gets roughly one third of the channel share...
+        first_bulk = frames.index(b"y" * 100)
+        assert first_bulk < 5
+
+        bulk_in_first_30 = frames[:30].count(b"y" * 100)
+        assert 5 <= bulk_in_first_30 <= 15
+
+    def test_weighted_share(self):
+        for _ in range(200):
+            self.queue.put(b"d" * 64, Priority.DIRECT)
+            self.queue.put(b"c" * 64, Priority.CHANNEL)
+
+        frames = [self.queue.get_nowait() for _ in range(120)]
+
+        direct = frames.count(b"d" * 64)
+        channel = frames.count(b"c" * 64)
+
+        assert direct == 2 * channel
+
+    def test_large_frames(self):
+        # frames larger than the quantum are sent after a few rounds
+        self.queue.put(b"z" * 4096, Priority.BULK)
+        self.queue.put(b"small", Priority.CHANNEL)
+
+        assert self.drain() == [b"small", b"z" * 4096]
+
+    def test_shutdown_marker(self):
+        self.queue.put(b"chat")
+        self.queue.put(None)
+
+        assert self.queue.get() is None
+        assert self.queue.get() == b"chat"
+
+    def test_blocking_get(self):
+        def delayed_put():
+            time.sleep(0.05)
+            self.queue.put(b"hello", Priority.DIRECT)
+
+        thread = threading.Thread(target=delayed_put)
+        thread.start()
+
+        assert self.queue.get(timeout=5) == b"hello"
+        thread.join()
+
+    def test_wait_stats(self):
+        clock = FakeClock()
+        xmit = TransmitQueue(clock=clock)
+
+        xmit.put(b"hello", Priority.DIRECT)
+        xmit.put(b"world", Priority.DIRECT)
+        clock.advance(2)
+
+        xmit.get()
+        clock.advance(1)
+        xmit.get()
+
+        stats = xmit.stats()["direct"]
+
+        assert stats["frames"] == 2
+        assert stats["bytes"] == 10
+        assert stats["avg_wait"] == 2.5
+        assert stats["max_wait"] == 3
+        assert stats["depth"] == 0